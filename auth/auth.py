@@ -1,73 +1,201 @@
 import logging
-import json
+import hashlib
+import hmac
 from datetime import datetime, timezone
-from flask import session
+from flask import g, request, session
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
+from werkzeug.exceptions import TooManyRequests
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from config import Config, SETTINGS_PATH
+from config import Config
+from auth.token_cache import TokenCache
+from auth.last_used import LastUsedRecorder
+from auth.rate_limit import RateLimiter, TokenLimits
+from auth.store import StoreError, get_store
+from monitoring.logs import SAMPLED
+from monitoring.metrics import RATE_LIMITED, count_request_body, request_body_length, timed_verification
 
 # --- API Authentication (X-API-Token Header) ---
 # This tells flask-httpauth to look for the token in the 'X-API-Token' header
 # and to not expect a scheme like 'Bearer'.
 api_auth = HTTPTokenAuth(header='X-API-Token')
 
+# API tokens are high-entropy random values, so they are stored under a keyed
+# SHA-256 fingerprint instead of a salted KDF hash. Verifying a token is then a
+# single HMAC plus a dictionary lookup. Entries created before this format are
+# still accepted and are migrated to the new format on their first use.
+API_TOKEN_HASH_PREFIX = "hmac-sha256$"
+
+# Verified tokens are cached by fingerprint with their rate limits, so repeat
+# requests skip the store lookup (and, for legacy entries, the KDF scan).
+# configure_auth() applies the settings and attaches the Redis client, which
+# enables the shared tier and cross-worker revocation.
+token_cache = TokenCache()
+
+# 'last_used' timestamps are buffered and written to the credential store in
+# batches; configure_auth() starts the background flusher.
+last_used_recorder = LastUsedRecorder()
+
+# Per-token rate limits and daily byte quotas, counted in Redis so they hold
+# across workers and containers; configure_auth() attaches the Redis client.
+rate_limiter = RateLimiter()
+
+def configure_auth(redis_client):
+    """Apply the settings to the token cache, rate limiter and 'last_used' recorder (called by create_app)."""
+    token_cache.max_entries = Config.TOKEN_CACHE_MAX_ENTRIES
+    token_cache.ttl = Config.TOKEN_CACHE_TTL
+    token_cache.shared = Config.TOKEN_CACHE_SHARED
+    token_cache.attach_redis(redis_client)
+    rate_limiter.attach_redis(redis_client)
+    # Tokens deleted by another worker leave this worker's cache even if the
+    # Redis revocation broadcast was missed; a broadcast makes the store look
+    # for the change at once.
+    store = get_store()
+    store.on_change(token_cache.clear)
+    token_cache.on_revocation(lambda fingerprint: store.check_for_changes(force=True))
+    last_used_recorder.flush_interval = Config.LAST_USED_FLUSH_INTERVAL
+    last_used_recorder.start()
+
+def revoke_api_token(stored_hash):
+    """Evict a deleted or replaced token from the caches of every worker."""
+    token_cache.invalidate(stored_hash)
+
+def _api_token_key():
+    """Returns the key used for API token fingerprints."""
+    key = Config.API_TOKEN_KEY or Config.SECRET_KEY
+    return key.get_secret_value().encode('utf-8')
+
 def hash_api_token(token):
-    """Generates a hash for an API token for secure storage."""
-    return generate_password_hash(token)
+    """Generates the keyed fingerprint under which an API token is stored."""
+    digest = hmac.new(_api_token_key(), token.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"{API_TOKEN_HASH_PREFIX}{digest}"
+
+def is_legacy_token_hash(stored_hash):
+    """Returns True if the stored hash is a werkzeug (salted KDF) token hash."""
+    return not stored_hash.startswith(API_TOKEN_HASH_PREFIX)
+
+def migrate_legacy_token(stored_hash, fingerprint):
+    """Re-key a verified legacy token entry under its new fingerprint in the credential store."""
+    try:
+        token_data = get_store().rekey_token(stored_hash, fingerprint)
+    except StoreError as e:
+        logging.error("Failed to migrate legacy API token: %s", e)
+        return
+    logging.info("Migrated legacy API token to fingerprint format: %s", token_data.description if token_data else stored_hash[:15])
+
+def _find_legacy_token(token, fingerprint):
+    """Scan the remaining werkzeug-hashed tokens and migrate the one that matches."""
+    legacy_tokens = [
+        (stored_hash, token_data)
+        for stored_hash, token_data in get_store().tokens().items()
+        if is_legacy_token_hash(stored_hash)
+    ]
+    for stored_hash, token_data in legacy_tokens:
+        logging.debug("Comparing with legacy hash: %s... for desc: '%s'", stored_hash[:15], token_data.description)
+        if check_password_hash(stored_hash, token):
+            migrate_legacy_token(stored_hash, fingerprint)
+            return token_data
+    return None
 
 @api_auth.verify_token
+@timed_verification('token')
 def verify_api_token(token):
     """
     Verify an API token from the X-API-Token header.
-    The incoming token is hashed and compared against stored hashed tokens.
-    If valid, the 'last_used' timestamp is updated.
+    The incoming token is fingerprinted and looked up in the verified-token
+    cache, then among the stored tokens, falling back to a scan of any legacy
+    werkzeug-hashed tokens.
+    If valid, the 'last_used' timestamp is updated and the token's rate limit
+    and daily byte quota are applied (429 Too Many Requests when exceeded).
     Returns the description of the token if valid, otherwise None.
     """
-    logging.debug(f"--- Verifying API Token ---")
-    logging.debug(f"Incoming raw token: {token[:8]}...")
-    for stored_hash, token_data in Config.API_TOKENS.items():
-        logging.debug(f"Comparing with stored hash: {stored_hash[:15]}... for desc: '{token_data.description}'")
-        is_match = check_password_hash(stored_hash, token)
-        logging.debug(f"Result of check_password_hash: {is_match}")
-        if is_match:
-            # Token is valid, update last_used timestamp
-            now_utc = datetime.now(timezone.utc).isoformat()
-            
-            # Update in-memory config first
-            token_data.last_used = now_utc
-            
-            # Asynchronously update the settings.json file
-            try:
-                with open(SETTINGS_PATH, 'r+') as f:
-                    settings_data = json.load(f)
-                    if stored_hash in settings_data['API_TOKENS']:
-                        settings_data['API_TOKENS'][stored_hash]['last_used'] = now_utc
-                        f.seek(0)
-                        json.dump(settings_data, f, indent=4)
-                        f.truncate()
-            except (IOError, json.JSONDecodeError) as e:
-                logging.error(f"Failed to update last_used for token: {e}")
-
-            logging.info(f"API access by token: {token_data.description}")
-            return token_data.description # Return the description for the current user context
-
-    logging.warning(f"❌ Invalid API token provided: {token[:8]}...") # Log only a truncated token
-    return None
+    if not token:
+        return None
+    logging.debug("--- Verifying API Token ---")
+    logging.debug("Incoming raw token: %s...", token[:8])
+
+    fingerprint = hash_api_token(token)
+    store = get_store()
+    store.check_for_changes()
+    cached = token_cache.get(fingerprint)
+    if cached is None:
+        token_data = store.get_token(fingerprint)
+        if token_data is None:
+            token_data = _find_legacy_token(token, fingerprint)
+
+        if token_data is None:
+            logging.warning("❌ Invalid API token provided: %s...", token[:8]) # Log only a truncated token
+            return None
+
+        cached = token_cache.set(fingerprint, token_data.description, token_limits(token_data))
+
+    description, limits = cached
+    last_used_recorder.record(fingerprint, datetime.now(timezone.utc).isoformat())
+    _enforce_rate_limit(fingerprint, description, limits)
+
+    logging.info("API access by token: %s", description, extra=SAMPLED)
+    return description # Return the description for the current user context
+
+def token_limits(token_data):
+    """The limits for a token: its own settings, falling back to the global defaults."""
+    def pick(value, default):
+        return default if value is None else value
+
+    return TokenLimits(
+        requests_per_minute=pick(token_data and token_data.rate_limit_per_minute, Config.RATE_LIMIT_PER_MINUTE),
+        burst=pick(token_data and token_data.rate_limit_burst, Config.RATE_LIMIT_BURST),
+        daily_bytes=pick(token_data and token_data.daily_byte_quota, Config.DAILY_BYTE_QUOTA),
+    )
+
+def _enforce_rate_limit(fingerprint, description, limits):
+    """
+    Count the request against the token's limits; raises TooManyRequests when one
+    is exceeded. A body without a Content-Length (chunked) is counted as it is
+    read and charged to the quota by settle_request_quota once the request ends.
+    """
+    if not limits.requests_per_minute and not limits.daily_bytes:
+        return
+    counter = count_request_body(request.environ)
+    decision = rate_limiter.check(fingerprint, limits, request_body_length(request.environ))
+    if decision.allowed:
+        if counter is not None:
+            g.quota_charge = (fingerprint, counter)
+        return
+
+    RATE_LIMITED.labels(decision.reason).inc()
+    if decision.reason == 'quota':
+        logging.warning("Daily byte quota exceeded for token: %s (%s bytes used)", description, decision.bytes_today)
+        message = f'Daily upload quota of {limits.daily_bytes} bytes exceeded for this token.'
+    else:
+        logging.warning("Rate limit exceeded for token: %s", description)
+        message = f'Rate limit of {limits.requests_per_minute} requests per minute exceeded for this token.'
+    raise TooManyRequests(message, retry_after=decision.retry_after)
+
+def settle_request_quota(exc=None):
+    """
+    Charge the bytes read from a request body without a Content-Length to the
+    token's daily quota (registered as a teardown_request hook by create_app).
+    The endpoints read request bodies before they return their response.
+    """
+    charge = g.pop('quota_charge', None)
+    if charge is not None:
+        fingerprint, counter = charge
+        rate_limiter.charge(fingerprint, counter.bytes_read)
 
 # --- Admin UI Authentication (Basic Auth) ---
 admin_auth = HTTPBasicAuth()
 
 @admin_auth.verify_password
+@timed_verification('basic')
 def verify_admin_password(username, password):
     """
     Verify admin credentials for the web UI.
     """
-    expected_password = Config.ADMIN_CREDENTIALS.get(username)
-    logging.debug(f"DEBUG: verify_admin_password - username: {username}")
+    expected_password = get_store().admin_password(username)
+    logging.debug("DEBUG: verify_admin_password - username: %s", username)
     
     if not expected_password:
-        logging.warning(f"❌ Invalid admin login attempt for non-existent user: {username}")
+        logging.warning("❌ Invalid admin login attempt for non-existent user: %s", username)
         return None
 
     is_valid = False
@@ -82,7 +210,7 @@ def verify_admin_password(username, password):
         session['admin_user'] = username
         return username
 
-    logging.warning(f"❌ Invalid admin password for user: {username}")
+    logging.warning("❌ Invalid admin password for user: %s", username)
     return None
 
 # --- Password Hashing Utility ---
@@ -0,0 +1,63 @@
+import atexit
+import logging
+import threading
+
+from auth.store import StoreError, get_store
+
+
+class LastUsedRecorder:
+    """
+    Write-behind buffer for API token 'last_used' timestamps.
+
+    Successful authentications only record the timestamp in memory. A background
+    thread flushes the coalesced updates to the credential store every
+    `flush_interval` seconds (and once more at shutdown), so the request path
+    never writes to it.
+    """
+
+    def __init__(self, flush_interval=30):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, fingerprint, timestamp):
+        """Remember the latest use of a token."""
+        with self._lock:
+            self._pending[fingerprint] = timestamp
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def flush(self):
+        """Write all pending timestamps to the credential store in a single update."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        try:
+            get_store().record_last_used(pending)
+        except StoreError as e:
+            logging.error("Failed to flush last_used timestamps for %s token(s): %s", len(pending), e)
+            # Put them back so the next flush retries, keeping any newer values
+            with self._lock:
+                for fingerprint, timestamp in pending.items():
+                    if self._pending.get(fingerprint, '') < timestamp:
+                        self._pending[fingerprint] = timestamp
+
+    def start(self):
+        """Start the background flusher and flush once more at interpreter exit."""
+        if self._thread is not None or self.flush_interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="last-used-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
@@ -0,0 +1,141 @@
+import logging
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+# Redis key prefixes for the request token buckets and the daily byte counters.
+BUCKET_KEY_PREFIX = "api_toolbox:ratelimit:"
+QUOTA_KEY_PREFIX = "api_toolbox:quota:"
+
+# Limits that apply to one token. None means unlimited.
+TokenLimits = namedtuple('TokenLimits', ['requests_per_minute', 'burst', 'daily_bytes'])
+
+# Outcome of a check: `allowed`, which limit rejected the request ('rate' or
+# 'quota'), the seconds after which a retry can succeed and the bytes used today.
+Decision = namedtuple('Decision', ['allowed', 'reason', 'retry_after', 'bytes_today'])
+
+# Checks the daily byte quota and takes one request from the token bucket, both
+# or neither. The bucket is refilled continuously at `rate` requests per second
+# up to `burst`, using the Redis server clock so every container agrees.
+# KEYS: bucket, quota counter. ARGV: rate (req/s, 0 = unlimited), burst,
+# request bytes, daily quota (0 = unlimited), seconds until the quota resets.
+# Returns {allowed (0/1), reason, retry_after, bytes_today}.
+CHECK_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local quota = tonumber(ARGV[4])
+local quota_ttl = tonumber(ARGV[5])
+
+local used = tonumber(redis.call('GET', KEYS[2]) or '0')
+if quota > 0 and used + cost > quota then
+    return {0, 'quota', quota_ttl, used}
+end
+
+if rate > 0 then
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    if tokens < 1 then
+        return {0, 'rate', math.ceil((1 - tokens) / rate), used}
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - 1), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+end
+
+if cost > 0 then
+    used = redis.call('INCRBY', KEYS[2], cost)
+    redis.call('EXPIRE', KEYS[2], quota_ttl + 3600)
+end
+return {1, 'ok', 0, used}
+"""
+
+
+def seconds_until_utc_midnight(now=None):
+    now = now or datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(1, math.ceil((midnight - now).total_seconds()))
+
+
+class RateLimiter:
+    """
+    Per-token request rate limits (token bucket) and daily request byte quotas,
+    kept in Redis so they hold across workers and containers.
+
+    Without a Redis client, or when Redis fails, requests are let through.
+    """
+
+    def __init__(self):
+        self._redis = None
+        self._script = None
+
+    def attach_redis(self, redis_client):
+        self._redis = redis_client
+        self._script = redis_client.register_script(CHECK_SCRIPT)
+
+    def check(self, fingerprint, limits, request_bytes):
+        """Count one request of `request_bytes` against the token's limits; returns a Decision."""
+        unlimited = Decision(True, 'ok', 0, None)
+        if self._redis is None or (not limits.requests_per_minute and not limits.daily_bytes):
+            return unlimited
+
+        rate = limits.requests_per_minute / 60 if limits.requests_per_minute else 0
+        burst = limits.burst or limits.requests_per_minute or 0
+        try:
+            allowed, reason, retry_after, used = self._script(
+                keys=[BUCKET_KEY_PREFIX + fingerprint, self._quota_key(fingerprint)],
+                args=[rate, burst, request_bytes, limits.daily_bytes or 0, seconds_until_utc_midnight()],
+            )
+        except Exception as e:
+            logging.warning("Rate limit check failed, allowing the request: %s", e)
+            return unlimited
+        reason = reason.decode('ascii') if isinstance(reason, bytes) else reason
+        return Decision(bool(allowed), reason, int(retry_after), int(used))
+
+    def charge(self, fingerprint, request_bytes):
+        """
+        Add `request_bytes` to today's quota counter of a token, for a body whose
+        size was unknown when the request was checked. Once the counter is over
+        the quota, the token's following requests are rejected.
+        """
+        if self._redis is None or not request_bytes:
+            return
+        key = self._quota_key(fingerprint)
+        try:
+            pipe = self._redis.pipeline()
+            pipe.incrby(key, request_bytes)
+            pipe.expire(key, seconds_until_utc_midnight() + 3600)
+            pipe.execute()
+        except Exception as e:
+            logging.warning("Could not count %s request bytes against the daily quota: %s", request_bytes, e)
+
+    def usage(self, fingerprints):
+        """Return {fingerprint: {'requests_available', 'bytes_today'}} for the admin token list."""
+        if self._redis is None or not fingerprints:
+            return {}
+        try:
+            pipe = self._redis.pipeline()
+            for fingerprint in fingerprints:
+                pipe.hget(BUCKET_KEY_PREFIX + fingerprint, 'tokens')
+                pipe.get(self._quota_key(fingerprint))
+            values = pipe.execute()
+        except Exception as e:
+            logging.warning("Could not read rate limit usage: %s", e)
+            return {}
+
+        usage = {}
+        for index, fingerprint in enumerate(fingerprints):
+            tokens, bytes_today = values[2 * index], values[2 * index + 1]
+            usage[fingerprint] = {
+                # Tokens as of the last request; the bucket refills in between
+                'requests_available': math.floor(float(tokens)) if tokens is not None else None,
+                'bytes_today': int(bytes_today or 0),
+            }
+        return usage
+
+    @staticmethod
+    def _quota_key(fingerprint):
+        return f"{QUOTA_KEY_PREFIX}{datetime.now(timezone.utc):%Y%m%d}:{fingerprint}"
@@ -0,0 +1,529 @@
+"""
+Storage for API tokens and admin credentials.
+
+CREDENTIAL_STORE selects the backend:
+  json    API_TOKENS and ADMIN_CREDENTIALS in settings.json (the default).
+          Every change rewrites the file; workers notice it from the file's
+          stat and read it again. Rewrites that only moved 'last_used'
+          timestamps do not count as changes.
+  sqlite  A SQLite database in WAL mode (CREDENTIAL_DB_PATH), one row per
+          token or admin account. Lookups use the primary key, every change
+          updates only its own rows, and a revision counter bumped by each
+          change lets workers detect changes with a one-row read. An empty
+          database is filled from settings.json on first start.
+
+Both backends run `on_change` callbacks when another worker changed the data
+(checked at most every CHANGE_CHECK_INTERVAL seconds), which is used to drop
+cached token verifications.
+
+The data can be exported to and imported from JSON in the settings.json format:
+
+    python -m auth.store export --output credentials.json
+    python -m auth.store import credentials.json [--replace]
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from pydantic import ValidationError
+
+from config import SETTINGS_PATH, ApiToken, Config, ConfigurationError, update_settings
+
+# Seconds between two checks for changes made by other workers
+CHANGE_CHECK_INTERVAL = 1.0
+
+TOKEN_FIELDS = tuple(ApiToken.model_fields)
+
+
+class StoreError(Exception):
+    """The credential store could not be read or written."""
+
+
+class CredentialStore:
+    """
+    Interface of the API token and admin credential stores. Tokens are keyed
+    by their stored hash (fingerprint) and returned as ApiToken objects.
+    """
+
+    def __init__(self):
+        self._revision = None
+        self._checked_at = None
+        self._check_lock = threading.Lock()
+        self._change_callbacks = []
+
+    # --- Change detection ---
+
+    def revision(self):
+        """A cheap value that changes whenever tokens or credentials change."""
+        raise NotImplementedError
+
+    def on_change(self, callback):
+        """Register a callback invoked when a change by another process is detected."""
+        self._change_callbacks.append(callback)
+
+    def check_for_changes(self, force=False):
+        """
+        Compare the revision (at most every CHANGE_CHECK_INTERVAL seconds unless
+        `force`d); returns True if it moved.
+        """
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < CHANGE_CHECK_INTERVAL:
+            return False
+        with self._check_lock:
+            if not force and self._checked_at is not None and now - self._checked_at < CHANGE_CHECK_INTERVAL:
+                return False
+            self._checked_at = now
+            try:
+                revision = self.revision()
+            except StoreError as e:
+                logging.warning("Could not check the credential store for changes: %s", e)
+                return False
+            changed = self._revision is not None and revision != self._revision
+            self._revision = revision
+            if changed:
+                changed = self._reload()
+        if changed:
+            for callback in self._change_callbacks:
+                callback()
+        return changed
+
+    def _reload(self):
+        """
+        Refresh in-memory state after the revision moved; returns False if
+        nothing that affects verification changed.
+        """
+        return True
+
+    # --- API tokens ---
+
+    def tokens(self):
+        """All tokens as a dict of fingerprint -> ApiToken."""
+        raise NotImplementedError
+
+    def get_token(self, fingerprint):
+        """The ApiToken stored under `fingerprint`, or None."""
+        raise NotImplementedError
+
+    def add_token(self, fingerprint, token_data):
+        """Store a new token; returns False if its description is already in use."""
+        raise NotImplementedError
+
+    def delete_token(self, fingerprint):
+        """Delete a token; returns False if it did not exist."""
+        raise NotImplementedError
+
+    def rekey_token(self, fingerprint, new_fingerprint):
+        """Move a token to a new fingerprint; returns its ApiToken, or None if it did not exist."""
+        raise NotImplementedError
+
+    def record_last_used(self, timestamps):
+        """Set 'last_used' for many tokens at once (fingerprint -> ISO-8601 UTC timestamp), never moving it back."""
+        raise NotImplementedError
+
+    # --- Admin credentials ---
+
+    def admin_credentials(self):
+        """All admin accounts as a dict of username -> password hash."""
+        raise NotImplementedError
+
+    def admin_password(self, username):
+        """The password hash of an admin account, or None."""
+        return self.admin_credentials().get(username)
+
+    def set_admin_password(self, username, password_hash):
+        raise NotImplementedError
+
+    # --- Import / export ---
+
+    def export_data(self):
+        """Tokens and credentials in the settings.json format."""
+        return {
+            'ADMIN_CREDENTIALS': self.admin_credentials(),
+            'API_TOKENS': {fingerprint: token_data.model_dump() for fingerprint, token_data in self.tokens().items()},
+        }
+
+    def import_data(self, data, replace=False):
+        """
+        Add (or overwrite) the tokens and credentials of `data`, a dict in the
+        settings.json format. With `replace`, entries missing from `data` are
+        deleted. Returns the number of tokens and of admin accounts imported.
+        """
+        raise NotImplementedError
+
+
+def parse_import_data(data):
+    """Validate the API_TOKENS and ADMIN_CREDENTIALS sections of settings.json-style data."""
+    try:
+        tokens = {fingerprint: ApiToken(**token_data) for fingerprint, token_data in data.get('API_TOKENS', {}).items()}
+    except (TypeError, ValidationError) as e:
+        raise StoreError(f"Invalid API_TOKENS: {e}") from e
+    credentials = data.get('ADMIN_CREDENTIALS', {})
+    if not all(isinstance(value, str) for value in credentials.values()):
+        raise StoreError("Invalid ADMIN_CREDENTIALS: passwords must be strings")
+    return tokens, credentials
+
+
+def _credential_state(tokens, credentials):
+    """Tokens and credentials without 'last_used', which does not affect verification."""
+    return {fingerprint: token_data.model_dump(exclude={'last_used'}) for fingerprint, token_data in tokens.items()}, credentials
+
+
+class JsonSettingsStore(CredentialStore):
+    """
+    Tokens and credentials in settings.json, held in memory in Config. Changes
+    go through update_settings (file lock, atomic rewrite); the file's inode,
+    size and modification time serve as the revision. When it moves the file
+    is read again, but only changes to tokens or credentials other than
+    'last_used' (which every flush rewrites) are reported as changes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Read the file again after taking its revision so no change is missed
+        self._revision = self.revision()
+        self._reload()
+
+    def revision(self):
+        try:
+            stat = os.stat(SETTINGS_PATH)
+        except OSError as e:
+            raise StoreError(str(e)) from e
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _reload(self):
+        try:
+            with open(SETTINGS_PATH, 'r') as f:
+                tokens, credentials = parse_import_data(json.load(f))
+        except (OSError, json.JSONDecodeError, StoreError) as e:
+            logging.error("Could not reload tokens from %s, keeping the loaded ones: %s", SETTINGS_PATH, e)
+            return False
+        changed = (_credential_state(tokens, credentials)
+                   != _credential_state(Config.API_TOKENS, Config.ADMIN_CREDENTIALS))
+        Config.API_TOKENS = tokens
+        Config.ADMIN_CREDENTIALS = credentials
+        return changed
+
+    def _update(self, mutate):
+        try:
+            return update_settings(mutate)
+        except (OSError, json.JSONDecodeError) as e:
+            raise StoreError(str(e)) from e
+
+    def tokens(self):
+        self.check_for_changes()
+        return dict(Config.API_TOKENS)
+
+    def get_token(self, fingerprint):
+        self.check_for_changes()
+        return Config.API_TOKENS.get(fingerprint)
+
+    def add_token(self, fingerprint, token_data):
+        def add(settings_data):
+            tokens = settings_data['API_TOKENS']
+            if any(entry.get('description') == token_data.description for entry in tokens.values()):
+                return False
+            tokens[fingerprint] = token_data.model_dump()
+            return True
+
+        if not self._update(add):
+            return False
+        Config.API_TOKENS[fingerprint] = token_data
+        return True
+
+    def delete_token(self, fingerprint):
+        def remove(settings_data):
+            return settings_data['API_TOKENS'].pop(fingerprint, None) is not None
+
+        deleted = self._update(remove)
+        Config.API_TOKENS.pop(fingerprint, None)
+        return deleted
+
+    def rekey_token(self, fingerprint, new_fingerprint):
+        def rekey(settings_data):
+            tokens = settings_data['API_TOKENS']
+            if fingerprint not in tokens:
+                return None
+            tokens[new_fingerprint] = tokens.pop(fingerprint)
+            return ApiToken(**tokens[new_fingerprint])
+
+        token_data = self._update(rekey)
+        Config.API_TOKENS.pop(fingerprint, None)
+        if token_data is not None:
+            Config.API_TOKENS[new_fingerprint] = token_data
+        return token_data
+
+    def record_last_used(self, timestamps):
+        def apply(settings_data):
+            tokens = settings_data.get('API_TOKENS', {})
+            for fingerprint, timestamp in timestamps.items():
+                entry = tokens.get(fingerprint)
+                # ISO-8601 UTC timestamps compare correctly as strings
+                if entry is not None and (entry.get('last_used') or '') < timestamp:
+                    entry['last_used'] = timestamp
+
+        self._update(apply)
+        for fingerprint, timestamp in timestamps.items():
+            token_data = Config.API_TOKENS.get(fingerprint)
+            if token_data is not None and (token_data.last_used or '') < timestamp:
+                token_data.last_used = timestamp
+
+    def admin_credentials(self):
+        self.check_for_changes()
+        return dict(Config.ADMIN_CREDENTIALS)
+
+    def set_admin_password(self, username, password_hash):
+        def set_password(settings_data):
+            settings_data['ADMIN_CREDENTIALS'][username] = password_hash
+
+        self._update(set_password)
+        Config.ADMIN_CREDENTIALS[username] = password_hash
+
+    def import_data(self, data, replace=False):
+        tokens, credentials = parse_import_data(data)
+
+        def merge(settings_data):
+            if replace:
+                settings_data['API_TOKENS'] = {}
+                settings_data['ADMIN_CREDENTIALS'] = {}
+            settings_data['API_TOKENS'].update(
+                (fingerprint, token_data.model_dump()) for fingerprint, token_data in tokens.items())
+            settings_data['ADMIN_CREDENTIALS'].update(credentials)
+
+        self._update(merge)
+        self._reload()
+        return len(tokens), len(credentials)
+
+
+class SqliteStore(CredentialStore):
+    """
+    Tokens and credentials in a SQLite database in WAL mode, so readers in all
+    workers never block on a writer. Each thread uses its own connection.
+    Writes run in short IMMEDIATE transactions and bump the `revision` row of
+    store_meta, except for 'last_used' updates, which do not affect
+    verification.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS api_tokens (
+            fingerprint TEXT PRIMARY KEY,
+            description TEXT NOT NULL,
+            last_used TEXT,
+            rate_limit_per_minute INTEGER,
+            rate_limit_burst INTEGER,
+            daily_byte_quota INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS api_tokens_description ON api_tokens (description);
+        CREATE TABLE IF NOT EXISTS admin_credentials (
+            username TEXT PRIMARY KEY,
+            password_hash TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS store_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO store_meta (key, value) VALUES ('revision', 0);
+    """
+
+    def __init__(self, path, busy_timeout=5.0):
+        super().__init__()
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            connection = self._connection()
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(self.SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            raise StoreError(f"Could not open credential database {path}: {e}") from e
+        self._revision = self.revision()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit mode; writes open their transactions explicitly
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _read(self, sql, params=()):
+        try:
+            return self._connection().execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            raise StoreError(str(e)) from e
+
+    def _write(self, apply, bump_revision=True):
+        """Run `apply(connection)` in an IMMEDIATE transaction and return its result."""
+        connection = self._connection()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = apply(connection)
+                if bump_revision:
+                    connection.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'revision'")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return result
+        except sqlite3.Error as e:
+            raise StoreError(str(e)) from e
+
+    @staticmethod
+    def _token(row):
+        return ApiToken(**dict(zip(TOKEN_FIELDS, row)))
+
+    def revision(self):
+        return self._read("SELECT value FROM store_meta WHERE key = 'revision'")[0][0]
+
+    def is_empty(self):
+        return not self._read("SELECT 1 FROM admin_credentials UNION ALL SELECT 1 FROM api_tokens LIMIT 1")
+
+    def tokens(self):
+        rows = self._read(f"SELECT fingerprint, {', '.join(TOKEN_FIELDS)} FROM api_tokens")
+        return {row[0]: self._token(row[1:]) for row in rows}
+
+    def get_token(self, fingerprint):
+        rows = self._read(f"SELECT {', '.join(TOKEN_FIELDS)} FROM api_tokens WHERE fingerprint = ?", (fingerprint,))
+        return self._token(rows[0]) if rows else None
+
+    @staticmethod
+    def _insert_token(connection, fingerprint, token_data):
+        values = token_data.model_dump()
+        connection.execute(
+            f"INSERT OR REPLACE INTO api_tokens (fingerprint, {', '.join(TOKEN_FIELDS)}) "
+            f"VALUES (?{', ?' * len(TOKEN_FIELDS)})",
+            (fingerprint, *(values[field] for field in TOKEN_FIELDS)),
+        )
+
+    def add_token(self, fingerprint, token_data):
+        def add(connection):
+            if connection.execute("SELECT 1 FROM api_tokens WHERE description = ?", (token_data.description,)).fetchone():
+                return False
+            self._insert_token(connection, fingerprint, token_data)
+            return True
+
+        return self._write(add)
+
+    def delete_token(self, fingerprint):
+        return self._write(
+            lambda connection: connection.execute("DELETE FROM api_tokens WHERE fingerprint = ?", (fingerprint,)).rowcount > 0)
+
+    def rekey_token(self, fingerprint, new_fingerprint):
+        def rekey(connection):
+            cursor = connection.execute(
+                "UPDATE api_tokens SET fingerprint = ? WHERE fingerprint = ?", (new_fingerprint, fingerprint))
+            if not cursor.rowcount:
+                return None
+            row = connection.execute(
+                f"SELECT {', '.join(TOKEN_FIELDS)} FROM api_tokens WHERE fingerprint = ?", (new_fingerprint,)).fetchone()
+            return self._token(row)
+
+        return self._write(rekey)
+
+    def record_last_used(self, timestamps):
+        self._write(lambda connection: connection.executemany(
+            "UPDATE api_tokens SET last_used = ?1 WHERE fingerprint = ?2 AND (last_used IS NULL OR last_used < ?1)",
+            [(timestamp, fingerprint) for fingerprint, timestamp in timestamps.items()],
+        ), bump_revision=False)
+
+    def admin_credentials(self):
+        return dict(self._read("SELECT username, password_hash FROM admin_credentials"))
+
+    def admin_password(self, username):
+        rows = self._read("SELECT password_hash FROM admin_credentials WHERE username = ?", (username,))
+        return rows[0][0] if rows else None
+
+    def set_admin_password(self, username, password_hash):
+        self._write(lambda connection: connection.execute(
+            "INSERT OR REPLACE INTO admin_credentials (username, password_hash) VALUES (?, ?)", (username, password_hash)))
+
+    def import_data(self, data, replace=False):
+        tokens, credentials = parse_import_data(data)
+
+        def load(connection):
+            if replace:
+                connection.execute("DELETE FROM api_tokens")
+                connection.execute("DELETE FROM admin_credentials")
+            for fingerprint, token_data in tokens.items():
+                self._insert_token(connection, fingerprint, token_data)
+            connection.executemany(
+                "INSERT OR REPLACE INTO admin_credentials (username, password_hash) VALUES (?, ?)", credentials.items())
+
+        self._write(load)
+        return len(tokens), len(credentials)
+
+
+def default_db_path():
+    """credentials.db next to settings.json, so it lives on the same volume."""
+    return os.path.join(os.path.dirname(os.path.abspath(SETTINGS_PATH)), 'credentials.db')
+
+def open_store():
+    """Create the store selected by CREDENTIAL_STORE."""
+    if Config.CREDENTIAL_STORE != 'sqlite':
+        return JsonSettingsStore()
+
+    store = SqliteStore(Config.CREDENTIAL_DB_PATH or default_db_path())
+    if store.is_empty():
+        tokens, credentials = store.import_data({
+            'API_TOKENS': {fingerprint: token_data.model_dump() for fingerprint, token_data in Config.API_TOKENS.items()},
+            'ADMIN_CREDENTIALS': Config.ADMIN_CREDENTIALS,
+        })
+        logging.info("Imported %s API token(s) and %s admin account(s) from %s into %s.",
+                     tokens, credentials, SETTINGS_PATH, store.path)
+    return store
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """The process-wide credential store, created on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = open_store()
+    return _store
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv(".env")
+    parser = argparse.ArgumentParser(description="Export or import API tokens and admin credentials.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='Write the tokens and credentials as JSON')
+    export_parser.add_argument('--output', help='File to write (default: stdout)')
+    import_parser = commands.add_parser('import', help='Load tokens and credentials from a JSON file (settings.json format)')
+    import_parser.add_argument('file')
+    import_parser.add_argument('--replace', action='store_true', help='Delete entries that are not in the file')
+    args = parser.parse_args()
+
+    try:
+        store = get_store()
+        if args.command == 'export':
+            data = json.dumps(store.export_data(), indent=4)
+            if args.output:
+                with open(args.output, 'w') as f:
+                    f.write(data + '\n')
+            else:
+                print(data)
+        else:
+            with open(args.file, 'r') as f:
+                data = json.load(f)
+            tokens, credentials = store.import_data(data, replace=args.replace)
+            print(f"Imported {tokens} API token(s) and {credentials} admin account(s).")
+    except (StoreError, ConfigurationError, OSError, json.JSONDecodeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
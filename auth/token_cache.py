@@ -0,0 +1,139 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from auth.rate_limit import TokenLimits
+
+# Redis key prefix for the shared tier and the channel used to broadcast revocations.
+SHARED_KEY_PREFIX = "api_toolbox:token:"
+REVOCATION_CHANNEL = "api_toolbox:token-revocations"
+
+# A verified token: its description and the rate limits that apply to it
+CachedToken = namedtuple('CachedToken', ['description', 'limits'])
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified API token fingerprints -> CachedToken
+    (description and limits), so a cache hit needs no credential store lookup.
+
+    Entries expire after `ttl` seconds. When a Redis client is attached the cache
+    also uses Redis as an optional shared tier, and listens on a pub/sub channel so
+    a revocation in one worker evicts the token in every worker immediately.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300, shared=False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._listener = None
+        self._revocation_callbacks = []
+
+    def get(self, fingerprint):
+        """Return the CachedToken for a fingerprint, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                token, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(fingerprint)
+                    return token
+                del self._entries[fingerprint]
+
+        if self.shared and self._redis is not None:
+            try:
+                value = self._redis.get(SHARED_KEY_PREFIX + fingerprint)
+            except Exception as e:
+                logging.warning("Shared token cache lookup failed: %s", e)
+                return None
+            if value is not None:
+                try:
+                    shared = json.loads(value)
+                    token = CachedToken(shared['description'], TokenLimits(*shared['limits']))
+                except (ValueError, KeyError, TypeError):
+                    # Written by an older version; verify the token again
+                    return None
+                self._store_local(fingerprint, token)
+                return token
+        return None
+
+    def set(self, fingerprint, description, limits):
+        """Cache a verified token with the TokenLimits that apply to it; returns the CachedToken."""
+        token = CachedToken(description, limits)
+        self._store_local(fingerprint, token)
+        if self.shared and self._redis is not None:
+            try:
+                value = json.dumps({'description': description, 'limits': list(limits)})
+                self._redis.setex(SHARED_KEY_PREFIX + fingerprint, self.ttl, value)
+            except Exception as e:
+                logging.warning("Shared token cache update failed: %s", e)
+        return token
+
+    def invalidate(self, fingerprint):
+        """Evict a token locally, from the shared tier and in all other workers."""
+        self._evict_local(fingerprint)
+        if self._redis is None:
+            return
+        try:
+            self._redis.delete(SHARED_KEY_PREFIX + fingerprint)
+            self._redis.publish(REVOCATION_CHANNEL, fingerprint)
+        except Exception as e:
+            logging.error("Failed to broadcast token revocation, other workers rely on TTL expiry: %s", e)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def on_revocation(self, callback):
+        """Register a callback invoked with the fingerprint of every revoked token."""
+        self._revocation_callbacks.append(callback)
+
+    def attach_redis(self, redis_client):
+        """Use `redis_client` for the shared tier and start the revocation listener."""
+        self._redis = redis_client
+        if self._listener is None:
+            self._listener = threading.Thread(
+                target=self._listen_for_revocations, name="token-cache-revocations", daemon=True
+            )
+            self._listener.start()
+
+    def _store_local(self, fingerprint, token):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[fingerprint] = (token, expires_at)
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _evict_local(self, fingerprint):
+        with self._lock:
+            self._entries.pop(fingerprint, None)
+        for callback in self._revocation_callbacks:
+            callback(fingerprint)
+
+    def _listen_for_revocations(self):
+        backoff = 1
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REVOCATION_CHANNEL)
+                # Revocations may have been missed while disconnected.
+                self.clear()
+                backoff = 1
+                for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    fingerprint = message['data']
+                    if isinstance(fingerprint, bytes):
+                        fingerprint = fingerprint.decode('utf-8')
+                    self._evict_local(fingerprint)
+            except Exception as e:
+                logging.warning("Token revocation listener disconnected, retrying in %ss: %s", backoff, e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
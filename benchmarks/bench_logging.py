@@ -0,0 +1,106 @@
+"""
+Benchmark the logging cost on the request thread.
+
+Simulates the log lines of one authenticated API request (two DEBUG lines that
+are filtered out at INFO level and two INFO lines) and compares the previous
+setup, where f-strings were formatted eagerly and a RotatingFileHandler wrote on
+the calling thread, with the queued setup from monitoring/logs.py.
+
+    python -m benchmarks.bench_logging --requests 20000
+"""
+import argparse
+import logging
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+if __package__ in (None, ''):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monitoring.logs import (  # noqa: E402
+    SAMPLED, TEXT_FORMAT, DeferredFormatQueueHandler, InfoSampler, JsonFormatter, LogWriter,
+)
+
+TOKEN = 'q8Zk3vT0c5mYyWbL0h2n4r6t8v0x2z4b6d8f0h2j4l6'
+DESCRIPTION = 'Integration ERP'
+FILENAME = 'invoice_2024_0001.pdf'
+
+
+def eager_request(logger):
+    """The per-request log lines as they were written before (f-strings)."""
+    logger.debug(f"--- Verifying API Token ---")
+    logger.debug(f"Incoming raw token: {TOKEN[:8]}...")
+    logger.info(f"API access by token: {DESCRIPTION}")
+    logger.info(f"Successfully encoded file: {FILENAME}.")
+
+
+def lazy_request(logger):
+    """The same lines with lazy %-formatting; INFO lines subject to sampling."""
+    logger.debug("--- Verifying API Token ---")
+    logger.debug("Incoming raw token: %s...", TOKEN[:8])
+    logger.info("API access by token: %s", DESCRIPTION, extra=SAMPLED)
+    logger.info("Successfully encoded file: %s.", FILENAME, extra=SAMPLED)
+
+
+def run(name, work_dir, requests, queued, emit, json_format=False, sample_rate=1.0):
+    """Log `requests` simulated requests; return (caller seconds, seconds until written)."""
+    logger = logging.getLogger(f'bench.{name}')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    file_handler = RotatingFileHandler(os.path.join(work_dir, f'{name}.log'), maxBytes=10 * 1024 * 1024, backupCount=5)
+    file_handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+    listener = None
+    if queued:
+        handler = DeferredFormatQueueHandler(queue.SimpleQueue())
+        handler.addFilter(InfoSampler(sample_rate))
+        listener = LogWriter(handler.queue, file_handler, respect_handler_level=True)
+        listener.start()
+    else:
+        handler = file_handler
+    logger.addHandler(handler)
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        emit(logger)
+    caller = time.perf_counter() - started
+    if listener:
+        listener.stop()
+    written = time.perf_counter() - started
+
+    logger.removeHandler(handler)
+    file_handler.close()
+    return caller, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_logging_')
+    try:
+        modes = [
+            ('before: eager f-strings, file handler', dict(queued=False, emit=eager_request)),
+            ('queued, lazy, text', dict(queued=True, emit=lazy_request)),
+            ('queued, lazy, json', dict(queued=True, emit=lazy_request, json_format=True)),
+            ('queued, lazy, text, 10% INFO sampling', dict(queued=True, emit=lazy_request, sample_rate=0.1)),
+        ]
+        baseline = None
+        print(f"{'mode':42} {'request thread':>16} {'until written':>15}")
+        for index, (label, options) in enumerate(modes):
+            caller, written = run(f'mode{index}', work_dir, args.requests, **options)
+            per_request = caller / args.requests * 1e6
+            baseline = baseline or per_request
+            print(f"{label:42} {per_request:>10.1f} us/req {written / args.requests * 1e6:>8.1f} us/req"
+                  f"  ({per_request / baseline:.0%} of before)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
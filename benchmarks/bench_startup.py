@@ -0,0 +1,106 @@
+"""
+Benchmark the cold start of the application.
+
+Each run starts a fresh interpreter that imports `main`, creates the app, and
+serves a first /health request and then a first /csv2xls conversion (which loads
+openpyxl) through the Flask test client. Redis is replaced by fakeredis, which
+is imported before the clock starts, so the import of the redis package is not
+included. The median of every phase over all runs is reported, plus which heavy
+modules were loaded after create_app() to check that they are loaded lazily.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+if __package__ in (None, ''):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import environment  # noqa: E402
+
+PHASES = (
+    ('import_ms', 'import main'),
+    ('create_app_ms', 'create_app()'),
+    ('first_health_ms', 'first GET /health'),
+    ('first_csv2xls_ms', 'first POST /csv2xls'),
+)
+
+# Heavy dependencies whose presence after create_app() is reported
+WATCHED_MODULES = ('openpyxl', 'services.xlsx_writer', 'services.xlsx_reader')
+
+CSV_BODY = b'id;name;amount\n' + b''.join(b'%d;row %d;%d.50\n' % (i, i, i) for i in range(100))
+
+
+def measure():
+    """Run in the child interpreter: time the startup phases and return them."""
+    work_dir = environment.prepare_settings()
+    try:
+        environment.use_fake_redis()
+
+        result = {}
+        started = time.perf_counter()
+        import main
+        result['import_ms'] = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        app = main.create_app()
+        result['create_app_ms'] = (time.perf_counter() - started) * 1000
+        result['loaded_after_create_app'] = [name for name in WATCHED_MODULES if name in sys.modules]
+
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.get('/health')
+        result['first_health_ms'] = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f'/health returned {response.status_code}')
+
+        token = environment.issue_api_token(client)
+        started = time.perf_counter()
+        response = client.post('/csv2xls', headers={'X-API-Token': token},
+                               data={'file': (io.BytesIO(CSV_BODY), 'startup.csv')},
+                               content_type='multipart/form-data')
+        response.get_data()
+        result['first_csv2xls_ms'] = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f'/csv2xls returned {response.status_code}')
+        return result
+    finally:
+        environment.cleanup_settings(work_dir)
+
+
+def run_child():
+    """Start a fresh interpreter running `measure` and return its result."""
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_startup', '--child'],
+        cwd=environment.REPO_ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure()))
+        return
+
+    results = [run_child() for _ in range(args.runs)]
+    print(f"{'phase':22} {'median':>10} {'min':>10} {'max':>10}")
+    for key, label in PHASES:
+        values = [result[key] for result in results]
+        print(f"{label:22} {statistics.median(values):>7.1f} ms {min(values):>7.1f} ms {max(values):>7.1f} ms")
+    loaded = results[0]['loaded_after_create_app']
+    print(f"loaded after create_app(): {', '.join(loaded) if loaded else 'none of ' + ', '.join(WATCHED_MODULES)}")
+
+
+if __name__ == '__main__':
+    main()
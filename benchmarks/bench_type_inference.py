@@ -0,0 +1,63 @@
+"""
+Benchmark the cost of infer_types on csv2xls conversions.
+
+Converts a synthetic CSV (integer, decimal, date, boolean and text columns) with
+and without type inference and reports the relative overhead.
+
+    python -m benchmarks.bench_type_inference --rows 100000
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+if __package__ in (None, ''):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import environment  # noqa: E402
+from benchmarks.data import synthetic_csv  # noqa: E402
+from services.csv_types import TypeInference  # noqa: E402
+
+
+def convert(data, type_inference):
+    """Convert `data` to a saved workbook and return the elapsed seconds."""
+    # Imported after prepare_settings(): config takes SETTINGS_PATH when it is imported
+    from werkzeug.datastructures import FileStorage
+    from services.xlsx_writer import new_workbook, write_csv_to_sheets
+
+    started = time.perf_counter()
+    wb = new_workbook()
+    write_csv_to_sheets(FileStorage(stream=io.BytesIO(data), filename='bench.csv'), wb.create_sheet, ';', type_inference)
+    with tempfile.TemporaryFile() as output:
+        wb.save(output)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per mode; the fastest is reported')
+    args = parser.parse_args()
+
+    work_dir = environment.prepare_settings()
+    data = synthetic_csv(args.rows)
+    inference = TypeInference.for_lang('SV')
+
+    # Interleave the modes so drift (thermal, page cache) affects both equally
+    plain, typed = [], []
+    for _ in range(args.repeat):
+        plain.append(convert(data, None))
+        typed.append(convert(data, inference))
+
+    best_plain, best_typed = min(plain), min(typed)
+    print(f"rows:             {args.rows}")
+    print(f"text cells:       {best_plain:.2f}s ({args.rows / best_plain:,.0f} rows/s)")
+    print(f"infer_types=true: {best_typed:.2f}s ({args.rows / best_typed:,.0f} rows/s)")
+    print(f"overhead:         {(best_typed / best_plain - 1) * 100:+.1f}%")
+    environment.cleanup_settings(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Deterministic synthetic inputs for the benchmarks."""
+import csv
+import io
+import random
+from datetime import date, timedelta
+
+# Column shapes cycled through when generating CSVs
+CSV_COLUMN_KINDS = ('id', 'decimal', 'integer', 'date', 'boolean', 'text', 'comment')
+_COMMENTS = ('', 'Express delivery', 'Invoice later', 'Back order', 'Leave at reception; call ahead')
+
+
+def synthetic_csv(rows, columns=len(CSV_COLUMN_KINDS), separator=';', decimal_comma=True, seed=1):
+    """Return a CSV (bytes, UTF-8) with a header row and `rows` data rows."""
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+    kinds = [CSV_COLUMN_KINDS[i % len(CSV_COLUMN_KINDS)] for i in range(columns)]
+
+    def value(kind, row_number):
+        if kind == 'id':
+            return row_number
+        if kind == 'decimal':
+            amount = f"{rng.uniform(-10000, 10000):.2f}"
+            return amount.replace('.', ',') if decimal_comma else amount
+        if kind == 'integer':
+            return rng.randint(0, 500)
+        if kind == 'date':
+            return (start + timedelta(days=rng.randint(0, 2000))).isoformat()
+        if kind == 'boolean':
+            return rng.choice(('true', 'false'))
+        if kind == 'text':
+            return f"Customer {rng.randint(1, 5000)}"
+        return rng.choice(_COMMENTS)
+
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=separator, lineterminator='\n')
+    writer.writerow([f"{kind}_{i}" for i, kind in enumerate(kinds, start=1)])
+    for row_number in range(1, rows + 1):
+        writer.writerow([value(kind, row_number) for kind in kinds])
+    return out.getvalue().encode('utf-8')
+
+
+def synthetic_binary(size, compressible=False, seed=1):
+    """Return `size` bytes of random data, or of repetitive text when `compressible`."""
+    if compressible:
+        line = b'2024-01-31;INV-000123;Customer 42;1234,50;paid\n'
+        return (line * (size // len(line) + 1))[:size]
+    return random.Random(seed).randbytes(size)
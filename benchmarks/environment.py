@@ -0,0 +1,76 @@
+"""
+Run the application outside Docker for benchmarking.
+
+`prepare_settings` must be called before the settings are first used (they are
+loaded on first access of `config.Config`). Redis is replaced by fakeredis.
+"""
+import base64
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+ADMIN_USER = 'admin'
+ADMIN_PASSWORD = 'change_me'  # as in defaults/settings.template.json
+
+
+def prepare_settings(**overrides):
+    """
+    Write a scratch settings.json based on the template (logs go to the scratch
+    directory too) and point the application at it. Returns the directory.
+    """
+    work_dir = tempfile.mkdtemp(prefix='api_toolbox_bench_')
+    with open(os.path.join(REPO_ROOT, 'defaults', 'settings.template.json')) as f:
+        settings = json.load(f)
+    settings['LOG_FILE'] = os.path.join(work_dir, 'logs', 'app.log')
+    settings.update(overrides)
+
+    settings_path = os.path.join(work_dir, 'settings.json')
+    with open(settings_path, 'w') as f:
+        json.dump(settings, f, indent=4)
+
+    os.environ['SETTINGS_PATH'] = settings_path
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret')
+    return work_dir
+
+
+def cleanup_settings(work_dir):
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def use_fake_redis():
+    """Replace redis.Redis with an in-process fakeredis server."""
+    import fakeredis
+    import redis
+
+    server = fakeredis.FakeServer()
+
+    class FakeRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, **kwargs):
+            for name in ('host', 'port', 'db'):
+                kwargs.pop(name, None)
+            super().__init__(server=server, **kwargs)
+
+    redis.Redis = FakeRedis
+    redis.StrictRedis = FakeRedis
+
+
+def load_app():
+    """Create the Flask application (after prepare_settings and use_fake_redis)."""
+    import main
+    return main.app
+
+
+def issue_api_token(client, description='benchmark'):
+    """Create an API token through the admin API and return the raw token."""
+    credentials = base64.b64encode(f'{ADMIN_USER}:{ADMIN_PASSWORD}'.encode()).decode()
+    response = client.post('/admin/api/tokens', json={'description': description},
+                           headers={'Authorization': f'Basic {credentials}'})
+    if response.status_code != 201:
+        raise RuntimeError(f'Could not create an API token: {response.status_code} {response.get_data(as_text=True)}')
+    return response.json['token']
@@ -0,0 +1,196 @@
+"""
+Run the benchmark suite and optionally compare it against a saved baseline.
+
+Every scenario runs in a fresh interpreter so its peak RSS is measured in
+isolation. Results are written as JSON; with --baseline the run fails (exit
+code 1) when a metric regresses by more than --threshold.
+
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --baseline baseline.json --threshold 0.15
+    python -m benchmarks.run --list
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+if __package__ in (None, ''):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import environment  # noqa: E402
+
+# Metric -> +1 when higher is worse, -1 when lower is worse
+COMPARED_METRICS = {
+    'p50_ms': 1,
+    'p99_ms': 1,
+    'throughput_mb_s': -1,
+    'peak_rss_mb': 1,
+}
+
+# Options that change the workload; results are only comparable when they match
+WORKLOAD_OPTIONS = ('csv_rows', 'csv_columns', 'csv_files', 'binary_size', 'iterations', 'warmup')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='API Toolbox benchmark suite')
+    parser.add_argument('--scenario', action='append', help='scenario to run (repeatable); default all')
+    parser.add_argument('--list', action='store_true', help='list the scenarios and exit')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--csv-rows', type=int, default=20000)
+    parser.add_argument('--csv-columns', type=int, default=7)
+    parser.add_argument('--csv-files', type=int, default=3, help='number of CSVs for batch scenarios')
+    parser.add_argument('--binary-size', type=int, default=8 * 1024 * 1024, help='bytes')
+    parser.add_argument('--output', help='write the JSON report to this path')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15, help='allowed relative regression (0.15 = 15%%)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    return parser
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_child(options):
+    """Run one scenario in this process and print its result as JSON."""
+    # Allow bodies of the requested size through the upload limits
+    limit = max(options.binary_size * 2, 1024 * 1024 * 1024)
+    # Conversions are measured without the result cache (http_csv2xls_cached turns it on)
+    work_dir = environment.prepare_settings(
+        MAX_UPLOAD_FILE_SIZE=limit, MAX_STREAM_DECODE_SIZE=limit, MAX_CSV_UPLOAD_SIZE=limit,
+        MAX_BATCH_UPLOAD_SIZE=limit, MAX_XLSX_UPLOAD_SIZE=limit,
+        CSV_CACHE_ENABLED=False, LOG_LEVEL='WARNING',
+    )
+    try:
+        from benchmarks.scenarios import SCENARIOS
+        workload = SCENARIOS[options.child].setup(options)
+
+        for _ in range(options.warmup):
+            workload.run()
+        timings = []
+        for _ in range(options.iterations):
+            started = time.perf_counter()
+            workload.run()
+            timings.append(time.perf_counter() - started)
+    finally:
+        environment.cleanup_settings(work_dir)
+
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    result = {
+        'iterations': len(timings),
+        'input_bytes': workload.input_bytes,
+        'mean_ms': round(mean * 1000, 3),
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+        'throughput_mb_s': round(workload.input_bytes / mean / 1024 / 1024, 3),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit / 1024 / 1024, 1),
+        'peak_children_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * rss_unit / 1024 / 1024, 1),
+    }
+    if workload.rows:
+        result['rows_per_s'] = round(workload.rows / mean, 1)
+    print(json.dumps(result))
+
+
+def run_scenario(name, options):
+    """Run a scenario in a subprocess and return its result (or an error record)."""
+    command = [sys.executable, '-m', 'benchmarks.run', '--child', name]
+    for option in WORKLOAD_OPTIONS:
+        command += [f"--{option.replace('_', '-')}", str(getattr(options, option))]
+    completed = subprocess.run(command, cwd=environment.REPO_ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f'exit code {completed.returncode}'}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(report, baseline, threshold):
+    """Return human-readable regression lines for metrics beyond the threshold."""
+    regressions = []
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or 'error' in result or 'error' in previous:
+            continue
+        for metric, direction in COMPARED_METRICS.items():
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction > threshold:
+                regressions.append(f"{name}.{metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def print_result(name, result):
+    if 'error' in result:
+        print(f"{name:28} ERROR {result['error']}")
+        return
+    rows = f" {result['rows_per_s']:>10,.0f} rows/s" if 'rows_per_s' in result else ''
+    print(f"{name:28} p50 {result['p50_ms']:>9.1f} ms  p99 {result['p99_ms']:>9.1f} ms  "
+          f"{result['throughput_mb_s']:>7.1f} MB/s  rss {result['peak_rss_mb']:>6.1f} MB{rows}")
+
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+    if options.child:
+        run_child(options)
+        return 0
+
+    from benchmarks.scenarios import SCENARIOS
+    if options.list:
+        for scenario in SCENARIOS.values():
+            print(f"{scenario.name:28} {scenario.description}")
+        return 0
+
+    names = options.scenario or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenario(s): {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': {option: getattr(options, option) for option in WORKLOAD_OPTIONS},
+        'results': {},
+    }
+    for name in names:
+        result = run_scenario(name, options)
+        report['results'][name] = result
+        print_result(name, result)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {options.output}")
+
+    failed = any('error' in result for result in report['results'].values())
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('options') != report['options']:
+            print("Warning: the baseline was recorded with different workload options.", file=sys.stderr)
+        regressions = compare(report, baseline, options.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            failed = True
+        else:
+            print(f"No regressions beyond {options.threshold:.0%} against {options.baseline}.")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Benchmark scenarios.
+
+Each scenario prepares its input from the run options and returns a Workload: a
+callable performing one operation plus the input size it processes. `http_*`
+scenarios go through the Flask test client (auth, parsing, response handling
+included); `service_*` scenarios call the service functions directly.
+"""
+import base64
+import gzip
+import io
+import tempfile
+from collections import namedtuple
+
+from benchmarks import data, environment
+
+Scenario = namedtuple('Scenario', ['name', 'description', 'setup'])
+Workload = namedtuple('Workload', ['run', 'input_bytes', 'rows'])
+
+SCENARIOS = {}
+
+
+def scenario(name, description):
+    def register(setup):
+        SCENARIOS[name] = Scenario(name, description, setup)
+        return setup
+    return register
+
+
+_client = None
+_headers = None
+
+def api_client():
+    """Test client and API token headers, created on first use."""
+    global _client, _headers
+    if _client is None:
+        environment.use_fake_redis()
+        _client = environment.load_app().test_client()
+        _headers = {'X-API-Token': environment.issue_api_token(_client)}
+    return _client, _headers
+
+
+def expect_ok(response):
+    body = response.get_data()  # drains streamed responses
+    response.close()
+    if response.status_code != 200:
+        raise RuntimeError(f'Unexpected status {response.status_code}: {body[:200]!r}')
+    return body
+
+
+def _csv_inputs(options):
+    return [
+        data.synthetic_csv(options.csv_rows, options.csv_columns, seed=index)
+        for index in range(1, options.csv_files + 1)
+    ]
+
+
+# --- HTTP ---
+
+def _csv2xls_workload(options, payloads, path='/csv2xls', **form):
+    client, headers = api_client()
+
+    def run():
+        files = [(io.BytesIO(payload), f'bench_{i}.csv') for i, payload in enumerate(payloads, start=1)]
+        expect_ok(client.post(path, data={'file': files, **form}, headers=headers))
+
+    return Workload(run, sum(map(len, payloads)), options.csv_rows * len(payloads))
+
+@scenario('http_csv2xls', 'POST /csv2xls with one CSV')
+def http_csv2xls(options):
+    return _csv2xls_workload(options, _csv_inputs(options)[:1])
+
+@scenario('http_csv2xls_gzip', 'POST /csv2xls with one CSV uploaded as .csv.gz')
+def http_csv2xls_gzip(options):
+    client, headers = api_client()
+    payload = _csv_inputs(options)[0]
+    compressed = gzip.compress(payload, 6)
+
+    def run():
+        expect_ok(client.post('/csv2xls', data={'file': (io.BytesIO(compressed), 'bench_1.csv.gz')}, headers=headers))
+
+    return Workload(run, len(payload), options.csv_rows)
+
+@scenario('http_csv2xls_table', 'POST /csv2xls with one CSV, create_table=true')
+def http_csv2xls_table(options):
+    return _csv2xls_workload(options, _csv_inputs(options)[:1], create_table='true')
+
+@scenario('http_csv2xls_batch', 'POST /csv2xls with --csv-files CSVs (process pool)')
+def http_csv2xls_batch(options):
+    return _csv2xls_workload(options, _csv_inputs(options))
+
+@scenario('http_csv2xls_cached', 'POST /csv2xls with one CSV, served from the result cache')
+def http_csv2xls_cached(options):
+    from config import Config
+
+    Config.CSV_CACHE_ENABLED = True
+    workload = _csv2xls_workload(options, _csv_inputs(options)[:1])
+    workload.run()  # fill the cache
+    return workload
+
+@scenario('http_base64_encode', 'POST /Base64/encode')
+def http_base64_encode(options):
+    client, headers = api_client()
+    payload = data.synthetic_binary(options.binary_size)
+
+    def run():
+        expect_ok(client.post('/Base64/encode', data={'bizDoc': (io.BytesIO(payload), 'bench.pdf')}, headers=headers))
+
+    return Workload(run, len(payload), None)
+
+@scenario('http_base64_encode_gzip', 'POST /Base64/encode with Accept-Encoding: gzip')
+def http_base64_encode_gzip(options):
+    client, headers = api_client()
+    payload = data.synthetic_binary(options.binary_size)
+    headers = {**headers, 'Accept-Encoding': 'gzip'}
+
+    def run():
+        expect_ok(client.post('/Base64/encode', data={'bizDoc': (io.BytesIO(payload), 'bench.pdf')}, headers=headers))
+
+    return Workload(run, len(payload), None)
+
+@scenario('http_base64_encode_stream', 'POST /Base64/encode/stream')
+def http_base64_encode_stream(options):
+    client, headers = api_client()
+    payload = data.synthetic_binary(options.binary_size)
+
+    def run():
+        expect_ok(client.post('/Base64/encode/stream', data={'bizDoc': (io.BytesIO(payload), 'bench.pdf')}, headers=headers))
+
+    return Workload(run, len(payload), None)
+
+@scenario('http_base64_encode_batch', 'POST /Base64/encode/batch with 10 files of --binary-size / 10')
+def http_base64_encode_batch(options):
+    client, headers = api_client()
+    payloads = [data.synthetic_binary(max(1, options.binary_size // 10), seed=index) for index in range(10)]
+
+    def run():
+        files = [(io.BytesIO(payload), f'bench_{i}.pdf') for i, payload in enumerate(payloads)]
+        expect_ok(client.post('/Base64/encode/batch', data={'bizDoc': files}, headers=headers))
+
+    return Workload(run, sum(map(len, payloads)), None)
+
+@scenario('http_base64_decode', 'POST /Base64/decode (form field, capped at MAX_UPLOAD_FILE_SIZE)')
+def http_base64_decode(options):
+    from config import Config
+
+    client, headers = api_client()
+    # The form field may hold the Base64 text of a file up to the upload limit
+    size = min(options.binary_size, Config.MAX_UPLOAD_FILE_SIZE)
+    encoded = base64.b64encode(data.synthetic_binary(size)).decode('ascii')
+
+    def run():
+        expect_ok(client.post('/Base64/decode', data={'base64': encoded, 'filename': 'bench.pdf'}, headers=headers))
+
+    return Workload(run, len(encoded), None)
+
+@scenario('http_base64_decode_stream', 'POST /Base64/decode/stream (raw body)')
+def http_base64_decode_stream(options):
+    client, headers = api_client()
+    encoded = base64.b64encode(data.synthetic_binary(options.binary_size))
+
+    def run():
+        expect_ok(client.post('/Base64/decode/stream?filename=bench.pdf', data=encoded,
+                              content_type='text/plain', headers=headers))
+
+    return Workload(run, len(encoded), None)
+
+@scenario('http_base64_decode_stream_gzip', 'POST /Base64/decode/stream (raw body, Content-Encoding: gzip)')
+def http_base64_decode_stream_gzip(options):
+    client, headers = api_client()
+    encoded = base64.b64encode(data.synthetic_binary(options.binary_size))
+    compressed = gzip.compress(encoded, 6)
+    headers = {**headers, 'Content-Encoding': 'gzip'}
+
+    def run():
+        expect_ok(client.post('/Base64/decode/stream?filename=bench.pdf', data=compressed,
+                              content_type='text/plain', headers=headers))
+
+    return Workload(run, len(encoded), None)
+
+@scenario('http_xls2csv', 'POST /xls2csv with a workbook of --csv-rows rows')
+def http_xls2csv(options):
+    from werkzeug.datastructures import FileStorage
+    from services.xlsx_writer import SheetJob, build_workbook
+
+    client, headers = api_client()
+    payload = _csv_inputs(options)[0]
+    with tempfile.TemporaryFile() as output:
+        build_workbook([SheetJob(FileStorage(stream=io.BytesIO(payload), filename='bench.csv'), 'bench.csv', 'Blad1', None)],
+                       ';', output)
+        output.seek(0)
+        workbook = output.read()
+
+    def run():
+        expect_ok(client.post('/xls2csv', data={'file': (io.BytesIO(workbook), 'bench.xlsx')}, headers=headers))
+
+    return Workload(run, len(workbook), options.csv_rows)
+
+
+# --- Service functions ---
+
+@scenario('service_build_workbook', 'services.xlsx_writer.build_workbook with one CSV')
+def service_build_workbook(options):
+    from werkzeug.datastructures import FileStorage
+    from services.xlsx_writer import SheetJob, build_workbook
+
+    payload = _csv_inputs(options)[0]
+
+    def run():
+        job = SheetJob(FileStorage(stream=io.BytesIO(payload), filename='bench.csv'), 'bench.csv', 'Blad1', None)
+        with tempfile.TemporaryFile() as output:
+            build_workbook([job], ';', output)
+
+    return Workload(run, len(payload), options.csv_rows)
+
+@scenario('service_base64_encode', 'services.base64.iter_encoded_chunks over a file')
+def service_base64_encode(options):
+    from services.base64 import iter_encoded_chunks
+
+    payload = data.synthetic_binary(options.binary_size)
+
+    def run():
+        for _ in iter_encoded_chunks(io.BytesIO(payload)):
+            pass
+
+    return Workload(run, len(payload), None)
+
+@scenario('service_base64_decode', 'services.base64.decode_base64_stream into a spooled file')
+def service_base64_decode(options):
+    from services.base64 import DECODE_SPOOL_SIZE, decode_base64_stream
+
+    encoded = base64.b64encode(data.synthetic_binary(options.binary_size))
+
+    def run():
+        with tempfile.SpooledTemporaryFile(max_size=DECODE_SPOOL_SIZE) as output:
+            decode_base64_stream(io.BytesIO(encoded), output, len(encoded))
+
+    return Workload(run, len(encoded), None)
@@ -1,41 +1,101 @@
 import os
 import json
-import sys
 import shutil
 import logging
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Literal, Optional
 from pydantic import BaseModel, Field, SecretStr, ValidationError
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; fall back to in-process locking only
+    fcntl = None
+
 # --- Pydantic Settings Model ---
 # Defines the structure and validation for all configuration parameters.
 
 class ApiToken(BaseModel):
     description: str
     last_used: Optional[str] = None
+    # Per-token limits; None uses the global default, 0 removes the limit for this token
+    rate_limit_per_minute: Optional[int] = Field(None, ge=0, description="Requests per minute allowed for this token.")
+    rate_limit_burst: Optional[int] = Field(None, ge=0, description="Requests this token may make at once before the per-minute rate applies.")
+    daily_byte_quota: Optional[int] = Field(None, ge=0, description="Request body bytes this token may upload per UTC day.")
 
 class Settings(BaseModel):
     # From settings.json
     ADMIN_CREDENTIALS: Dict[str, str] = Field(..., description="Admin credentials for the web UI. Passwords should be hashed.")
-    API_TOKENS: Dict[str, ApiToken] = Field(..., description="A dictionary of hashed API tokens and their metadata.")
+    API_TOKENS: Dict[str, ApiToken] = Field(..., description="A dictionary of API token fingerprints (or legacy hashes) and their metadata.")
     ALLOWED_EXTENSIONS: List[str] = Field(..., description="List of allowed file extensions for uploads.")
     LOG_FILE: str = Field("logs/app.log", description="Path to the application log file.")
     MAX_BYTES: int = Field(10 * 1024 * 1024, description="Maximum log file size in bytes.")
     BACKUP_COUNT: int = Field(5, description="Number of log file backups to keep.")
     LOG_LEVEL: str = Field("WARNING", description="Logging level (e.g., DEBUG, INFO, WARNING).")
+    LOG_FORMAT: Literal["text", "json"] = Field("text", description="Log file format: 'text' lines or one JSON object per line.")
+    LOG_INFO_SAMPLE_RATE: float = Field(1.0, ge=0.0, le=1.0, description="Fraction of high-volume per-request INFO lines to keep (1 keeps all).")
     SESSION_TYPE: str = Field("redis", description="Session storage type. Should be 'redis'.")
     SESSION_PERMANENT: bool = Field(False, description="Whether sessions should be permanent.")
     MAX_UPLOAD_FILE_SIZE: int = Field(10 * 1024 * 1024, description="Maximum file upload size in bytes.")
+    MAX_BATCH_UPLOAD_SIZE: int = Field(100 * 1024 * 1024, description="Maximum request body size in bytes for /Base64/encode/batch (each file is still limited to MAX_UPLOAD_FILE_SIZE).")
+    MAX_CSV_UPLOAD_SIZE: int = Field(100 * 1024 * 1024, description="Maximum request body size in bytes for CSV to XLS conversions (all files together).")
+    MAX_XLSX_UPLOAD_SIZE: int = Field(100 * 1024 * 1024, description="Maximum request body size in bytes for XLS to CSV conversions.")
+    MAX_REQUEST_BODY_SIZE: int = Field(1024 * 1024, description="Maximum request body size in bytes for endpoints without their own upload limit.")
+    UPLOAD_SPOOL_THRESHOLD: int = Field(512 * 1024, description="Uploaded files larger than this many bytes are spooled to temp files instead of memory.")
+    MAX_STREAM_DECODE_SIZE: int = Field(100 * 1024 * 1024, description="Maximum Base64 request body size in bytes for /Base64/decode/stream.")
+    TOKEN_CACHE_TTL: int = Field(300, description="Seconds a verified API token stays in the token cache.")
+    TOKEN_CACHE_MAX_ENTRIES: int = Field(1024, description="Maximum number of verified API tokens cached per worker.")
+    TOKEN_CACHE_SHARED: bool = Field(False, description="Also cache verified API tokens in Redis, shared by all workers.")
+    CSV_CONVERSION_PROCESSES: Optional[int] = Field(None, description="Worker processes for multi-file CSV to XLS conversions, per serving process. Defaults to the CPU cores divided by SERVER_WORKERS under serve.py (the number of CPU cores otherwise); 1 converts in the request thread.")
+    CSV_JOB_WORKERS: int = Field(2, description="Background threads running asynchronous CSV to XLS jobs.")
+    CSV_JOB_RESULT_TTL: int = Field(3600, description="Seconds job status and results of asynchronous CSV to XLS jobs are kept.")
+    CSV_JOB_RESULT_DIR: Optional[str] = Field(None, description="Directory for asynchronous job uploads and results. Defaults to a folder in the system temp directory.")
+    CSV_CACHE_ENABLED: bool = Field(False, description="Cache finished CSV to XLS workbooks by upload content and parameters, and serve repeated conversions from the cache. Off by default: cached workbooks keep the uploaded data on disk until evicted by size.")
+    CSV_CACHE_DIR: Optional[str] = Field(None, description="Directory for cached CSV to XLS workbooks. Defaults to a folder in the system temp directory.")
+    CSV_CACHE_MAX_BYTES: int = Field(1024 * 1024 * 1024, ge=0, description="Size cap of the CSV to XLS result cache; least recently used workbooks are evicted beyond it.")
+    CSV_CACHE_SHARED: bool = Field(False, description="Keep the result cache's LRU index and hit counts in Redis, for containers sharing CSV_CACHE_DIR.")
+    RATE_LIMIT_PER_MINUTE: Optional[int] = Field(None, ge=0, description="Default requests per minute per API token (None or 0: unlimited). Needs Redis.")
+    RATE_LIMIT_BURST: Optional[int] = Field(None, ge=0, description="Default burst size of the per-token rate limit. Defaults to the per-minute rate.")
+    DAILY_BYTE_QUOTA: Optional[int] = Field(None, ge=0, description="Default request body bytes per API token per UTC day (None or 0: unlimited). Needs Redis.")
+    ADMISSION_CONTROL_ENABLED: bool = Field(True, description="Limit concurrent heavy requests so lightweight routes (health checks, ping, admin) keep free server threads.")
+    ADMISSION_HEAVY_ROUTES: List[str] = Field(["/csv2xls", "/xls2csv", "/Base64"], description="Path prefixes whose POST requests count as heavy.")
+    ADMISSION_HEAVY_SLOTS: int = Field(2, ge=1, description="Heavy requests processed at the same time per worker process.")
+    ADMISSION_HEAVY_QUEUE: int = Field(4, ge=0, description="Heavy requests that may wait for a free slot; further ones get 503. Keep slots + queue below the server's thread count.")
+    ADMISSION_QUEUE_TIMEOUT: float = Field(10.0, ge=0, description="Seconds a heavy request waits for a slot before it gets 503.")
+    ADMISSION_RETRY_AFTER: int = Field(5, ge=0, description="Retry-After seconds sent with admission 503 responses.")
+    COMPRESSION_ENABLED: bool = Field(True, description="Accept gzip request bodies (Content-Encoding: gzip) and gzip JSON, CSV and text responses for clients sending Accept-Encoding: gzip.")
+    COMPRESSION_LEVEL: int = Field(6, ge=1, le=9, description="gzip compression level of responses (1 fastest, 9 smallest).")
+    COMPRESSION_MIN_SIZE: int = Field(1024, ge=0, description="Responses with a known length below this many bytes are sent uncompressed.")
+    SERVER_HOST: str = Field("0.0.0.0", description="Address serve.py listens on.")
+    SERVER_PORT: int = Field(8000, description="Port serve.py listens on.")
+    SERVER_WORKERS: Optional[int] = Field(None, ge=1, description="Worker processes started by serve.py. Defaults to the number of available CPU cores.")
+    SERVER_THREADS: int = Field(8, ge=1, description="Request threads per worker process. Keep above ADMISSION_HEAVY_SLOTS + ADMISSION_HEAVY_QUEUE.")
+    SERVER_CONNECTION_LIMIT: int = Field(100, ge=1, description="Open connections per worker process before it stops accepting new ones.")
+    SERVER_CHANNEL_TIMEOUT: int = Field(120, ge=1, description="Seconds an inactive connection is kept open.")
+    SERVER_BACKLOG: int = Field(1024, ge=1, description="Listen backlog of each worker's socket.")
+    SERVER_GRACEFUL_TIMEOUT: int = Field(30, ge=0, description="Seconds workers get to finish running requests on shutdown or restart.")
+    LAST_USED_FLUSH_INTERVAL: int = Field(30, description="Seconds between batched writes of API token 'last_used' timestamps to the credential store (0 writes immediately).")
+    CREDENTIAL_STORE: Literal["json", "sqlite"] = Field("json", description="Where API tokens and admin credentials are kept: 'json' (API_TOKENS and ADMIN_CREDENTIALS in settings.json) or 'sqlite'.")
+    CREDENTIAL_DB_PATH: Optional[str] = Field(None, description="SQLite database of the 'sqlite' credential store. Defaults to credentials.db next to settings.json, which it is filled from on first start.")
+    SERVER_TIMING_HEADER: bool = Field(False, description="Add a Server-Timing header with per-phase durations to every response. Off by default because it exposes internal timings, e.g. of token verification, to any client.")
+    SLOW_REQUEST_THRESHOLD_MS: int = Field(10000, description="Log the phase breakdown of requests slower than this many milliseconds (0 disables).")
+    METRICS_ENABLED: bool = Field(True, description="Collect request metrics and expose them at /metrics (admin Basic Auth).")
 
 
     # From environment variables
     SECRET_KEY: SecretStr = Field(..., description="A secret key for signing session data. Loaded from env.")
+    API_TOKEN_KEY: Optional[SecretStr] = Field(None, description="Key for API token fingerprints. Falls back to SECRET_KEY. Loaded from env.")
     REDIS_HOST: str = Field("localhost", description="Redis server hostname. Loaded from env.")
     REDIS_PORT: int = Field(6379, description="Redis server port. Loaded from env.")
     REDIS_DB: int = Field(0, description="Redis database number. Loaded from env.")
 
 # --- Configuration Loading Logic ---
 
+class ConfigurationError(Exception):
+    """settings.json (or the environment) is missing, unreadable or invalid."""
+
 # Resolve important paths once so other modules can import them.
 BASE_DIR = Path(__file__).resolve().parent
 DEFAULT_SETTINGS_FILE = BASE_DIR / "config" / "settings.json"
@@ -56,22 +116,19 @@ def ensure_settings_file():
     try:
         settings_path.parent.mkdir(parents=True, exist_ok=True)
     except OSError as exc:
-        logging.error(f"CRITICAL: Could not create config directory '{settings_path.parent}'. Error: {exc}")
-        sys.exit(1)
+        raise ConfigurationError(f"Could not create config directory '{settings_path.parent}': {exc}") from exc
 
     if settings_path.exists():
         return
 
     if not template_path.exists():
-        logging.error(f"CRITICAL: Template file '{template_path}' is missing. Cannot bootstrap settings.")
-        sys.exit(1)
+        raise ConfigurationError(f"Template file '{template_path}' is missing. Cannot bootstrap settings.")
 
     try:
         shutil.copy(template_path, settings_path)
-        logging.info(f"Created missing settings file at '{settings_path}' from template '{template_path}'.")
+        logging.info("Created missing settings file at '%s' from template '%s'.", settings_path, template_path)
     except OSError as exc:
-        logging.error(f"CRITICAL: Failed to create settings file at '{settings_path}'. Error: {exc}")
-        sys.exit(1)
+        raise ConfigurationError(f"Failed to create settings file at '{settings_path}': {exc}") from exc
 
 def load_configuration() -> Settings:
     """
@@ -86,12 +143,12 @@ def load_configuration() -> Settings:
         with open(SETTINGS_PATH, 'r') as f:
             settings_from_file = json.load(f)
     except (FileNotFoundError, json.JSONDecodeError) as e:
-        logging.error(f"CRITICAL: Could not read or parse settings file at '{SETTINGS_PATH}'. Error: {e}")
-        sys.exit(1)
+        raise ConfigurationError(f"Could not read or parse settings file at '{SETTINGS_PATH}': {e}") from e
 
     # 2. Load from environment variables
     settings_from_env = {
         "SECRET_KEY": os.getenv("SECRET_KEY"),
+        "API_TOKEN_KEY": os.getenv("API_TOKEN_KEY"),
         "REDIS_HOST": os.getenv("REDIS_HOST"),
         "REDIS_PORT": os.getenv("REDIS_PORT"),
         "REDIS_DB": os.getenv("REDIS_DB"),
@@ -104,9 +161,103 @@ def load_configuration() -> Settings:
         combined_settings = {**settings_from_file, **settings_from_env}
         return Settings(**combined_settings)
     except ValidationError as e:
-        logging.error(f"CRITICAL: Configuration validation failed!\n{e}")
-        sys.exit(1)
+        raise ConfigurationError(f"Configuration validation failed!\n{e}") from e
+
+# --- Settings File Updates ---
+
+_settings_lock = threading.Lock()
+
+@contextmanager
+def settings_file_lock():
+    """
+    Serialises read-modify-write cycles on settings.json between threads and,
+    where fcntl is available, between worker processes.
+    """
+    with _settings_lock:
+        lock_path = SETTINGS_PATH.with_name(SETTINGS_PATH.name + ".lock")
+        with open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def write_settings_file(settings_data):
+    """
+    Atomically replaces settings.json: the data is written to a temp file in the
+    same directory which is then renamed over the original, so readers never
+    see a partially written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=".settings.", suffix=".tmp", dir=SETTINGS_PATH.parent)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(settings_data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        if SETTINGS_PATH.exists():
+            shutil.copymode(SETTINGS_PATH, tmp_path)
+        os.replace(tmp_path, SETTINGS_PATH)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def update_settings(mutate):
+    """
+    Loads settings.json, applies `mutate(settings_data)` and writes the result back
+    atomically while holding the settings lock. Returns whatever `mutate` returns.
+    """
+    with settings_file_lock():
+        with open(SETTINGS_PATH, 'r') as f:
+            settings_data = json.load(f)
+        result = mutate(settings_data)
+        write_settings_file(settings_data)
+        return result
 
 # --- Global Config Object ---
+
+class LazySettings:
+    """
+    Proxy for the Settings object that loads and validates the configuration on
+    first attribute access rather than at import time, so importing modules is
+    cheap and a broken settings.json raises ConfigurationError where the
+    settings are first needed. Attribute writes go to the loaded Settings.
+    """
+
+    def __init__(self, loader):
+        object.__setattr__(self, '_loader', loader)
+        object.__setattr__(self, '_settings', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _load(self):
+        settings = self._settings
+        if settings is None:
+            with self._lock:
+                settings = self._settings
+                if settings is None:
+                    settings = self._loader()
+                    object.__setattr__(self, '_settings', settings)
+        return settings
+
+    def reload(self):
+        """Read settings.json and the environment again; returns the proxy."""
+        settings = self._loader()
+        object.__setattr__(self, '_settings', settings)
+        return self
+
+    @property
+    def loaded(self):
+        return self._settings is not None
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
 # This object is imported by other parts of the application.
-Config = load_configuration()
+Config = LazySettings(load_configuration)
@@ -14,5 +14,8 @@ echo "Updating permissions for config and logs..."
 chown -R appuser:appuser "${CONFIG_DIR}" "${LOG_DIR}"
 
 # --- Start Application ---
-echo "Starting Waitress as appuser..."
-exec gosu appuser /usr/local/bin/waitress-serve --host 0.0.0.0 --port 8000 main:app
+# serve.py starts SERVER_WORKERS waitress processes (default: one per CPU core)
+# with SERVER_THREADS threads each and supervises them. SIGTERM stops them
+# gracefully, SIGHUP restarts them with reloaded settings.
+echo "Starting Waitress workers as appuser..."
+exec gosu appuser python /app/serve.py
@@ -1,66 +1,28 @@
 import os
-import json
 import secrets
 import logging
-from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
-from flask import Flask, session, send_from_directory, request
+from flask import Flask, Response, current_app, send_from_directory, request
 from flask_restx import Api, Resource, Namespace, reqparse
-from werkzeug.middleware.proxy_fix import ProxyFix
-from flask_session import Session
-import redis
 
 # Import the new auth methods and the config object
-from auth.auth import api_auth, admin_auth
-from config import Config, SETTINGS_PATH
-from services.base64 import ns as ns_base64
-from services.csv_to_xls import ns as ns_csv2xls
+from auth.auth import api_auth, admin_auth, rate_limiter
+from auth.store import StoreError, get_store
+from config import Config
+from monitoring import profiler
 from version import __version__, __app_title__, __last_updated__, __author__
 
 load_dotenv(".env")
 
-# --- Application Setup ---
-# Serve the admin UI from a static folder
-app = Flask(__name__, static_folder='admin', static_url_path='/admin')
-app.wsgi_app = ProxyFix(app.wsgi_app)
-
-# --- Configuration ---
-app.config["SECRET_KEY"] = Config.SECRET_KEY.get_secret_value()
-app.config["SESSION_TYPE"] = Config.SESSION_TYPE
-app.config["SESSION_PERMANENT"] = Config.SESSION_PERMANENT
-app.config["SESSION_REDIS"] = redis.Redis(
-    host=Config.REDIS_HOST, port=Config.REDIS_PORT, db=Config.REDIS_DB
-)
-Session(app)
-
-
-
-# --- Logging Setup ---
-log_file_path = Config.LOG_FILE
-log_level = getattr(logging, Config.LOG_LEVEL.upper(), logging.INFO)
-
-# Ensure log directory exists
-log_dir = os.path.dirname(log_file_path)
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-# Setup RotatingFileHandler for app.log
-handler = RotatingFileHandler(
-    log_file_path,
-    maxBytes=Config.MAX_BYTES,
-    backupCount=Config.BACKUP_COUNT
-)
-handler.setFormatter(logging.Formatter(
-    '%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d - %(message)s'
-))
-
-# Apply handler to Flask's app logger and the root logger
-app.logger.addHandler(handler)
-app.logger.setLevel(log_level)
-logging.getLogger().addHandler(handler)
-logging.getLogger().setLevel(log_level)
-
-# --- API Setup ---
+# Importing this module is cheap: the settings, Redis and the service modules
+# (openpyxl in particular) are loaded by create_app() or on first use. `main.app`
+# creates the application on first access.
+
+# --- Namespaces ---
+ns_status = Namespace('Status', description='Status and health checks')
+# Admin endpoints are protected by Basic Auth, not API Key.
+ns_admin = Namespace('Admin', description='Admin operations', security=None)
+
 authorizations = {
     'apiKey': {
         'type': 'apiKey',
@@ -69,65 +31,167 @@ authorizations = {
     }
 }
 
-api = Api(
-    app,
-    version=__version__,
-    title=__app_title__,
-    description=f"Maintainer: {__author__} · Last revision: {__last_updated__}",
-    doc='/swagger/',
-    authorizations=authorizations
-)
+log_listener = None
+
+def configure_app_logging():
+    """Start the queued log writer once per process."""
+    global log_listener
+    if log_listener is not None:
+        return
+    from monitoring.logs import configure_logging
+
+    log_file_path = Config.LOG_FILE
+    log_level = getattr(logging, Config.LOG_LEVEL.upper(), logging.INFO)
+
+    # Ensure log directory exists
+    log_dir = os.path.dirname(log_file_path)
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    # Log through a queue; a background thread writes the rotating app.log.
+    # Flask's app logger propagates to the root logger.
+    log_listener = configure_logging(
+        log_file_path,
+        log_level,
+        max_bytes=Config.MAX_BYTES,
+        backup_count=Config.BACKUP_COUNT,
+        json_format=Config.LOG_FORMAT == 'json',
+        info_sample_rate=Config.LOG_INFO_SAMPLE_RATE,
+    )
 
-# --- Namespaces ---
-ns_status = Namespace('Status', description='Status and health checks')
-api.add_namespace(ns_status)
-api.add_namespace(ns_base64)
-api.add_namespace(ns_csv2xls)
+def create_app():
+    """Build the Flask application: settings, Redis, logging, API namespaces and middleware."""
+    import redis
+    from flask_session import Session
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    from auth.auth import configure_auth, settle_request_quota
+    from monitoring import metrics, timing
+    from services import admission, compression
+    from services.base64 import ns as ns_base64
+    from services.csv_to_xls import ns as ns_csv2xls
+    from services.xls_to_csv import ns as ns_xls2csv
+    from services.uploads import SpoolingRequest
+
+    # --- Application Setup ---
+    # Serve the admin UI from a static folder
+    app = Flask(__name__, static_folder='admin', static_url_path='/admin')
+    app.wsgi_app = ProxyFix(app.wsgi_app)
+    app.request_class = SpoolingRequest
+
+    # --- Configuration ---
+    app.config["SECRET_KEY"] = Config.SECRET_KEY.get_secret_value()
+    app.config["SESSION_TYPE"] = Config.SESSION_TYPE
+    app.config["SESSION_PERMANENT"] = Config.SESSION_PERMANENT
+    # Upload endpoints raise this per request (services/uploads.py)
+    app.config["MAX_CONTENT_LENGTH"] = Config.MAX_REQUEST_BODY_SIZE
+    # The client connects on its first command, not here
+    redis_client = redis.Redis(
+        host=Config.REDIS_HOST, port=Config.REDIS_PORT, db=Config.REDIS_DB
+    )
+    app.config["SESSION_REDIS"] = redis_client
+    Session(app)
+
+    # Token cache, rate limits and the 'last_used' flusher (auth/auth.py)
+    configure_auth(redis_client)
+    app.teardown_request(settle_request_quota)
+
+    # --- Logging Setup ---
+    configure_app_logging()
+    app.logger.setLevel(getattr(logging, Config.LOG_LEVEL.upper(), logging.INFO))
+
+    # --- API Setup ---
+    api = Api(
+        app,
+        version=__version__,
+        title=__app_title__,
+        description=f"Maintainer: {__author__} · Last revision: {__last_updated__}",
+        doc='/swagger/',
+        authorizations=authorizations
+    )
+    api.add_namespace(ns_status)
+    api.add_namespace(ns_base64)
+    api.add_namespace(ns_csv2xls)
+    api.add_namespace(ns_xls2csv)
+    api.add_namespace(ns_admin, path='/admin/api')
+
+    app.add_url_rule('/health', view_func=health_check)
+    app.add_url_rule('/metrics', view_func=prometheus_metrics)
+    app.add_url_rule('/admin', view_func=admin_index)
+    app.add_url_rule('/admin/', view_func=admin_index)
+
+    # --- Compression, admission control, metrics and timing ---
+    # Innermost, so admission slots are held while responses are compressed and
+    # metrics count the bytes actually transferred
+    compression.init_app(app)
+    # Installed before the metrics middleware so admission 503s are counted too
+    admission.init_app(app)
+    if Config.METRICS_ENABLED:
+        metrics.init_app(app, api)
+    timing.init_app(app, Config.SERVER_TIMING_HEADER, Config.SLOW_REQUEST_THRESHOLD_MS)
+    profiler.init_app(app)
+    return app
+
+_app = None
+
+def __getattr__(name):
+    """`main.app` (and `from main import app`) creates the application on first access."""
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 @ns_status.route('/ping')
 class Ping(Resource):
-    @api.doc(security='apiKey')
+    @ns_status.doc(security='apiKey')
     @api_auth.login_required
     def get(self):
         """Checks if the API is running and the user is authenticated via API Token."""
         return {'message': 'pong', 'authenticated_as': api_auth.current_user()}
 
 # --- Health Check Endpoint ---
-@app.route('/health')
 def health_check():
     """A simple health check endpoint for Docker."""
     return {'status': 'ok'}, 200
 
+@admin_auth.login_required
+def prometheus_metrics():
+    """Prometheus metrics, protected by the admin Basic Auth."""
+    if not Config.METRICS_ENABLED:
+        return {'message': 'Metrics are disabled'}, 404
+    from monitoring import metrics
+    body, content_type = metrics.render_latest()
+    return Response(body, content_type=content_type)
+
 # --- Admin UI and API ---
-@app.route('/admin')
-@app.route('/admin/')
 def admin_index():
     """Serves the admin index.html page."""
-    return send_from_directory(app.static_folder, 'index.html')
-
-# Admin endpoints are protected by Basic Auth, not API Key.
-ns_admin = Namespace('Admin', description='Admin operations', security=None)
-api.add_namespace(ns_admin, path='/admin/api')
-
-def write_settings(new_data):
-    """Helper function to write updated data to settings.json."""
-    with open(SETTINGS_PATH, 'w') as f:
-        json.dump(new_data, f, indent=4)
+    return send_from_directory(current_app.static_folder, 'index.html')
 
 def is_default_admin_password_active():
     """Returns True if any admin account still uses the default password."""
-    return any(password == "change_me" for password in Config.ADMIN_CREDENTIALS.values())
+    return any(password == "change_me" for password in get_store().admin_credentials().values())
 
 @ns_admin.route('/tokens')
 @ns_admin.doc(False) # Hide from Swagger UI
 class AdminTokenManager(Resource):
     @admin_auth.login_required
     def get(self):
-        """[Admin] List all API tokens."""
+        """[Admin] List all API tokens with their current rate limit and quota usage."""
+        from auth.auth import is_legacy_token_hash, token_limits
+
+        stored_tokens = get_store().tokens()
+        usage = rate_limiter.usage(list(stored_tokens))
         # Convert Pydantic objects to JSON-serializable dicts before returning
         tokens = {
-            token_hash: token_data.model_dump()
-            for token_hash, token_data in Config.API_TOKENS.items()
+            token_hash: {
+                **token_data.model_dump(),
+                'legacy': is_legacy_token_hash(token_hash),
+                'limits': token_limits(token_data)._asdict(),
+                'usage': usage.get(token_hash),
+            }
+            for token_hash, token_data in stored_tokens.items()
         }
         return {
             'tokens': tokens,
@@ -136,18 +200,15 @@ class AdminTokenManager(Resource):
 
     @admin_auth.login_required
     def post(self):
-        """[Admin] Create a new API token."""
+        """[Admin] Create a new API token (stored under its keyed fingerprint)."""
         parser = reqparse.RequestParser()
         parser.add_argument('description', type=str, required=True, help='Description for the new token')
+        parser.add_argument('rate_limit_per_minute', type=int, required=False, help='Requests per minute (default: RATE_LIMIT_PER_MINUTE, 0: unlimited)')
+        parser.add_argument('rate_limit_burst', type=int, required=False, help='Burst size of the rate limit (default: RATE_LIMIT_BURST)')
+        parser.add_argument('daily_byte_quota', type=int, required=False, help='Request body bytes per UTC day (default: DAILY_BYTE_QUOTA, 0: unlimited)')
         args = parser.parse_args()
 
         description = args['description']
-
-        # Check if description already exists
-        for token_data in Config.API_TOKENS.values():
-            if token_data.description == description:
-                return {'message': f'Description \'{description}\' already exists. Please use a unique description.'}, 409
-
         new_token = secrets.token_urlsafe(32)
         
         from auth.auth import hash_api_token
@@ -159,17 +220,16 @@ class AdminTokenManager(Resource):
             "description": description,
             "last_used": None
         }
+        for limit in ('rate_limit_per_minute', 'rate_limit_burst', 'daily_byte_quota'):
+            if args[limit] is not None:
+                if args[limit] < 0:
+                    return {'message': f'{limit} must not be negative.'}, 400
+                new_token_data[limit] = args[limit]
 
-        with open(SETTINGS_PATH, 'r+') as f:
-            settings_data = json.load(f)
-            settings_data['API_TOKENS'][hashed_token] = new_token_data
-            f.seek(0)
-            json.dump(settings_data, f, indent=4)
-            f.truncate()
+        # The store rejects duplicate descriptions atomically
+        if not get_store().add_token(hashed_token, ApiToken(**new_token_data)):
+            return {'message': f'Description \'{description}\' already exists. Please use a unique description.'}, 409
 
-        # Update in-memory config
-        Config.API_TOKENS[hashed_token] = ApiToken(**new_token_data)
-        
         # Return the original, unhashed token to the user
         return {'token': new_token, 'description': description}, 201
 
@@ -179,30 +239,75 @@ class AdminTokenDeleter(Resource):
     @admin_auth.login_required
     def delete(self, token_hash):
         """[Admin] Delete an API token by its hash."""
+        from auth.auth import revoke_api_token
+
         try:
-            with open(SETTINGS_PATH, 'r+') as f:
-                settings_data = json.load(f)
-                
-                if token_hash in settings_data['API_TOKENS']:
-                    # Delete from dictionary
-                    del settings_data['API_TOKENS'][token_hash]
-                    
-                    # Go to start of file and write updated data
-                    f.seek(0)
-                    json.dump(settings_data, f, indent=4)
-                    f.truncate()
-                    
-                    # Also delete from in-memory config
-                    if token_hash in Config.API_TOKENS:
-                        del Config.API_TOKENS[token_hash]
-                        
-                    return {'message': 'Token deleted'}, 200
-                else:
-                    return {'message': 'Token not found'}, 404
-        except (IOError, json.JSONDecodeError) as e:
-            logging.error(f"Error processing settings file during token deletion: {e}")
+            if not get_store().delete_token(token_hash):
+                return {'message': 'Token not found'}, 404
+        except StoreError as e:
+            logging.error("Error updating the credential store during token deletion: %s", e)
             return {'message': 'Server error while trying to delete token'}, 500
 
+        # Evict it from every worker's cache
+        revoke_api_token(token_hash)
+
+        return {'message': 'Token deleted'}, 200
+
+@ns_admin.route('/tokens/<string:token_hash>/reissue')
+@ns_admin.doc(False) # Hide from Swagger UI
+class AdminTokenReissuer(Resource):
+    @admin_auth.login_required
+    def post(self, token_hash):
+        """[Admin] Replace an API token with a new one in the fingerprint format."""
+        from auth.auth import hash_api_token, revoke_api_token
+
+        new_token = secrets.token_urlsafe(32)
+        fingerprint = hash_api_token(new_token)
+
+        try:
+            token_data = get_store().rekey_token(token_hash, fingerprint)
+        except StoreError as e:
+            logging.error("Error updating the credential store during token reissue: %s", e)
+            return {'message': 'Server error while trying to reissue token'}, 500
+        if token_data is None:
+            return {'message': 'Token not found'}, 404
+
+        revoke_api_token(token_hash)
+
+        # Return the original, unhashed token to the user
+        return {'token': new_token, 'description': token_data.description}, 201
+
+profiler_parser = reqparse.RequestParser()
+profiler_parser.add_argument('requests', type=int, required=False, default=10, help='Number of upcoming requests to profile')
+profiler_parser.add_argument('interval_ms', type=float, required=False, default=5, help='Sampling interval in milliseconds')
+
+@ns_admin.route('/profiler')
+@ns_admin.doc(False) # Hide from Swagger UI
+class AdminProfiler(Resource):
+    @admin_auth.login_required
+    def get(self):
+        """[Admin] Show the profiler status and the hottest stacks of the profiled requests."""
+        return profiler.profiler.report(limit=request.args.get('limit', 20, type=int))
+
+    @admin_auth.login_required
+    def post(self):
+        """[Admin] Profile the next N API requests handled by this worker."""
+        args = profiler_parser.parse_args()
+        if not 1 <= args['requests'] <= 1000:
+            return {'message': 'requests must be between 1 and 1000'}, 400
+        if not 1 <= args['interval_ms'] <= 1000:
+            return {'message': 'interval_ms must be between 1 and 1000'}, 400
+
+        profiler.profiler.arm(args['requests'], args['interval_ms'] / 1000)
+        logging.info("Sampling profiler armed by %s for %s request(s).", admin_auth.current_user(), args['requests'])
+        return profiler.profiler.report(limit=0), 202
+
+    @admin_auth.login_required
+    def delete(self):
+        """[Admin] Stop profiling further requests (the collected profile is kept)."""
+        profiler.profiler.disarm()
+        return profiler.profiler.report(limit=0)
+
 password_parser = reqparse.RequestParser()
 password_parser.add_argument('old_password', type=str, required=True)
 password_parser.add_argument('new_password', type=str, required=True)
@@ -228,19 +333,13 @@ class AdminPasswordChanger(Resource):
 
         # Hash the new password and save it
         new_hashed_password = hash_password(args['new_password'])
-        with open(SETTINGS_PATH, 'r') as f:
-            settings_data = json.load(f)
-        
-        settings_data['ADMIN_CREDENTIALS'][username] = new_hashed_password
-        write_settings(settings_data)
-        Config.ADMIN_CREDENTIALS[username] = new_hashed_password
+        get_store().set_admin_password(username, new_hashed_password)
 
         return {'message': f'Password for user {username} changed successfully.'}, 200
 
 if __name__ == '__main__':
-    import logging
     # When running directly, listen on all interfaces and port 8000
-    app.run(
+    create_app().run(
         host='0.0.0.0', 
         port=8000, 
         debug=os.getenv("DEBUG", "false").lower() == "true"
@@ -0,0 +1,110 @@
+"""
+Queued application logging.
+
+Request threads only put records on an in-memory queue; a QueueListener thread
+formats them and writes the rotating log file. Records can be written as plain
+text or as one JSON object per line, and high-volume INFO lines logged with
+`extra=SAMPLED` can be thinned out with a sample rate.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d - %(message)s'
+
+# Pass as `extra=` on INFO lines logged for every request to make them subject to sampling
+SAMPLED = {'sampled': True}
+
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sampled'}
+
+_exception_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single-line JSON object, including any `extra=` fields."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'file': record.filename,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'process': record.process,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith('_'):
+                entry[name] = value
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class InfoSampler(logging.Filter):
+    """Keeps only `rate` (0..1) of the INFO records logged with extra=SAMPLED."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno != logging.INFO or not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+
+class DeferredFormatQueueHandler(QueueHandler):
+    """
+    Queues records without formatting them. Only the message arguments are merged
+    (they may change once the call returns) and exceptions rendered to text; the
+    output format is applied by the listener thread.
+    """
+
+    def prepare(self, record):
+        # Updated in place rather than copied: the merged message and exception
+        # text format the same for any other handler that sees the record.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogWriter(QueueListener):
+    """QueueListener whose stop() may be called more than once (e.g. explicitly and at exit)."""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def configure_logging(log_file, level, max_bytes, backup_count, json_format=False, info_sample_rate=1.0):
+    """
+    Route the root logger through a queue to a rotating log file and start the
+    writer thread (stopped, and the queue drained, at interpreter exit).
+    Returns the LogWriter (a QueueListener).
+    """
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    queue_handler = DeferredFormatQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(InfoSampler(info_sample_rate))
+
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = LogWriter(queue_handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,296 @@
+"""
+Prometheus metrics for the API.
+
+MetricsMiddleware wraps the WSGI app and records every request; a before_request
+hook labels it with the flask-restx namespace and resource that handled it.
+When PROMETHEUS_MULTIPROC_DIR is set (it must be set before this module is
+imported and point to an emptied directory), each worker process writes its
+samples there and the /metrics endpoint aggregates all of them.
+"""
+import functools
+import os
+import time
+
+from flask import request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client import multiprocess
+
+from monitoring import timing
+
+# environ keys set by the before_request hook
+LABELS_ENVIRON_KEY = 'api_toolbox.metrics.labels'
+IN_PROGRESS_ENVIRON_KEY = 'api_toolbox.metrics.in_progress'
+
+# Transferred body size of a request whose body is inflated on the way in
+REQUEST_LENGTH_ENVIRON_KEY = 'api_toolbox.request_length'
+# Byte counter on the input of a request body sent without a Content-Length
+REQUEST_COUNTER_ENVIRON_KEY = 'api_toolbox.request_counter'
+
+# Requests that did not match any route
+UNMATCHED_LABELS = ('none', 'unmatched')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 1 KiB .. 1 GiB in powers of four
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))
+AUTH_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+REQUESTS = Counter(
+    'api_toolbox_requests_total', 'HTTP requests handled.',
+    ['namespace', 'resource', 'method', 'status'],
+)
+REQUEST_DURATION = Histogram(
+    'api_toolbox_request_duration_seconds',
+    'Time until the response body was produced (file responses exclude sending the file).',
+    ['namespace', 'resource', 'method'], buckets=LATENCY_BUCKETS,
+)
+IN_PROGRESS = Gauge(
+    'api_toolbox_requests_in_progress', 'Requests currently being handled.',
+    ['namespace', 'resource'], multiprocess_mode='livesum',
+)
+REQUEST_SIZE = Histogram(
+    'api_toolbox_request_size_bytes', 'Request body sizes.',
+    ['namespace', 'resource'], buckets=SIZE_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    'api_toolbox_response_size_bytes', 'Response body sizes.',
+    ['namespace', 'resource'], buckets=SIZE_BUCKETS,
+)
+AUTH_DURATION = Histogram(
+    'api_toolbox_auth_verification_seconds', 'Time spent verifying credentials.',
+    ['scheme', 'result'], buckets=AUTH_BUCKETS,
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'api_toolbox_admission_queue_depth', 'Requests waiting for an admission slot.',
+    ['route_class'], multiprocess_mode='livesum',
+)
+ADMISSION_ACTIVE = Gauge(
+    'api_toolbox_admission_active', 'Requests holding an admission slot.',
+    ['route_class'], multiprocess_mode='livesum',
+)
+ADMISSION_WAIT = Histogram(
+    'api_toolbox_admission_wait_seconds', 'Time requests waited for an admission slot.',
+    ['route_class'], buckets=LATENCY_BUCKETS,
+)
+ADMISSION_REJECTED = Counter(
+    'api_toolbox_admission_rejected_total', 'Requests rejected with 503 because the admission queue was full.',
+    ['route_class'],
+)
+RATE_LIMITED = Counter(
+    'api_toolbox_rate_limited_total', 'Requests rejected by a per-token rate limit or daily byte quota.',
+    ['reason'],
+)
+CSV_CACHE_LOOKUPS = Counter(
+    'api_toolbox_csv2xls_cache_lookups_total', 'csv2xls result cache lookups.',
+    ['result'],
+)
+CSV_CACHE_EVICTIONS = Counter(
+    'api_toolbox_csv2xls_cache_evictions_total', 'Workbooks evicted from the csv2xls result cache.',
+)
+
+
+def multiprocess_enabled():
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+def render_latest():
+    """Return the metrics in the Prometheus text format and its content type."""
+    if multiprocess_enabled():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid):
+    """Drop the live gauges of a worker process that exited (multi-process mode only)."""
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(pid)
+
+def request_body_length(environ):
+    """
+    Size of the request body as sent by the client (compressed bodies count
+    compressed). For a body without a Content-Length, the bytes read so far.
+    """
+    counter = environ.get(REQUEST_COUNTER_ENVIRON_KEY)
+    if counter is not None:
+        return counter.bytes_read
+    return environ.get(REQUEST_LENGTH_ENVIRON_KEY) or int(environ.get('CONTENT_LENGTH') or 0)
+
+def count_request_body(environ):
+    """
+    Count the bytes read from a request body sent without a Content-Length (e.g.
+    chunked) by wrapping wsgi.input, unless this was done already. Returns the
+    counter, or None when the length is declared. Must be called before the
+    application reads the body, and before the body is inflated so the
+    transferred bytes are counted.
+    """
+    counter = environ.get(REQUEST_COUNTER_ENVIRON_KEY)
+    if counter is None and not environ.get('CONTENT_LENGTH') and REQUEST_LENGTH_ENVIRON_KEY not in environ:
+        counter = environ[REQUEST_COUNTER_ENVIRON_KEY] = _CountingInput(environ['wsgi.input'])
+        environ['wsgi.input'] = counter
+    return counter
+
+@functools.lru_cache(maxsize=1024)
+def _request_series(namespace, resource, method):
+    """Labelled children of the per-request metrics; looking them up is most of the cost."""
+    return (
+        REQUEST_DURATION.labels(namespace, resource, method),
+        IN_PROGRESS.labels(namespace, resource),
+        REQUEST_SIZE.labels(namespace, resource),
+        RESPONSE_SIZE.labels(namespace, resource),
+    )
+
+def timed_verification(scheme):
+    """
+    Decorate an auth verification callback to record its duration and outcome,
+    also as the 'auth' phase of the current request.
+    """
+    def decorator(verify):
+        @functools.wraps(verify)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result = verify(*args, **kwargs)
+            elapsed = time.perf_counter() - started
+            AUTH_DURATION.labels(scheme, 'success' if result else 'failure').observe(elapsed)
+            timing.add('auth', elapsed)
+            return result
+        return wrapper
+    return decorator
+
+
+class EndpointLabels:
+    """Maps Flask endpoints to (namespace, resource) labels, cached per endpoint."""
+
+    def __init__(self, app, api):
+        self.app = app
+        self.api = api
+        self._labels = {}
+
+    def __call__(self, endpoint):
+        labels = self._labels.get(endpoint)
+        if labels is None:
+            labels = self._labels[endpoint] = self._resolve(endpoint)
+        return labels
+
+    def _resolve(self, endpoint):
+        if endpoint is None:
+            return UNMATCHED_LABELS
+        view_class = getattr(self.app.view_functions.get(endpoint), 'view_class', None)
+        if view_class is not None:
+            for namespace in self.api.namespaces:
+                if any(route.resource is view_class for route in namespace.resources):
+                    return namespace.name, view_class.__name__
+        return 'app', endpoint
+
+
+class _CountingInput:
+    """Wraps wsgi.input to count the bytes of a request body without a Content-Length."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.bytes_read = 0
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._stream.readline(*args)
+        self.bytes_read += len(data)
+        return data
+
+    def __iter__(self):
+        for line in self._stream:
+            self.bytes_read += len(line)
+            yield line
+
+    def close(self):
+        close = getattr(self._stream, 'close', None)
+        if close:
+            close()
+
+
+class _CountingBody:
+    """Wraps a response iterable without a Content-Length, finishing the metrics on close."""
+
+    def __init__(self, app_iter, finish):
+        self._app_iter = app_iter
+        self._finish = finish
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        for chunk in self._app_iter:
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self._app_iter, 'close', None)
+            if close:
+                close()
+        finally:
+            self._finish(self.bytes_sent)
+
+
+class MetricsMiddleware:
+    """
+    WSGI middleware recording request counts, latency, in-flight requests and
+    body sizes. Responses with a Content-Length are passed through untouched (so
+    file responses keep the server's file wrapper); streamed responses are
+    measured until the server closes them.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        count_request_body(environ)
+
+        response = {}
+
+        def record_start_response(status, headers, exc_info=None):
+            response['status'] = status.split(' ', 1)[0]
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    response['length'] = int(value)
+                    break
+            return start_response(status, headers, exc_info)
+
+        def finish(response_bytes):
+            namespace, resource = environ.get(LABELS_ENVIRON_KEY, UNMATCHED_LABELS)
+            method = environ.get('REQUEST_METHOD', '')
+            duration, in_progress, request_size, response_size = _request_series(namespace, resource, method)
+            duration.observe(time.perf_counter() - started)
+            REQUESTS.labels(namespace, resource, method, response.get('status', '500')).inc()
+            if environ.pop(IN_PROGRESS_ENVIRON_KEY, False):
+                in_progress.dec()
+            request_size.observe(request_body_length(environ))
+            response_size.observe(response_bytes)
+
+        try:
+            app_iter = self.wsgi_app(environ, record_start_response)
+        except BaseException:
+            finish(0)
+            raise
+
+        if 'length' in response:
+            finish(response['length'])
+            return app_iter
+        return _CountingBody(app_iter, finish)
+
+
+def init_app(app, api):
+    """Label requests with their namespace/resource and install the middleware."""
+    endpoint_labels = EndpointLabels(app, api)
+
+    @app.before_request
+    def label_request_for_metrics():
+        labels = endpoint_labels(request.endpoint)
+        request.environ[LABELS_ENVIRON_KEY] = labels
+        _request_series(*labels, request.method)[1].inc()
+        request.environ[IN_PROGRESS_ENVIRON_KEY] = True
+
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app)
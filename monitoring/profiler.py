@@ -0,0 +1,139 @@
+"""
+On-demand sampling profiler.
+
+An admin arms the profiler for the next N API requests. While any of them is in
+flight, a background thread samples the stacks of the threads handling them via
+sys._current_frames() and aggregates identical stacks. Nothing is sampled when
+the profiler is not armed. Profiles are per worker process.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_STACK_DEPTH = 64
+
+
+class SamplingProfiler:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._remaining = 0
+        self._active = set()
+        self._reset_stats(interval=0.005)
+
+    def _reset_stats(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.functions = Counter()
+        self.samples = 0
+        self.requests_profiled = 0
+        self.armed_at = None
+
+    def arm(self, requests, interval):
+        """Discard the previous profile and profile the next `requests` requests."""
+        with self._lock:
+            self._reset_stats(interval)
+            self._remaining = requests
+            self.armed_at = time.time()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+
+    def disarm(self):
+        with self._lock:
+            self._remaining = 0
+
+    def begin_request(self):
+        """Profile the calling thread's request if the profiler is armed. Returns True if so."""
+        if not self._remaining:
+            return False
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            self._active.add(threading.get_ident())
+            self._wakeup.notify()
+            return True
+
+    def end_request(self):
+        with self._lock:
+            self._active.discard(threading.get_ident())
+            self.requests_profiled += 1
+
+    def report(self, limit=20):
+        """Status plus the hottest stacks (root first) and leaf functions ('file:function')."""
+        with self._lock:
+            samples = self.samples or 1
+            return {
+                'armed': self._remaining > 0,
+                'remaining_requests': self._remaining,
+                'requests_profiled': self.requests_profiled,
+                'in_progress': len(self._active),
+                'interval_ms': self.interval * 1000,
+                'samples': self.samples,
+                'armed_at': self.armed_at,
+                'pid': os.getpid(),
+                'top_stacks': [
+                    {'samples': count, 'percent': round(100 * count / samples, 1), 'stack': list(stack)}
+                    for stack, count in self.stacks.most_common(limit)
+                ],
+                'top_functions': [
+                    {'samples': count, 'percent': round(100 * count / samples, 1), 'function': function}
+                    for function, count in self.functions.most_common(limit)
+                ],
+            }
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._wakeup.wait()
+                interval = self.interval
+            time.sleep(interval)
+            self._sample()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id in self._active:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = _format_stack(frame)
+                self.stacks[stack] += 1
+                self.functions[stack[-1].rsplit(':', 1)[0]] += 1
+                self.samples += 1
+
+
+def _format_stack(frame):
+    """Return the stack of `frame` as 'file:function:line' strings, root first."""
+    entries = []
+    while frame is not None and len(entries) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        entries.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    entries.reverse()
+    return tuple(entries)
+
+
+profiler = SamplingProfiler()
+
+
+def init_app(app, skip_prefixes=('/admin', '/metrics', '/health')):
+    """Profile armed requests, except for the admin, metrics and health routes."""
+    from flask import g, request
+
+    @app.before_request
+    def begin_profiled_request():
+        if request.path.startswith(skip_prefixes):
+            return
+        g.profiled = profiler.begin_request()
+
+    @app.teardown_request
+    def end_profiled_request(exc):
+        if g.pop('profiled', False):
+            profiler.end_request()
@@ -0,0 +1,120 @@
+"""
+Per-request phase timing.
+
+Code marks the stages of a request with `phase(name)` (or adds measured time with
+`add(name, seconds)`). While a request is being handled the spans accumulate in
+a recorder held in a context variable; outside a request (e.g. in conversion
+worker processes) they cost one context variable lookup and are discarded.
+This module has no Flask imports so the services can use it; `init_app` wires it
+into the application (Server-Timing header and slow-request log).
+"""
+import logging
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar('api_toolbox_request_timings', default=None)
+
+# Server-Timing metric names are HTTP tokens
+_INVALID_TOKEN_CHARS = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+class PhaseRecorder:
+    """Accumulated duration and count per phase name, in first-seen order."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def add(self, name, seconds):
+        total, count = self.phases.get(name, (0.0, 0))
+        self.phases[name] = (total + seconds, count + 1)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Return the Server-Timing header value (durations in milliseconds)."""
+        entries = [
+            f"{_INVALID_TOKEN_CHARS.sub('_', name)};dur={total * 1000:.1f}"
+            for name, (total, _) in self.phases.items()
+        ]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(entries)
+
+    def summary(self):
+        """One-line breakdown for logs."""
+        return ', '.join(
+            f"{name}={total * 1000:.1f}ms" + (f" ({count}x)" if count > 1 else '')
+            for name, (total, count) in self.phases.items()
+        ) or 'no phases recorded'
+
+
+def start_request():
+    """Start recording phases for the request handled by the current context."""
+    recorder = PhaseRecorder()
+    return recorder, _current.set(recorder)
+
+def finish_request(token):
+    _current.reset(token)
+
+def current_recorder():
+    return _current.get()
+
+def add(name, seconds):
+    """Add `seconds` to a phase of the current request, if any."""
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.add(name, seconds)
+
+@contextmanager
+def phase(name):
+    """Time the enclosed block as phase `name` of the current request."""
+    recorder = _current.get()
+    if recorder is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.add(name, time.perf_counter() - started)
+
+
+def init_app(app, server_timing_header=True, slow_request_threshold_ms=0):
+    """
+    Record phases for every request, add the Server-Timing header to responses
+    (unless disabled) and log the breakdown of requests slower than the threshold
+    (0 disables the log).
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_phase_timing():
+        g.phase_recorder, g.phase_token = start_request()
+
+    @app.after_request
+    def report_phase_timing(response):
+        recorder = g.get('phase_recorder')
+        if recorder is None:
+            return response
+        if server_timing_header:
+            response.headers['Server-Timing'] = recorder.server_timing()
+        elapsed_ms = recorder.elapsed() * 1000
+        if slow_request_threshold_ms and elapsed_ms >= slow_request_threshold_ms:
+            logging.warning(
+                "Slow request: %s %s -> %s took %.0fms (%s)",
+                request.method, request.path, response.status_code, elapsed_ms, recorder.summary(),
+            )
+        return response
+
+    @app.teardown_request
+    def stop_phase_timing(exc):
+        token = g.pop('phase_token', None)
+        if token is not None:
+            try:
+                finish_request(token)
+            except ValueError:
+                # Reset from a different context (e.g. a streamed response); just clear it
+                _current.set(None)
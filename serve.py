@@ -0,0 +1,359 @@
+"""
+Production entry point: serves main:app from SERVER_WORKERS waitress processes.
+
+The master process forks the workers and supervises them; it never imports the
+application, so it holds no Redis connections or threads that a fork could
+copy. Each worker loads the settings and the app itself and listens on its own
+SO_REUSEPORT socket, so the kernel spreads connections over the workers (where
+SO_REUSEPORT is unavailable they share one socket bound by the master). With
+more than one worker, PROMETHEUS_MULTIPROC_DIR is set up so /metrics covers
+all of them.
+
+Signals to the master:
+  SIGTERM / SIGINT  stop accepting connections, let the workers finish their
+                    requests for up to SERVER_GRACEFUL_TIMEOUT seconds, exit.
+  SIGHUP            graceful restart: reload settings.json, start new workers
+                    and stop the old ones once the new ones are listening.
+
+Run with `python serve.py`.
+"""
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv(".env")
+
+import config
+
+# Exit code of a worker that could not load the settings, the app or its socket;
+# restarting it would fail the same way, so the master gives up.
+WORKER_BOOT_ERROR = 3
+
+# Workers that die within this many seconds of starting are restarted after RESTART_DELAY
+MIN_WORKER_UPTIME = 10
+RESTART_DELAY = 5
+
+SUPERVISE_INTERVAL = 0.5
+
+# A stopping worker closes keep-alive connections that have been quiet this many
+# seconds; newer ones may still be sending their next request.
+QUIET_TIME = 1.0
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS
+        return os.cpu_count() or 1
+
+def worker_count(settings):
+    return settings.SERVER_WORKERS or available_cpus()
+
+def conversion_processes(settings):
+    """
+    CSV_CONVERSION_PROCESSES of each worker. By default the cores are divided
+    among the workers, so all their conversion pools together start about one
+    process per core instead of one per core in every worker.
+    """
+    return settings.CSV_CONVERSION_PROCESSES or max(1, available_cpus() // worker_count(settings))
+
+def prepare_metrics_dir(workers):
+    """Point prometheus_client at an emptied multi-process directory when there are several workers."""
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not directory:
+        if workers == 1:
+            return
+        directory = os.environ['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(tempfile.gettempdir(), 'api_toolbox_metrics')
+    os.makedirs(directory, exist_ok=True)
+    with os.scandir(directory) as scan:
+        for entry in scan:
+            if entry.name.endswith('.db'):
+                os.remove(entry.path)
+
+def listen_socket(host, port, reuse_port):
+    """A bound TCP socket; waitress starts listening on it."""
+    family, socktype, proto, _, address = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, socktype, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    return sock
+
+def worker_log_file(log_file, index):
+    """Worker 0 writes the configured log file, worker n its own `<name>-n<ext>` next to it."""
+    if index == 0:
+        return log_file
+    base, ext = os.path.splitext(log_file)
+    return f"{base}-{index}{ext}"
+
+
+# --- Worker process ---
+
+def run_worker(index, shared_socket, ready_fd):
+    """Load the app and serve until SIGTERM; returns the process exit code."""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    # The master coordinates shutdown and restarts for the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    try:
+        # Read settings.json again: tokens may have been added since the master loaded it
+        settings = config.Config.reload()
+        if worker_count(settings) > 1:
+            settings.LOG_FILE = worker_log_file(settings.LOG_FILE, index)
+        settings.CSV_CONVERSION_PROCESSES = conversion_processes(settings)
+        sock = shared_socket or listen_socket(settings.SERVER_HOST, settings.SERVER_PORT, reuse_port=True)
+
+        # The app logs through its own queue handler, not the master's stderr handler
+        for handler in logging.getLogger().handlers[:]:
+            logging.getLogger().removeHandler(handler)
+        from waitress.server import create_server
+        from main import app
+        from services.uploads import largest_upload_limit
+
+        server = create_server(
+            app,
+            sockets=[sock],
+            threads=settings.SERVER_THREADS,
+            connection_limit=settings.SERVER_CONNECTION_LIMIT,
+            channel_timeout=settings.SERVER_CHANNEL_TIMEOUT,
+            backlog=settings.SERVER_BACKLOG,
+            # Bodies larger than any endpoint accepts are refused by waitress before buffering
+            max_request_body_size=largest_upload_limit(),
+        )
+    except Exception:
+        logging.critical("Worker %s failed to start.", index, exc_info=True)
+        return WORKER_BOOT_ERROR
+
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+    logging.info("Worker %s (pid %s) serving on %s:%s with %s threads.",
+                 index, os.getpid(), settings.SERVER_HOST, settings.SERVER_PORT, settings.SERVER_THREADS)
+    serve_until_stopped(server, stopping, settings.SERVER_GRACEFUL_TIMEOUT)
+    return 0
+
+def serve_until_stopped(server, stopping, graceful_timeout):
+    """
+    Run the waitress event loop. After SIGTERM the listening socket is closed,
+    quiet keep-alive connections are dropped and requests in progress get up to
+    `graceful_timeout` seconds to finish.
+    """
+    from waitress import wasyncore
+
+    deadline = None
+    while True:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + graceful_timeout
+            # Take over connections already queued on the socket, which would be
+            # reset when it closes, then close only the listening socket (the
+            # trigger is still needed for the running requests).
+            accept_pending(server)
+            wasyncore.dispatcher.close(server)
+        if deadline is not None:
+            busy = False
+            now = time.time()
+            for channel in list(server.active_channels.values()):
+                if channel.requests or channel.request or channel.total_outbufs_len or now - channel.last_activity < QUIET_TIME:
+                    busy = True
+                else:
+                    channel.will_close = True
+            if (not busy and not server.active_channels) or time.monotonic() >= deadline:
+                break
+        wasyncore.loop(timeout=server.adj.asyncore_loop_timeout, map=server._map,
+                       use_poll=server.adj.asyncore_use_poll, count=1)
+    server.task_dispatcher.shutdown()
+
+def accept_pending(server):
+    connections = len(server.active_channels)
+    while len(server._map) < server.adj.connection_limit:
+        server.handle_accept()
+        if len(server.active_channels) == connections:
+            break
+        connections = len(server.active_channels)
+
+
+# --- Master process ---
+
+class Worker:
+    def __init__(self, pid, index, generation, ready_fd):
+        self.pid = pid
+        self.index = index
+        self.generation = generation
+        self.ready_fd = ready_fd
+        self.ready = False
+        self.started = time.monotonic()
+
+
+class Arbiter:
+    """Starts, supervises and restarts the worker processes."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.workers = {}
+        self.generation = 0
+        self.restart_at = {}
+        self.shared_socket = None
+        self.signals = []
+
+    def run(self):
+        # The workers run in children forked from here. They leave through
+        # sys.exit, which unwinds this frame, so the master code must not catch
+        # SystemExit or clean up in `finally` blocks.
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: self.signals.append(signum))
+
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            self.shared_socket = listen_socket(self.settings.SERVER_HOST, self.settings.SERVER_PORT, reuse_port=False)
+        prepare_metrics_dir(worker_count(self.settings))
+        from monitoring import metrics
+        self.metrics = metrics
+
+        logging.info("Starting %s worker(s) on %s:%s.",
+                     worker_count(self.settings), self.settings.SERVER_HOST, self.settings.SERVER_PORT)
+        while True:
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.restart()
+                else:
+                    logging.info("Received %s, shutting down.", signal.Signals(signum).name)
+                    return self.stop()
+            if not self.reap():
+                return self.stop(1)
+            self.spawn_missing()
+            time.sleep(SUPERVISE_INTERVAL)
+
+    def spawn_missing(self):
+        current = {w.index for w in self.workers.values() if w.generation == self.generation}
+        now = time.monotonic()
+        for index in range(worker_count(self.settings)):
+            if index not in current and self.restart_at.get(index, 0) <= now:
+                self.spawn(index)
+
+    def spawn(self, index):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            for worker in self.workers.values():
+                os.close(worker.ready_fd)
+            sys.exit(run_worker(index, self.shared_socket, write_fd))
+        os.close(write_fd)
+        self.workers[pid] = Worker(pid, index, self.generation, read_fd)
+        return self.workers[pid]
+
+    def reap(self):
+        """Collect exited workers; returns False when one could not start at all."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return True
+            if pid == 0:
+                return True
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            started = self._is_ready(worker)
+            os.close(worker.ready_fd)
+            self.metrics.mark_process_dead(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if worker.generation != self.generation:
+                continue
+            if code == WORKER_BOOT_ERROR and not started:
+                logging.error("Worker %s could not start, stopping the server.", worker.index)
+                return False
+            logging.warning("Worker %s (pid %s) exited with code %s, restarting it.", worker.index, pid, code)
+            if time.monotonic() - worker.started < MIN_WORKER_UPTIME:
+                self.restart_at[worker.index] = time.monotonic() + RESTART_DELAY
+
+    def restart(self):
+        """Replace every worker, stopping the old ones once the new ones are listening."""
+        logging.info("Received SIGHUP, reloading settings and restarting workers.")
+        previous_settings = self.settings
+        try:
+            self.settings = config.load_configuration()
+        except config.ConfigurationError as e:
+            logging.error("Keeping the running workers: %s", e)
+            return
+        old = list(self.workers.values())
+        self.generation += 1
+        new = [self.spawn(index) for index in range(worker_count(self.settings))]
+        if not self.wait_ready(new, self.settings.SERVER_GRACEFUL_TIMEOUT):
+            logging.error("New workers did not start, keeping the running ones.")
+            for worker in new:
+                self._signal(worker, signal.SIGTERM)
+            self.settings = previous_settings
+            self.generation -= 1
+            return
+        self.restart_at.clear()
+        for worker in old:
+            self._signal(worker, signal.SIGTERM)
+
+    def wait_ready(self, workers, timeout):
+        """Wait until all `workers` are listening; returns False if one exited or the timeout passed."""
+        deadline = time.monotonic() + timeout
+        while True:
+            self.reap()
+            if any(w.pid not in self.workers for w in workers):
+                return False
+            pending = [w for w in workers if not self._is_ready(w)]
+            if not pending:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            select.select([w.ready_fd for w in pending], [], [], SUPERVISE_INTERVAL)
+
+    def stop(self, code=0):
+        """Stop all workers gracefully, killing those still running after the graceful timeout."""
+        for worker in list(self.workers.values()):
+            self._signal(worker, signal.SIGTERM)
+        deadline = time.monotonic() + self.settings.SERVER_GRACEFUL_TIMEOUT + 5
+        while self.workers and time.monotonic() < deadline:
+            self.generation = -1  # Nothing is restarted from here on
+            self.reap()
+            time.sleep(0.1)
+        for worker in list(self.workers.values()):
+            logging.warning("Worker %s (pid %s) did not stop in time, killing it.", worker.index, worker.pid)
+            self._signal(worker, signal.SIGKILL)
+        while self.workers:
+            self.reap()
+            time.sleep(0.1)
+        return code
+
+    @staticmethod
+    def _is_ready(worker):
+        if not worker.ready:
+            readable, _, _ = select.select([worker.ready_fd], [], [], 0)
+            worker.ready = bool(readable) and os.read(worker.ready_fd, 1) == b'1'
+        return worker.ready
+
+    @staticmethod
+    def _signal(worker, signum):
+        try:
+            os.kill(worker.pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [serve] %(levelname)s: %(message)s')
+    try:
+        settings = config.load_configuration()
+    except config.ConfigurationError as e:
+        logging.critical("%s", e)
+        return 1
+    return Arbiter(settings).run()
+
+if __name__ == '__main__':
+    sys.exit(main())
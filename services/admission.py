@@ -0,0 +1,164 @@
+"""
+Admission control for expensive requests.
+
+The WSGI server has a fixed pool of worker threads shared by every route, so a
+burst of conversions could otherwise occupy all of them and starve /health and
+/Status/ping. AdmissionMiddleware sends POST requests to the heavy routes
+(ADMISSION_HEAVY_ROUTES) through a RouteLimiter: ADMISSION_HEAVY_SLOTS of them
+run at once, up to ADMISSION_HEAVY_QUEUE more wait for a slot for at most
+ADMISSION_QUEUE_TIMEOUT seconds, and anything beyond that is answered
+immediately with 503 and Retry-After. Heavy requests therefore never hold more
+than slots + queue server threads; the server runs with more threads than that
+(SERVER_THREADS), and the rest stay free for lightweight routes.
+"""
+import json
+import logging
+import threading
+import time
+
+from config import Config
+from monitoring import metrics
+
+HEAVY = 'heavy'
+
+
+class RouteLimiter:
+    """Counting semaphore with a bounded, time-limited wait queue."""
+
+    def __init__(self, slots, queue_size, timeout, queue_depth=None):
+        self.slots = slots
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.queue_depth = queue_depth  # Optional gauge tracking `waiting`
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if needed; returns False when rejected."""
+        with self._condition:
+            if self.active < self.slots:
+                self.active += 1
+                return True
+            if self.waiting >= self.queue_size:
+                return False
+            self.waiting += 1
+            if self.queue_depth is not None:
+                self.queue_depth.inc()
+            try:
+                admitted = self._condition.wait_for(lambda: self.active < self.slots, self.timeout)
+                if admitted:
+                    self.active += 1
+                return admitted
+            finally:
+                self.waiting -= 1
+                if self.queue_depth is not None:
+                    self.queue_depth.dec()
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class _ReleasingBody:
+    """Wraps a streamed response iterable, releasing the slot once the server closes it."""
+
+    def __init__(self, app_iter, release):
+        self._app_iter = app_iter
+        self._release = release
+
+    def __iter__(self):
+        return iter(self._app_iter)
+
+    def close(self):
+        try:
+            close = getattr(self._app_iter, 'close', None)
+            if close:
+                close()
+        finally:
+            self._release()
+
+
+class AdmissionMiddleware:
+    """
+    WSGI middleware limiting concurrent heavy requests. A slot is held until the
+    response body is produced: responses with a Content-Length (JSON, or files
+    that the server sends from disk through wsgi.file_wrapper) release it when
+    the app returns, streamed responses when the server closes them.
+    """
+
+    def __init__(self, wsgi_app, heavy_routes, slots, queue_size, timeout, retry_after):
+        self.wsgi_app = wsgi_app
+        self.heavy_routes = tuple(heavy_routes)
+        self.retry_after = retry_after
+        self.limiter = RouteLimiter(slots, queue_size, timeout, metrics.ADMISSION_QUEUE_DEPTH.labels(HEAVY))
+        self._active = metrics.ADMISSION_ACTIVE.labels(HEAVY)
+        self._wait = metrics.ADMISSION_WAIT.labels(HEAVY)
+        self._rejected = metrics.ADMISSION_REJECTED.labels(HEAVY)
+
+    def is_heavy(self, environ):
+        return environ.get('REQUEST_METHOD') == 'POST' and environ.get('PATH_INFO', '').startswith(self.heavy_routes)
+
+    def __call__(self, environ, start_response):
+        if not self.is_heavy(environ):
+            return self.wsgi_app(environ, start_response)
+
+        started = time.perf_counter()
+        admitted = self.limiter.acquire()
+        self._wait.observe(time.perf_counter() - started)
+        if not admitted:
+            self._rejected.inc()
+            logging.warning("Rejected %s %s: all %s heavy request slots are busy.",
+                            environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'), self.limiter.slots)
+            return self._reject(start_response)
+
+        self._active.inc()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._active.dec()
+                self.limiter.release()
+
+        has_length = {}
+
+        def record_start_response(status, headers, exc_info=None):
+            has_length['value'] = any(name.lower() == 'content-length' for name, _ in headers)
+            return start_response(status, headers, exc_info)
+
+        try:
+            app_iter = self.wsgi_app(environ, record_start_response)
+        except BaseException:
+            release()
+            raise
+
+        if has_length.get('value'):
+            release()
+            return app_iter
+        return _ReleasingBody(app_iter, release)
+
+    def _reject(self, start_response):
+        body = json.dumps({'message': 'The server is busy with other conversions. Please retry later.'}).encode('utf-8')
+        start_response('503 SERVICE UNAVAILABLE', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(self.retry_after)),
+        ])
+        return [body]
+
+
+def init_app(app):
+    """Install the admission middleware configured by the ADMISSION_* settings."""
+    if not Config.ADMISSION_CONTROL_ENABLED:
+        return
+    app.wsgi_app = AdmissionMiddleware(
+        app.wsgi_app,
+        heavy_routes=Config.ADMISSION_HEAVY_ROUTES,
+        slots=Config.ADMISSION_HEAVY_SLOTS,
+        queue_size=Config.ADMISSION_HEAVY_QUEUE,
+        timeout=Config.ADMISSION_QUEUE_TIMEOUT,
+        retry_after=Config.ADMISSION_RETRY_AFTER,
+    )
@@ -1,20 +1,52 @@
 from flask_restx import Namespace, Resource, reqparse
-from flask import send_file
+from flask import Response, request
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
 from auth.auth import api_auth # Import the new api_auth
 import base64
 import binascii
-from io import BytesIO
+import json
+import os
+import shutil
+import tempfile
+import zipfile
 from config import Config
+from monitoring.logs import SAMPLED
+from services.uploads import MULTIPART_OVERHEAD, detach_upload_stream, send_result_file, upload_limit
 import logging
 
 ns = Namespace('Base64', description='Base64 operations')
 
+# Read uploads in multiples of 3 bytes so every chunk encodes without padding
+# and the encoded chunks can simply be concatenated.
+ENCODE_CHUNK_SIZE = 3 * 64 * 1024
+# Raw Base64 request bodies are read in blocks of this size; decoding happens on
+# 4-character boundaries. Decoded output is kept in memory up to
+# DECODE_SPOOL_SIZE bytes before spilling to a temp file.
+DECODE_CHUNK_SIZE = 256 * 1024
+DECODE_SPOOL_SIZE = 1024 * 1024
+BASE64_WHITESPACE = b' \t\r\n'
+
+def max_upload_body_size():
+    return Config.MAX_UPLOAD_FILE_SIZE + MULTIPART_OVERHEAD
+
+def max_encoded_size():
+    """Length of the Base64 text of a MAX_UPLOAD_FILE_SIZE file, with room for MIME line breaks."""
+    encoded = (Config.MAX_UPLOAD_FILE_SIZE + 2) // 3 * 4
+    return encoded + encoded // 38
+
 parser_encode = reqparse.RequestParser()
 parser_encode.add_argument('bizDoc', location='files', type=FileStorage, required=True, help='The file to upload')
 parser_encode.add_argument('filename', location='form', type=str, required=False, help='Name of the file being uploaded')
 
+parser_encode_batch = reqparse.RequestParser()
+parser_encode_batch.add_argument('bizDoc', location='files', type=FileStorage, required=False, action='append', help='Files to encode')
+parser_encode_batch.add_argument('archive', location='files', type=FileStorage, required=False, help='Zip archive whose files are encoded')
+
+parser_decode_stream = reqparse.RequestParser()
+parser_decode_stream.add_argument('filename', location='args', type=str, required=True, help='Name of the file')
+
 parser_decode = reqparse.RequestParser()
 parser_decode.add_argument('base64', location='form', type=str, required=True, help='Base64-encoded file')
 parser_decode.add_argument('filename', location='form', type=str, required=True, help='Name of the file')
@@ -24,59 +56,233 @@ class Base64Encoder(Resource):
     @ns.expect(parser_encode)
     @ns.doc(security='apiKey')
     @api_auth.login_required
+    @upload_limit(max_upload_body_size)
     def post(self):
         """Encode file to Base64"""
         args = parser_encode.parse_args()
         file = args['bizDoc']
         filename = args['filename']
 
-        if not file:
-            logging.warning("No file provided for encoding.")
-            return {'message': 'No file provided'}, 400
-
-        if not filename:
-            filename = file.filename
-        
-        filename = secure_filename(filename)
-
-        content_length = getattr(file, "content_length", None)
-        if content_length is not None and content_length > Config.MAX_UPLOAD_FILE_SIZE:
-            logging.warning(f"File too large for encoding: {filename}. Size: {content_length} bytes.")
-            return {'message': f'File too large. Max size is {Config.MAX_UPLOAD_FILE_SIZE / (1024 * 1024)} MB'}, 413
-
-        if not self.allowed_file(filename):
-            logging.warning(f"File type not allowed for encoding: {filename}.")
-            return {'message': 'File type not allowed'}, 400
+        filename, error = self.check_upload(file, filename)
+        if error:
+            return error
 
         try:
             file_content = file.read()
             if not file_content:
-                logging.warning(f"Empty file provided for encoding: {filename}.")
+                logging.warning("Empty file provided for encoding: %s.", filename)
                 return {'message': 'File is empty'}, 400
             if len(file_content) > Config.MAX_UPLOAD_FILE_SIZE:
-                logging.warning(f"File too large after read for encoding: {filename}. Size: {len(file_content)} bytes.")
+                logging.warning("File too large after read for encoding: %s. Size: %s bytes.", filename, len(file_content))
                 return {'message': f'File too large. Max size is {Config.MAX_UPLOAD_FILE_SIZE / (1024 * 1024)} MB'}, 413
             encoded_content = base64.b64encode(file_content).decode('utf-8')
-            logging.info(f"Successfully encoded file: {filename}.")
+            logging.info("Successfully encoded file: %s.", filename, extra=SAMPLED)
             return {
                 'filename': filename,
                 'base64': encoded_content
             }, 200
         except Exception as e:
-            logging.error(f"Error encoding file {filename} to Base64: {e}", exc_info=True)
+            logging.error("Error encoding file %s to Base64: %s", filename, e, exc_info=True)
             return {'message': 'Error encoding file to Base64'}, 500
 
+    def check_upload(self, file, filename, size=None):
+        """
+        Validate an upload before encoding (`size` overrides the upload's content length).
+        Returns the sanitized filename and None, or None and an error response.
+        """
+        if not file:
+            logging.warning("No file provided for encoding.")
+            return None, ({'message': 'No file provided'}, 400)
+
+        if not filename:
+            filename = file.filename
+
+        filename = secure_filename(filename or '')
+
+        content_length = size if size is not None else getattr(file, "content_length", None)
+        if content_length is not None and content_length > Config.MAX_UPLOAD_FILE_SIZE:
+            logging.warning("File too large for encoding: %s. Size: %s bytes.", filename, content_length)
+            return None, ({'message': f'File too large. Max size is {Config.MAX_UPLOAD_FILE_SIZE / (1024 * 1024)} MB'}, 413)
+
+        if not self.allowed_file(filename):
+            logging.warning("File type not allowed for encoding: %s.", filename)
+            return None, ({'message': 'File type not allowed'}, 400)
+
+        return filename, None
+
     def allowed_file(self, filename):
         if '.' not in filename:
             return False
         ext = filename.rsplit('.', 1)[-1].lower()
         return ext in Config.ALLOWED_EXTENSIONS
 
+@ns.route('/encode/stream')
+class Base64StreamEncoder(Base64Encoder):
+    @ns.expect(parser_encode)
+    @ns.doc(security='apiKey')
+    @api_auth.login_required
+    @upload_limit(max_upload_body_size)
+    def post(self):
+        """Encode file to Base64, streaming the JSON response in constant memory"""
+        args = parser_encode.parse_args()
+        file = args['bizDoc']
+
+        filename, error = self.check_upload(file, args['filename'])
+        if error:
+            return error
+
+        size = upload_size(file.stream)
+        if size == 0:
+            logging.warning("Empty file provided for encoding: %s.", filename)
+            return {'message': 'File is empty'}, 400
+        if size is not None and size > Config.MAX_UPLOAD_FILE_SIZE:
+            logging.warning("File too large for encoding: %s. Size: %s bytes.", filename, size)
+            return {'message': f'File too large. Max size is {Config.MAX_UPLOAD_FILE_SIZE / (1024 * 1024)} MB'}, 413
+
+        logging.info("Streaming Base64 encoding of file: %s.", filename, extra=SAMPLED)
+        return Response(
+            generate_encoded_json(detach_upload_stream(file), filename),
+            mimetype='application/json'
+        )
+
+def upload_size(stream):
+    """Return the size of a seekable upload stream (rewound to the start), or None."""
+    try:
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+def iter_encoded_chunks(stream, chunk_size=ENCODE_CHUNK_SIZE):
+    """Yield the Base64 encoding of a binary stream chunk by chunk."""
+    remainder = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        data = remainder + chunk
+        aligned = len(data) - len(data) % 3
+        remainder = data[aligned:]
+        if aligned:
+            yield base64.b64encode(data[:aligned])
+    if remainder:
+        yield base64.b64encode(remainder)
+
+def generate_encoded_json(stream, filename):
+    """Yield the same JSON document as /encode, with the Base64 body streamed."""
+    try:
+        yield f'{{"filename": {json.dumps(filename)}, "base64": "'.encode('utf-8')
+        yield from iter_encoded_chunks(stream)
+        yield b'"}\n'
+    finally:
+        stream.close()
+
+# Files per batch request; also bounds the work done for one zip archive
+MAX_BATCH_FILES = 1000
+
+@ns.route('/encode/batch')
+class Base64BatchEncoder(Base64Encoder):
+    @ns.expect(parser_encode_batch)
+    @ns.doc(security='apiKey', description='Upload several bizDoc files and/or one zip archive. The response has one JSON line per file: {"filename", "base64"} or {"filename", "error", "status"}.')
+    @api_auth.login_required
+    @upload_limit(lambda: Config.MAX_BATCH_UPLOAD_SIZE)
+    def post(self):
+        """Encode many files to Base64, streaming one NDJSON line per file"""
+        args = parser_encode_batch.parse_args()
+        files = [f for f in (args['bizDoc'] or []) if f]
+        archive_upload = args['archive']
+        if not files and not archive_upload:
+            return {'message': 'No file provided'}, 400
+
+        archive = None
+        members = []
+        if archive_upload:
+            try:
+                archive = zipfile.ZipFile(detach_upload_stream(archive_upload))
+            except (zipfile.BadZipFile, OSError):
+                logging.warning("Invalid zip archive provided for batch encoding: %s.", archive_upload.filename)
+                return {'message': 'Invalid zip archive'}, 400
+            members = [info for info in archive.infolist() if not info.is_dir()]
+
+        if len(files) + len(members) > MAX_BATCH_FILES:
+            if archive is not None:
+                archive.fp.close()
+            return {'message': f'Too many files. Max is {MAX_BATCH_FILES} per batch'}, 413
+
+        logging.info("Streaming Base64 batch encoding of %s file(s).", len(files) + len(members), extra=SAMPLED)
+        uploads = [(file, detach_upload_stream(file)) for file in files]
+        return Response(generate_batch_ndjson(self, uploads, archive, members), mimetype='application/x-ndjson')
+
+    def check_batch_upload(self, file, filename, size):
+        """check_upload for one batch member; returns the filename and an NDJSON error object or None."""
+        checked, error = self.check_upload(file, filename, size)
+        if error is None and size == 0:
+            logging.warning("Empty file provided for encoding: %s.", filename)
+            error = ({'message': 'File is empty'}, 400)
+        if error is not None:
+            body, status = error
+            return filename, {'filename': filename, 'error': body['message'], 'status': status}
+        return checked, None
+
+def generate_batch_ndjson(encoder, uploads, archive=None, members=()):
+    """
+    Yield one JSON line per uploaded file and zip archive member, in order.
+    Each file is encoded in chunks, so memory stays bounded whatever its size;
+    failing files yield an error line and the batch continues.
+    """
+    try:
+        for file, stream in uploads:
+            filename, error = encoder.check_batch_upload(file, file.filename, upload_size(stream))
+            yield from _batch_line(filename, stream, error)
+
+        for info in members:
+            filename, error = encoder.check_batch_upload(info, os.path.basename(info.filename), info.file_size)
+            stream = None
+            if error is None:
+                stream, error = _extract_member(archive, info, filename)
+            yield from _batch_line(filename, stream, error)
+    finally:
+        for _, stream in uploads:
+            stream.close()
+        if archive is not None:
+            archive.fp.close()
+            archive.close()
+
+def _extract_member(archive, info, filename):
+    """
+    Copy a zip member to a spooled temp file so decompression errors are
+    reported as an error line instead of ending the response mid-line.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=DECODE_SPOOL_SIZE)
+    try:
+        with archive.open(info) as member:
+            shutil.copyfileobj(member, output, ENCODE_CHUNK_SIZE)
+    except (zipfile.BadZipFile, RuntimeError, NotImplementedError, OSError, EOFError) as e:
+        output.close()
+        logging.warning("Could not extract %s from zip archive for batch encoding: %s", filename, e)
+        return None, {'filename': filename, 'error': 'Could not extract file from archive', 'status': 400}
+    output.seek(0)
+    return output, None
+
+def _batch_line(filename, stream, error):
+    if error is not None:
+        yield json.dumps(error).encode('utf-8') + b'\n'
+        return
+    try:
+        yield f'{{"filename": {json.dumps(filename)}, "base64": "'.encode('utf-8')
+        yield from iter_encoded_chunks(stream)
+        yield b'"}\n'
+    finally:
+        stream.close()
+
 @ns.route('/decode')
 class Base64Decoder(Resource):
     @ns.expect(parser_decode)
     @ns.doc(security='apiKey')
     @api_auth.login_required
+    @upload_limit(lambda: max_encoded_size() + MULTIPART_OVERHEAD, max_encoded_size)
     def post(self):
         """Decode Base64 to a file"""
         args = parser_decode.parse_args()
@@ -87,17 +293,104 @@ class Base64Decoder(Resource):
 
         try:
             decoded_content = base64.b64decode(base64_content)
-            stream = BytesIO(decoded_content)
-            logging.info(f"Successfully decoded Base64 content to file: {filename}.")
-            return send_file(
-                stream,
-                as_attachment=True,
-                download_name=filename,
-                mimetype='application/octet-stream'
-            )
         except binascii.Error as e:
-            logging.warning(f"Invalid Base64 content provided for decoding {filename}: {e}")
+            logging.warning("Invalid Base64 content provided for decoding %s: %s", filename, e)
             return {'message': 'Invalid Base64 content'}, 400
+
+        output = tempfile.SpooledTemporaryFile(max_size=DECODE_SPOOL_SIZE)
+        try:
+            output.write(decoded_content)
+            del decoded_content
+            output.seek(0)
+            logging.info("Successfully decoded Base64 content to file: %s.", filename, extra=SAMPLED)
+            return send_result_file(output, filename, 'application/octet-stream')
+        except Exception as e:
+            output.close()
+            logging.error("Error decoding Base64 content to file %s: %s", filename, e, exc_info=True)
+            return {'message': 'Error decoding Base64'}, 500
+
+@ns.route('/decode/stream')
+class Base64StreamDecoder(Resource):
+    @ns.expect(parser_decode_stream)
+    @ns.doc(security='apiKey', description='Send the Base64 text as the raw request body (chunked transfer encoding is supported).')
+    @api_auth.login_required
+    @upload_limit(lambda: Config.MAX_STREAM_DECODE_SIZE)
+    def post(self):
+        """Decode a raw Base64 request body to a file without buffering it in memory"""
+        args = parser_decode_stream.parse_args()
+        filename = secure_filename(args['filename'])
+
+        # Oversized Content-Length bodies were rejected by upload_limit already
+        max_size = Config.MAX_STREAM_DECODE_SIZE
+        output = tempfile.SpooledTemporaryFile(max_size=DECODE_SPOOL_SIZE)
+        try:
+            decoded_size = decode_base64_stream(request.stream, output, max_size)
+        except binascii.Error as e:
+            output.close()
+            logging.warning("Invalid Base64 content provided for decoding %s: %s", filename, e)
+            return {'message': 'Invalid Base64 content'}, 400
+        except RequestEntityTooLarge:
+            output.close()
+            logging.warning("Base64 body too large for decoding %s.", filename)
+            return {'message': f'Request body too large. Max size is {max_size / (1024 * 1024)} MB'}, 413
+        except BadRequest as e:
+            # A gzip-compressed body that could not be inflated
+            output.close()
+            logging.warning("Unreadable request body for decoding %s: %s", filename, e.description)
+            return {'message': e.description}, 400
         except Exception as e:
-            logging.error(f"Error decoding Base64 content to file {filename}: {e}", exc_info=True)
+            output.close()
+            logging.error("Error decoding Base64 content to file %s: %s", filename, e, exc_info=True)
             return {'message': 'Error decoding Base64'}, 500
+
+        if decoded_size == 0:
+            output.close()
+            logging.warning("Empty Base64 body provided for decoding %s.", filename)
+            return {'message': 'No Base64 content provided'}, 400
+
+        output.seek(0)
+        logging.info("Successfully decoded streamed Base64 content to file: %s.", filename, extra=SAMPLED)
+        return send_result_file(output, filename, 'application/octet-stream')
+
+def decode_base64_stream(source, target, max_size, chunk_size=DECODE_CHUNK_SIZE):
+    """
+    Decode Base64 text read from `source` into the binary file `target`.
+
+    Whitespace (e.g. MIME line breaks) is ignored and the text is decoded on
+    4-character boundaries. Raises binascii.Error for invalid content and
+    RequestEntityTooLarge once more than `max_size` bytes have been read.
+    Returns the number of decoded bytes written.
+    """
+    remainder = b''
+    received = 0
+    written = 0
+    padded = False
+
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        received += len(chunk)
+        if received > max_size:
+            raise RequestEntityTooLarge()
+
+        chunk = chunk.translate(None, BASE64_WHITESPACE)
+        if not chunk:
+            continue
+        if padded:
+            raise binascii.Error('Excess data after padding')
+
+        data = remainder + chunk
+        aligned = len(data) - len(data) % 4
+        remainder = data[aligned:]
+        if aligned:
+            block = data[:aligned]
+            written += target.write(base64.b64decode(block, validate=True))
+            # Padding may only appear at the very end of the input
+            padded = block.endswith(b'=')
+            if padded and remainder:
+                raise binascii.Error('Excess data after padding')
+
+    if remainder:
+        raise binascii.Error('Incorrect padding')
+    return written
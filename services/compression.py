@@ -0,0 +1,207 @@
+"""
+gzip request bodies and gzip responses.
+
+CompressionMiddleware inflates request bodies sent with `Content-Encoding: gzip`
+while the application reads them, so multipart parsing, the CSV reader and the
+streaming Base64 decoder see the plain bytes without the body ever being
+inflated as a whole. The endpoint's upload limit applies to the inflated size.
+Other content codings are refused with 415.
+
+Responses with a compressible Content-Type (JSON, NDJSON, CSV, other text) are
+gzipped block by block as they are sent when the client accepts gzip. Streamed
+responses (without Content-Length) are flushed after every block, so they stay
+streamed. Responses that carry a Content-Encoding already, or are smaller
+than COMPRESSION_MIN_SIZE, are passed through.
+"""
+import io
+import json
+import zlib
+
+from werkzeug.exceptions import BadRequest
+from werkzeug.http import parse_accept_header
+from werkzeug.wsgi import LimitedStream
+
+from config import Config
+from monitoring.metrics import REQUEST_LENGTH_ENVIRON_KEY, count_request_body
+
+# zlib window bits selecting the gzip container
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Compressed bytes read from the client per step
+DECODE_CHUNK_SIZE = 64 * 1024
+
+GZIP_CODINGS = ('gzip', 'x-gzip')
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml')
+
+
+class GzipDecodingStream(io.RawIOBase):
+    """
+    Readable stream of the inflated contents of the gzip stream `source`
+    (several concatenated members are allowed). Compressed data is read in
+    DECODE_CHUNK_SIZE chunks and inflated only as far as each read asks for, so
+    memory use stays bounded whatever the compression ratio. Corrupt or
+    truncated input raises BadRequest.
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        self._input = b''
+        self._output = b''
+        self._offset = 0
+        self._in_member = False
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._offset >= len(self._output):
+            if self._eof:
+                return 0
+            self._inflate(max(len(buffer), 1))
+        count = min(len(buffer), len(self._output) - self._offset)
+        buffer[:count] = self._output[self._offset:self._offset + count]
+        self._offset += count
+        return count
+
+    def _inflate(self, size):
+        if not self._input:
+            self._input = self._source.read(DECODE_CHUNK_SIZE)
+            if not self._input:
+                if self._in_member:
+                    raise BadRequest('The gzip request body is truncated.')
+                self._eof = True
+                return
+        if self._decompressor.eof:
+            self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        try:
+            self._output = self._decompressor.decompress(self._input, size)
+        except zlib.error as e:
+            raise BadRequest(f'The request body is not valid gzip data: {e}') from e
+        self._offset = 0
+        self._in_member = not self._decompressor.eof
+        # Input beyond `size` inflated bytes, or the start of the next member
+        self._input = self._decompressor.unconsumed_tail or self._decompressor.unused_data
+
+
+class _GzipBody:
+    """
+    Response iterable gzipping the chunks of `app_iter` as they are sent. For
+    `streamed` responses (no Content-Length, e.g. NDJSON) every chunk is
+    sync-flushed, so the client can inflate each one as it arrives instead of
+    waiting until zlib's buffer fills.
+    """
+
+    def __init__(self, app_iter, level, streamed=False):
+        self._app_iter = app_iter
+        self._level = level
+        self._streamed = streamed
+
+    def __iter__(self):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, GZIP_WBITS)
+        for chunk in self._app_iter:
+            data = compressor.compress(chunk)
+            if self._streamed and chunk:
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def close(self):
+        close = getattr(self._app_iter, 'close', None)
+        if close:
+            close()
+
+
+def is_compressible(content_type):
+    mimetype = content_type.split(';', 1)[0].strip().lower()
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+def accepts_gzip(environ):
+    accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+    return any(accepted.quality(coding) > 0 for coding in GZIP_CODINGS)
+
+
+class CompressionMiddleware:
+    """WSGI middleware inflating gzip request bodies and gzipping compressible responses."""
+
+    def __init__(self, wsgi_app, level=6, min_size=1024):
+        self.wsgi_app = wsgi_app
+        self.level = level
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        coding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if coding in GZIP_CODINGS:
+            self.decode_request(environ)
+        elif coding not in ('', 'identity'):
+            return self._unsupported(start_response, coding)
+
+        compress = environ.get('REQUEST_METHOD') != 'HEAD' and accepts_gzip(environ)
+        compressing = {}
+
+        def compressing_start_response(status, headers, exc_info=None):
+            header_names = {name.lower(): value for name, value in headers}
+            if is_compressible(header_names.get('content-type', '')):
+                vary = header_names.get('vary')
+                if vary is None:
+                    headers.append(('Vary', 'Accept-Encoding'))
+                elif 'accept-encoding' not in vary.lower():
+                    headers = [(name, f'{value}, Accept-Encoding' if name.lower() == 'vary' else value)
+                               for name, value in headers]
+                if compress and self._should_compress(status, header_names):
+                    headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+                    headers.append(('Content-Encoding', 'gzip'))
+                    compressing['body'] = True
+                    compressing['streamed'] = 'content-length' not in header_names
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.wsgi_app(environ, compressing_start_response)
+        if compressing.get('body'):
+            return _GzipBody(app_iter, self.level, compressing['streamed'])
+        return app_iter
+
+    def decode_request(self, environ):
+        """Replace the request body by its inflated contents, read on demand."""
+        length = environ.pop('CONTENT_LENGTH', '')
+        if length.isdigit():
+            # Keep the transferred size for quotas and metrics
+            environ[REQUEST_LENGTH_ENVIRON_KEY] = int(length)
+            stream = LimitedStream(environ['wsgi.input'], int(length))
+        else:
+            # Quotas and metrics count the compressed bytes as they are read
+            stream = count_request_body(environ)
+        environ['wsgi.input'] = GzipDecodingStream(stream)
+        # The inflated size is unknown; the application reads to the end of the
+        # stream, limited to the endpoint's maximum body size.
+        environ['wsgi.input_terminated'] = True
+        del environ['HTTP_CONTENT_ENCODING']
+
+    def _should_compress(self, status, headers):
+        code = int(status.split(' ', 1)[0])
+        if code < 200 or code in (204, 304):
+            return False
+        if headers.get('content-encoding', 'identity').lower() != 'identity':
+            return False
+        if 'no-transform' in headers.get('cache-control', '').lower():
+            return False
+        length = headers.get('content-length')
+        return length is None or int(length) >= self.min_size
+
+    def _unsupported(self, start_response, coding):
+        body = json.dumps({'message': f"Content-Encoding '{coding}' is not supported. Use gzip."}).encode('utf-8')
+        start_response('415 UNSUPPORTED MEDIA TYPE', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Accept-Encoding', 'gzip'),
+        ])
+        return [body]
+
+
+def init_app(app):
+    """Install the compression middleware configured by the COMPRESSION_* settings."""
+    if not Config.COMPRESSION_ENABLED:
+        return
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, Config.COMPRESSION_LEVEL, Config.COMPRESSION_MIN_SIZE)
@@ -0,0 +1,180 @@
+"""
+CSV inspection: dialect, size and column profile of an upload without converting it.
+
+Only the head of the file (SAMPLE_BYTES) is decoded and parsed. The encoding,
+delimiter and header row are sniffed from it, and the column widths, types and
+empty cells are profiled over its first SAMPLE_ROWS rows. The rest of the file
+is only scanned for newlines in READ_CHUNK_SIZE blocks, so counting the lines
+of a large file costs about as much as reading it once.
+"""
+import codecs
+import csv
+import gzip
+import io
+import zlib
+from collections import Counter
+from itertools import islice
+
+from monitoring import timing
+from services.csv_types import TEXT
+
+# Head of the file that is decoded and parsed
+SAMPLE_BYTES = 64 * 1024
+
+# Rows profiled, as many as the converter samples for column widths
+# (xlsx_writer.COLUMN_WIDTH_SAMPLE_ROWS; not imported to keep openpyxl unloaded)
+SAMPLE_ROWS = 1000
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Candidate delimiters; on a tie the earlier one wins. The semicolon comes
+# first because it is the converter's default and decimal commas are common.
+DELIMITERS = (';', ',', '\t')
+
+# Assumed for files that are not valid UTF-8
+FALLBACK_ENCODING = 'cp1252'
+
+
+def inspect_csv(stream, type_inference, compressed=False, delimiters=DELIMITERS):
+    """
+    Profile the CSV in the binary file `stream` (gzip-compressed if `compressed`).
+    Column types are detected with `type_inference`. Returns a dict with the
+    encoding, delimiter, header flag, line count, column profiles and warnings.
+    Raises ValueError for empty or unreadable files.
+    """
+    try:
+        stream.seek(0)
+    except (AttributeError, OSError):
+        pass
+    source = gzip.GzipFile(fileobj=stream, mode='rb') if compressed else stream
+
+    try:
+        head = source.read(SAMPLE_BYTES)
+        if not head:
+            raise ValueError('The provided CSV file is empty.')
+        with timing.phase('count_lines'):
+            line_count, rest_size = count_lines(source, head)
+    except (OSError, EOFError, zlib.error) as e:
+        if not compressed:
+            raise
+        raise ValueError(f'Could not read the gzip-compressed file: {e}') from e
+
+    with timing.phase('sniff'):
+        complete = rest_size == 0
+        encoding = detect_encoding(head, complete)
+        text = decode_head(head, encoding, complete)
+        delimiter, rows = sniff_delimiter(text, delimiters)
+        if not rows:
+            raise ValueError('The provided CSV file is empty.')
+        has_header = detect_header(rows, type_inference)
+        if not has_header:
+            rows = rows[:SAMPLE_ROWS]
+        columns = profile_columns(rows, has_header, type_inference)
+
+    return {
+        'encoding': encoding,
+        'delimiter': delimiter,
+        'has_header': has_header,
+        'line_count': line_count,
+        'sample_rows': len(rows) - has_header,
+        'column_count': len(columns),
+        'columns': columns,
+        'warnings': _warnings(encoding, rows),
+    }
+
+def count_lines(source, head):
+    """
+    Count the lines of `head` plus the rest of `source` (a last line without a
+    newline counts too). Returns the line count and the size of the rest.
+    """
+    newlines = head.count(b'\n')
+    last = head[-1:]
+    rest_size = 0
+    for chunk in iter(lambda: source.read(READ_CHUNK_SIZE), b''):
+        newlines += chunk.count(b'\n')
+        rest_size += len(chunk)
+        last = chunk[-1:]
+    return newlines + (last != b'\n'), rest_size
+
+def detect_encoding(head, complete):
+    """'utf-8-sig' or 'utf-16' for files with a byte order mark, else 'utf-8' or FALLBACK_ENCODING."""
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        # A multi-byte character may be cut off at the end of the head
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=complete)
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return 'utf-8'
+
+def decode_head(head, encoding, complete):
+    """The decoded head, cut after its last complete line unless it is the whole file."""
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(head, final=complete)
+    if not complete and '\n' in text:
+        text = text[:text.rindex('\n') + 1]
+    return text
+
+def parse_rows(text, delimiter):
+    """The first SAMPLE_ROWS + 1 non-empty rows of `text` (a header plus SAMPLE_ROWS rows)."""
+    reader = csv.reader(io.StringIO(text, newline=''), delimiter=delimiter)
+    return list(islice((row for row in reader if row), SAMPLE_ROWS + 1))
+
+def sniff_delimiter(text, delimiters):
+    """
+    Pick the delimiter that splits the sampled rows into more than one column
+    most consistently. Returns the delimiter and the rows parsed with it.
+    """
+    best = None
+    for priority, delimiter in enumerate(delimiters):
+        rows = parse_rows(text, delimiter)
+        counts = Counter(len(row) for row in rows)
+        columns, frequency = counts.most_common(1)[0] if counts else (0, 0)
+        score = (columns > 1, frequency / len(rows) if rows else 0, -priority)
+        if best is None or score > best[0]:
+            best = (score, delimiter, rows)
+    return best[1], best[2]
+
+def detect_header(rows, type_inference):
+    """
+    True if the first row looks like a header: it has a value that does not
+    fit the type detected for its column, or, when every column is text, its
+    values are all present and distinct.
+    """
+    first = rows[0]
+    column_types = type_inference.infer_column_types(rows[1:])
+    typed = [(value, kind) for value, kind in zip(first, column_types) if kind != TEXT]
+    if typed:
+        return any(value and not type_inference.matches(value, kind) for value, kind in typed)
+    return all(first) and len(set(first)) == len(first)
+
+def profile_columns(rows, has_header, type_inference):
+    """Name, detected type, widest value and empty cells of every column in the sampled rows."""
+    header = rows[0] if has_header else []
+    data = rows[1:] if has_header else rows
+    column_count = max(len(row) for row in rows)
+    column_types = type_inference.infer_column_types(data)
+
+    columns = []
+    for index in range(column_count):
+        values = [row[index] if index < len(row) else '' for row in data]
+        columns.append({
+            'index': index,
+            'name': header[index] if index < len(header) else None,
+            'type': column_types[index] if index < len(column_types) else TEXT,
+            'max_width': max((len(value) for value in values + header[index:index + 1]), default=0),
+            'empty': sum(1 for value in values if not value),
+        })
+    return columns
+
+def _warnings(encoding, rows):
+    warnings = []
+    if encoding == 'utf-8-sig':
+        warnings.append('The file starts with a UTF-8 byte order mark, which will be part of the first cell.')
+    elif encoding != 'utf-8':
+        warnings.append(f'The file does not look like UTF-8 (read as {encoding}). Conversions read UTF-8 and will fail or garble characters.')
+    ragged = sum(1 for row in rows if len(row) != len(rows[0]))
+    if ragged:
+        warnings.append(f'{ragged} of the first {len(rows)} rows have a different number of fields than the first row.')
+    return warnings
@@ -0,0 +1,172 @@
+"""
+Background CSV to XLS conversion jobs.
+
+Job status lives in Redis (a hash per job that expires after CSV_JOB_RESULT_TTL)
+so any worker can report it; uploads and the finished workbook live on disk in
+CSV_JOB_RESULT_DIR. Conversions run in a small thread pool using the same
+build_workbook pipeline as the synchronous endpoint.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from config import Config
+
+JOB_KEY_PREFIX = "api_toolbox:csv2xls:job:"
+RESULT_FILENAME = "result.xlsx"
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class JobStore:
+    """Job status records in Redis. Any redis-py compatible client works, including fakeredis."""
+
+    def __init__(self, redis_client, ttl):
+        self.redis = redis_client
+        self.ttl = ttl
+
+    def create(self, job_id, **fields):
+        self.update(job_id, **fields)
+
+    def update(self, job_id, **fields):
+        key = JOB_KEY_PREFIX + job_id
+        mapping = {name: '' if value is None else str(value) for name, value in fields.items()}
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def get(self, job_id):
+        data = self.redis.hgetall(JOB_KEY_PREFIX + job_id)
+        if not data:
+            return None
+        return {
+            (name.decode('utf-8') if isinstance(name, bytes) else name):
+            (value.decode('utf-8') if isinstance(value, bytes) else value)
+            for name, value in data.items()
+        }
+
+
+_executor = None
+
+def get_executor():
+    """Return the shared job thread pool, starting it on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=Config.CSV_JOB_WORKERS, thread_name_prefix="csv2xls-job")
+    return _executor
+
+def results_dir():
+    """Directory holding job inputs and results."""
+    path = Config.CSV_JOB_RESULT_DIR or os.path.join(tempfile.gettempdir(), "api_toolbox_jobs")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def job_dir(job_id):
+    return os.path.join(results_dir(), job_id)
+
+def result_path(job_id):
+    return os.path.join(job_dir(job_id), RESULT_FILENAME)
+
+def is_valid_job_id(job_id):
+    """Job ids are uuid4 hex strings; anything else never maps to a directory."""
+    try:
+        return uuid.UUID(hex=job_id).hex == job_id
+    except ValueError:
+        return False
+
+def cleanup_expired_results(now=None):
+    """Remove job directories older than the result TTL."""
+    now = now or time.time()
+    base = results_dir()
+    for name in os.listdir(base):
+        path = os.path.join(base, name)
+        try:
+            if now - os.path.getmtime(path) > Config.CSV_JOB_RESULT_TTL:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def submit_job(store, owner, separator, sheet_jobs, table_style, author, title, download_name, type_inference=None):
+    """
+    Spool the uploads to the job directory, record the job as queued and hand it to
+    the thread pool. Must be called while the uploads are still open (i.e. within
+    the request). Returns the new job id.
+    """
+    from services.xlsx_writer import SheetJob
+
+    cleanup_expired_results()
+
+    job_id = uuid.uuid4().hex
+    directory = job_dir(job_id)
+    os.makedirs(directory)
+
+    try:
+        spooled_jobs = []
+        for index, job in enumerate(sheet_jobs, start=1):
+            path = os.path.join(directory, f"input_{index}.csv")
+            stream = job.source.stream
+            try:
+                stream.seek(0)
+            except (AttributeError, OSError):
+                pass
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(stream, f)
+            spooled_jobs.append(SheetJob(path, job.filename, job.sheet_title, job.table_index))
+
+        store.create(
+            job_id,
+            status=STATUS_QUEUED,
+            owner=owner,
+            filename=download_name,
+            sheets_total=len(spooled_jobs),
+            sheets_done=0,
+            created=datetime.now(timezone.utc).isoformat(),
+        )
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+
+    get_executor().submit(_run_job, store, job_id, separator, spooled_jobs, table_style, author, title, type_inference)
+    logging.info("Queued csv2xls job %s with %s file(s) for %s.", job_id, len(spooled_jobs), owner)
+    return job_id
+
+def _run_job(store, job_id, separator, sheet_jobs, table_style, author, title, type_inference=None):
+    # Imported here so openpyxl is only loaded once conversions are requested
+    from services.xlsx_writer import CsvConversionError, build_workbook
+
+    directory = job_dir(job_id)
+    partial_path = os.path.join(directory, RESULT_FILENAME + ".part")
+    store.update(job_id, status=STATUS_RUNNING, started=datetime.now(timezone.utc).isoformat())
+
+    try:
+        build_workbook(
+            sheet_jobs, separator, partial_path, table_style, author, title,
+            on_sheet_done=lambda count: store.update(job_id, sheets_done=count),
+            type_inference=type_inference,
+        )
+        os.replace(partial_path, os.path.join(directory, RESULT_FILENAME))
+        store.update(job_id, status=STATUS_DONE, finished=datetime.now(timezone.utc).isoformat())
+        logging.info("csv2xls job %s finished.", job_id)
+    except CsvConversionError as e:
+        store.update(job_id, status=STATUS_FAILED, message=str(e), finished=datetime.now(timezone.utc).isoformat())
+        logging.warning("csv2xls job %s failed: %s", job_id, e)
+    except Exception as e:
+        store.update(job_id, status=STATUS_FAILED, message='Conversion failed', finished=datetime.now(timezone.utc).isoformat())
+        logging.error("csv2xls job %s crashed: %s", job_id, e, exc_info=True)
+    finally:
+        for job in sheet_jobs:
+            try:
+                os.remove(job.source)
+            except OSError:
+                pass
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
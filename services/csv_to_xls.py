@@ -1,15 +1,18 @@
-from flask import send_file
+from flask import current_app, send_file, url_for
 from flask_restx import Namespace, Resource, reqparse, abort
 from werkzeug.datastructures import FileStorage
-import csv
-import io
 import os
 import re
-from openpyxl import Workbook
-from openpyxl.worksheet.table import Table, TableStyleInfo
-from openpyxl.utils import get_column_letter
+import tempfile
 from auth.auth import api_auth # Import the new api_auth
-import logging
+from config import Config
+from monitoring import timing
+from services import csv_inspect, csv_jobs, result_cache
+from services.csv_types import TypeInference
+from services.uploads import send_result_file, upload_limit
+
+# services.xlsx_writer (and with it openpyxl) is imported by the request
+# handlers, so the module is only loaded once a conversion is requested.
 
 ns = Namespace('csv2xls', description='CSV to XLS operations')
 
@@ -17,9 +20,11 @@ ns = Namespace('csv2xls', description='CSV to XLS operations')
 SEPARATOR_CHOICES = ('comma', 'semicolon', 'tab')
 TABLE_STYLE_CHOICES = ('TableStyleMedium2', 'TableStyleMedium9', 'TableStyleMedium15', 'TableStyleLight1', 'TableStyleDark1')
 LANG_CHOICES = ('SV', 'DA', 'FI', 'NO', 'EN')
+# Accepted uploads; .csv.gz files are inflated while they are converted
+CSV_SUFFIXES = ('.csv', '.csv.gz')
 
 parser = reqparse.RequestParser()
-parser.add_argument('file', location='files', type=FileStorage, required=True, action='append', help='One or more CSV files to upload')
+parser.add_argument('file', location='files', type=FileStorage, required=True, action='append', help='One or more CSV files to upload (.csv or gzip-compressed .csv.gz)')
 parser.add_argument('separator', type=str, required=False, default='semicolon', choices=SEPARATOR_CHOICES, help='The separator used in the CSV file.')
 parser.add_argument('create_table', type=str, required=False, default='false', choices=('true', 'false'), help='Should the Excel output include a formatted table?')
 parser.add_argument('table_style', type=str, required=False, default='TableStyleMedium9', choices=TABLE_STYLE_CHOICES, help='The visual style to apply to the Excel table.')
@@ -27,19 +32,29 @@ parser.add_argument('lang', type=str, required=False, default='SV', choices=LANG
 parser.add_argument('author', type=str, required=False, default='NorthXL.se', help='The author property to set in the Excel file metadata.')
 parser.add_argument('title', type=str, required=False, default='', help='The title property to set in the Excel file metadata.')
 parser.add_argument('sheet_name', type=str, required=False, action='append', help='Optional custom sheet names (per file, invalid characters removed).')
+parser.add_argument('infer_types', type=str, required=False, default='false', choices=('true', 'false'), help='Write numbers, dates and booleans as typed cells instead of text (decimal comma for SV/DA/FI/NO).')
+
+parser_inspect = reqparse.RequestParser()
+parser_inspect.add_argument('file', location='files', type=FileStorage, required=True, help='The CSV file to inspect (.csv or gzip-compressed .csv.gz)')
+parser_inspect.add_argument('lang', type=str, required=False, default='SV', choices=LANG_CHOICES, help='Language code whose decimal and date formats are used to detect column types.')
 
 # --- Mappings ---
 SEPARATOR_MAP = {'comma': ',', 'semicolon': ';', 'tab': '\t'}
 SHEET_NAME_MAP = {'SV': 'Blad1', 'DA': 'Ark1', 'FI': 'Taulukko1', 'NO': 'Ark1', 'EN': 'Sheet1'}
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 
 @ns.route('')
 class CsvToXlsConverter(Resource):
     @ns.expect(parser)
     @ns.doc(security='apiKey')
     @api_auth.login_required
+    @upload_limit(lambda: Config.MAX_CSV_UPLOAD_SIZE)
     def post(self):
         """Convert CSV file to Excel with optional table formatting and custom metadata."""
-        args = parser.parse_args()
+        from services.xlsx_writer import CsvConversionError, build_workbook
+
+        with timing.phase('parse'):
+            args = parser.parse_args()
         files = args['file'] or []
         if not isinstance(files, list):
             files = [files]
@@ -48,127 +63,203 @@ class CsvToXlsConverter(Resource):
         if not files:
             abort(400, 'At least one CSV file must be provided.')
 
-        sep = SEPARATOR_MAP.get(args['separator'], ';')
-        base_sheet_template = SHEET_NAME_MAP.get(args['lang'], 'Sheet1')
-        sheet_name_inputs = args.get('sheet_name') or []
-        if isinstance(sheet_name_inputs, str):
-            sheet_name_inputs = [sheet_name_inputs]
-        create_table_flag = args['create_table']
-        create_table = isinstance(create_table_flag, str) and create_table_flag.lower() == 'true'
-
-        output = io.BytesIO()
-        wb = Workbook()
-        wb.properties.creator = args['author']
-        wb.properties.title = args['title']
-        used_sheet_names = set()
-        table_counter = 0
-
-        for index, uploaded_file in enumerate(files, start=1):
-            if not uploaded_file.filename or not uploaded_file.filename.lower().endswith('.csv'):
-                abort(400, f'Invalid file format for "{uploaded_file.filename}". Only .csv files are supported.')
-
-            requested_name = ''
-            if isinstance(sheet_name_inputs, list) and len(sheet_name_inputs) >= index:
-                requested_name = sheet_name_inputs[index - 1] or ''
-
-            default_sheet_name = default_sheet_name_for_index(base_sheet_template, index)
-            sanitized_name = sanitize_sheet_name(requested_name, default_sheet_name)
-            sheet_name = ensure_unique_sheet_name(sanitized_name, used_sheet_names)
-
-            ws = wb.active if index == 1 else wb.create_sheet()
-            ws.title = sheet_name
-
-            try:
-                write_csv_to_sheet(uploaded_file, ws, sep)
-            except ValueError as value_error:
-                abort(400, str(value_error))
-            except Exception as e:
-                logging.error(f"Error processing CSV file '{uploaded_file.filename}': {e}")
-                abort(400, f"Could not process CSV file '{uploaded_file.filename}'. Please check the file format and the selected separator. Error: {e}")
-
-            if create_table:
-                table_counter += 1
-                generate_table(ws, args['table_style'], table_counter, sheet_name)
-            
-        wb.save(output)
-        output.seek(0)
-        
-        if len(files) == 1:
-            base_filename = os.path.splitext(files[0].filename)[0] or 'converted_csv'
-        else:
-            base_name = os.path.splitext(files[0].filename or 'converted')[0]
-            base_filename = f"{base_name}_batch"
-        new_filename = f"{base_filename}.xlsx"
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            download_name=new_filename,
-            as_attachment=True
+        sep, sheet_jobs = plan_sheet_jobs(args, files)
+        type_inference = type_inference_for(args)
+
+        def build(output):
+            build_workbook(sheet_jobs, sep, output, args['table_style'], args['author'], args['title'],
+                           type_inference=type_inference)
+
+        cache = result_cache.get_cache(current_app.config["SESSION_REDIS"])
+        cache_status = None
+        try:
+            if cache is None:
+                output = build_to_tempfile(build)
+            else:
+                with timing.phase('cache_lookup'):
+                    key = result_cache.cache_key(
+                        (job.source.stream for job in sheet_jobs),
+                        cache_params(sep, sheet_jobs, args, type_inference),
+                    )
+                    output = cache.get(key)
+                cache_status = 'HIT' if output else 'MISS'
+                if output is None:
+                    output = cache.put(key, build)
+        except CsvConversionError as e:
+            abort(400, str(e))
+
+        response = send_result_file(output, output_filename(files), XLSX_MIMETYPE)
+        if cache_status:
+            response.headers['X-Cache'] = cache_status
+        return response
+
+@ns.route('/inspect')
+class CsvInspector(Resource):
+    @ns.expect(parser_inspect)
+    @ns.doc(security='apiKey')
+    @api_auth.login_required
+    @upload_limit(lambda: Config.MAX_CSV_UPLOAD_SIZE)
+    def post(self):
+        """Report the separator, encoding, header row, line count and column profile of a CSV file without converting it."""
+        with timing.phase('parse'):
+            args = parser_inspect.parse_args()
+        upload = args['file']
+        if not upload or not upload.filename or not upload.filename.lower().endswith(CSV_SUFFIXES):
+            abort(400, f'Invalid file format for "{upload.filename if upload else None}". Only .csv and .csv.gz files are supported.')
+
+        compressed = upload.filename.lower().endswith('.gz')
+        try:
+            profile = csv_inspect.inspect_csv(upload.stream, TypeInference.for_lang(args['lang']), compressed)
+        except ValueError as e:
+            abort(400, str(e))
+
+        separator = {delimiter: name for name, delimiter in SEPARATOR_MAP.items()}.get(profile['delimiter'])
+        return {'filename': upload.filename, 'compressed': compressed, 'separator': separator, **profile}, 200
+
+@ns.route('/jobs')
+class CsvToXlsJobs(Resource):
+    @ns.expect(parser)
+    @ns.doc(security='apiKey', responses={202: 'Job accepted'})
+    @api_auth.login_required
+    @upload_limit(lambda: Config.MAX_CSV_UPLOAD_SIZE)
+    def post(self):
+        """Start an asynchronous CSV to Excel conversion and return its job id."""
+        with timing.phase('parse'):
+            args = parser.parse_args()
+        files = [f for f in (args['file'] or []) if f]
+        if not files:
+            abort(400, 'At least one CSV file must be provided.')
+
+        sep, sheet_jobs = plan_sheet_jobs(args, files)
+        job_id = csv_jobs.submit_job(
+            job_store(), api_auth.current_user(), sep, sheet_jobs,
+            args['table_style'], args['author'], args['title'], output_filename(files),
+            type_inference_for(args),
         )
+        location = url_for('csv2xls_csv_to_xls_job', job_id=job_id)
+        return {'job_id': job_id, 'status': csv_jobs.STATUS_QUEUED, 'location': location}, 202, {'Location': location}
 
-def write_csv_to_sheet(file_storage, worksheet, separator):
-    """Stream CSV rows into a worksheet and adjust column widths."""
+@ns.route('/jobs/<string:job_id>')
+class CsvToXlsJob(Resource):
+    @ns.doc(security='apiKey', responses={200: 'Job status, or the .xlsx file once the job is done'})
+    @api_auth.login_required
+    def get(self, job_id):
+        """Report the progress of a conversion job, or download its result when done."""
+        job = job_store().get(job_id) if csv_jobs.is_valid_job_id(job_id) else None
+        # Jobs are only visible to the token that created them
+        if job is None or job.get('owner') != api_auth.current_user():
+            abort(404, 'Job not found or expired.')
+
+        if job['status'] == csv_jobs.STATUS_DONE:
+            path = csv_jobs.result_path(job_id)
+            if not os.path.exists(path):
+                abort(410, 'The job result is no longer available.')
+            return send_file(
+                path,
+                mimetype=XLSX_MIMETYPE,
+                download_name=job['filename'],
+                as_attachment=True
+            )
+
+        status = {
+            'job_id': job_id,
+            'status': job['status'],
+            'sheets_total': int(job.get('sheets_total') or 0),
+            'sheets_done': int(job.get('sheets_done') or 0),
+            'created': job.get('created'),
+        }
+        if job['status'] == csv_jobs.STATUS_FAILED:
+            status['message'] = job.get('message')
+        return status, 200
+
+def job_store():
+    """Job status store backed by the application's Redis connection."""
+    return csv_jobs.JobStore(current_app.config["SESSION_REDIS"], Config.CSV_JOB_RESULT_TTL)
+
+def plan_sheet_jobs(args, files):
+    """
+    Validate the uploaded files and work out the sheet (and table) for each.
+    Returns the CSV separator and the list of SheetJobs, in upload order.
+    """
+    from services.xlsx_writer import SheetJob, ensure_unique_sheet_name
+
+    sep = SEPARATOR_MAP.get(args['separator'], ';')
+    base_sheet_template = SHEET_NAME_MAP.get(args['lang'], 'Sheet1')
+    sheet_name_inputs = args.get('sheet_name') or []
+    if isinstance(sheet_name_inputs, str):
+        sheet_name_inputs = [sheet_name_inputs]
+    create_table_flag = args['create_table']
+    create_table = isinstance(create_table_flag, str) and create_table_flag.lower() == 'true'
+
+    used_sheet_names = set()
+    sheet_jobs = []
+
+    for index, uploaded_file in enumerate(files, start=1):
+        if not uploaded_file.filename or not uploaded_file.filename.lower().endswith(CSV_SUFFIXES):
+            abort(400, f'Invalid file format for "{uploaded_file.filename}". Only .csv and .csv.gz files are supported.')
+
+        requested_name = ''
+        if isinstance(sheet_name_inputs, list) and len(sheet_name_inputs) >= index:
+            requested_name = sheet_name_inputs[index - 1] or ''
+
+        default_sheet_name = default_sheet_name_for_index(base_sheet_template, index)
+        sanitized_name = sanitize_sheet_name(requested_name, default_sheet_name)
+        sheet_name = ensure_unique_sheet_name(sanitized_name, used_sheet_names)
+        table_index = index if create_table else None
+        sheet_jobs.append(SheetJob(uploaded_file, uploaded_file.filename, sheet_name, table_index))
+
+    return sep, sheet_jobs
+
+def type_inference_for(args):
+    """Type inference for the request's language, or None unless infer_types is true."""
+    flag = args.get('infer_types')
+    if not (isinstance(flag, str) and flag.lower() == 'true'):
+        return None
+    return TypeInference.for_lang(args['lang'])
+
+def build_to_tempfile(build):
+    """Run `build(output)` into an anonymous temporary file and return it rewound."""
+    # Spool the finished workbook to disk rather than holding it in memory
+    output = tempfile.TemporaryFile()
     try:
-        file_storage.stream.seek(0)
-    except (AttributeError, OSError):
-        pass
-
-    decoded_lines = (line.decode('utf-8') for line in file_storage.stream)
-    reader = csv.reader(decoded_lines, delimiter=separator)
-
-    column_widths = []
-    is_first_row = True
-
-    for row in reader:
-        if not row:
-            continue
-
-        if is_first_row:
-            column_widths = [len(str(cell)) for cell in row]
-            is_first_row = False
-        else:
-            for i, cell in enumerate(row):
-                cell_length = len(str(cell))
-                if i < len(column_widths):
-                    column_widths[i] = max(column_widths[i], cell_length)
-                else:
-                    column_widths.append(cell_length)
-
-        worksheet.append(row)
-
-    if is_first_row:
-        raise ValueError(f'The provided CSV file "{file_storage.filename}" is empty.')
-
-    adjust_column_widths(worksheet, column_widths)
-
-
-def adjust_column_widths(ws, column_widths):
-    """Adjust column widths based on the longest value found in each column."""
-    extra_space = 4
-    for i, width in enumerate(column_widths, 1):
-        column_letter = get_column_letter(i)
-        ws.column_dimensions[column_letter].width = width + extra_space
-
-def generate_table(ws, table_style_name, index, sheet_title):
-    """Create a table in the worksheet with the specified style."""
-    # Check if worksheet is empty before creating a table
-    if ws.max_row == 0:
-        return
-    table_name = build_table_name(sheet_title, index)
-    tab = Table(displayName=table_name, ref=f"A1:{get_column_letter(ws.max_column)}{ws.max_row}")
-    style = TableStyleInfo(
-        name=table_style_name, 
-        showFirstColumn=False,
-        showLastColumn=False, 
-        showRowStripes=True, 
-        showColumnStripes=False
-    )
-    tab.tableStyleInfo = style
-    ws.add_table(tab)
+        build(output)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+def cache_params(sep, sheet_jobs, args, type_inference):
+    """
+    The normalised parameters that determine the workbook, for the result cache key:
+    the planned sheet names and tables rather than the raw arguments they came from.
+    """
+    create_table = any(job.table_index for job in sheet_jobs)
+    return {
+        'separator': sep,
+        'sheets': [[job.sheet_title, job.table_index] for job in sheet_jobs],
+        'table_style': args['table_style'] if create_table else None,
+        'author': args['author'],
+        'title': args['title'],
+        'types': [type_inference.decimal_separator, type_inference.dotted_dates] if type_inference else None,
+    }
+
+def csv_base_name(filename):
+    """The upload's file name without its .csv (or .csv.gz) extension."""
+    if filename.lower().endswith('.gz'):
+        filename = filename[:-3]
+    return os.path.splitext(filename)[0]
+
+def output_filename(files):
+    """Name of the .xlsx download for the given uploads."""
+    if len(files) == 1:
+        base_filename = csv_base_name(files[0].filename) or 'converted_csv'
+    else:
+        base_name = csv_base_name(files[0].filename or 'converted')
+        base_filename = f"{base_name}_batch"
+    return f"{base_filename}.xlsx"
 
 INVALID_SHEET_CHARS = re.compile(r'[:\\/?*\[\]]')
-TABLE_NAME_INVALID_CHARS = re.compile(r'[^A-Za-z0-9_]')  # Excel table names allow letters, numbers, underscore
 
 def sanitize_sheet_name(name, fallback):
     """Return a sheet name that obeys Excel constraints, otherwise fallback."""
@@ -179,18 +270,6 @@ def sanitize_sheet_name(name, fallback):
         return fallback
     return cleaned[:31]
 
-def ensure_unique_sheet_name(name, used_names):
-    """Ensure the sheet name is unique within the workbook."""
-    candidate = name
-    suffix = 1
-    while candidate in used_names:
-        trimmed = name[: max(0, 31 - len(str(suffix)) - 1)]
-        candidate = f"{trimmed}_{suffix}" if trimmed else f"{name}_{suffix}"
-        candidate = candidate[:31]
-        suffix += 1
-    used_names.add(candidate)
-    return candidate
-
 def default_sheet_name_for_index(base_name, index):
     """Derive a sheet name from the language default that increments per file."""
     match = re.match(r'^(.*?)(\d+)$', base_name)
@@ -199,12 +278,3 @@ def default_sheet_name_for_index(base_name, index):
         start = int(start_number)
         return f"{prefix}{start + index - 1}"
     return f"{base_name}{index}"
-
-def build_table_name(sheet_title, index):
-    """Generate a workbook-unique table name based on sheet title."""
-    base = TABLE_NAME_INVALID_CHARS.sub('', sheet_title) or 'DataTable'
-    name = f"{base}_{index}"
-    # Excel table names must start with a letter; prefix if needed
-    if not name[0].isalpha():
-        name = f"T{name}"
-    return name[:31]
@@ -0,0 +1,129 @@
+"""
+Column type inference for CSV to XLS conversions.
+
+Types are inferred per column from a sample of rows. Rows are then converted in
+blocks: each typed column of a block is validated with a single regex match over
+the joined values and converted with one list comprehension, falling back to
+per-value conversion only for blocks that contain non-matching values (those
+values stay text).
+"""
+import re
+from datetime import date
+
+TEXT = 'text'
+INTEGER = 'integer'
+DECIMAL = 'decimal'
+DATE = 'date'
+BOOLEAN = 'boolean'
+
+# Languages whose CSV exports use a decimal comma and day-first dotted dates
+DECIMAL_COMMA_LANGS = ('SV', 'DA', 'FI', 'NO')
+
+# Numbers with leading zeros (postcodes, article numbers) and integer parts of
+# more than 15 digits (beyond Excel's precision) are left as text.
+_INTEGER = r'-?(?:0|[1-9]\d{0,14})'
+_BOOLEAN = r'(?i:true|false)'
+_ISO_DATE = r'\d{4}-\d{2}-\d{2}'
+_DOTTED_DATE = r'\d{1,2}\.\d{1,2}\.\d{4}'
+
+
+class TypeInference:
+    """Regexes and converters for one CSV dialect (decimal mark and date formats)."""
+
+    # Checked in this order; the first type matching every sampled value wins
+    TYPE_ORDER = (BOOLEAN, INTEGER, DECIMAL, DATE)
+
+    def __init__(self, decimal_separator='.', dotted_dates=False):
+        self.decimal_separator = decimal_separator
+        self.dotted_dates = dotted_dates
+
+        decimal = rf'{_INTEGER}(?:{re.escape(decimal_separator)}\d+)?'
+        dates = f'{_ISO_DATE}|{_DOTTED_DATE}' if dotted_dates else _ISO_DATE
+        patterns = {INTEGER: _INTEGER, DECIMAL: decimal, DATE: dates, BOOLEAN: _BOOLEAN}
+        self._value_patterns = {kind: re.compile(f'(?:{p})') for kind, p in patterns.items()}
+        # Matches a whole block of values joined by newlines (empty values allowed)
+        self._block_patterns = {
+            kind: re.compile(f'(?:{p})?(?:\\n(?:{p})?)*') for kind, p in patterns.items()
+        }
+
+    @classmethod
+    def for_lang(cls, lang):
+        """Inference settings matching the number and date conventions of `lang`."""
+        if lang in DECIMAL_COMMA_LANGS:
+            return cls(decimal_separator=',', dotted_dates=True)
+        return cls(decimal_separator='.', dotted_dates=False)
+
+    def infer_column_types(self, rows):
+        """Return the inferred type of every column in `rows` (header excluded)."""
+        column_count = max((len(row) for row in rows), default=0)
+        column_types = []
+        for index in range(column_count):
+            values = [row[index] for row in rows if len(row) > index and row[index]]
+            column_types.append(self._infer_type(values))
+        return column_types
+
+    def _infer_type(self, values):
+        if not values:
+            return TEXT
+        for kind in self.TYPE_ORDER:
+            pattern = self._value_patterns[kind]
+            if all(pattern.fullmatch(value) for value in values):
+                return kind
+        return TEXT
+
+    def matches(self, value, kind):
+        """True if `value` is written as a `kind` value (TEXT matches anything)."""
+        return kind == TEXT or bool(self._value_patterns[kind].fullmatch(value))
+
+    def convert_rows(self, rows, column_types):
+        """Convert the typed columns of a block of rows in place."""
+        if not rows:
+            return rows
+        complete = min(len(row) for row in rows) >= len(column_types)
+        for index, kind in enumerate(column_types):
+            if kind == TEXT:
+                continue
+            block = rows if complete else [row for row in rows if len(row) > index]
+            values = [row[index] for row in block]
+            for row, value in zip(block, self._convert_column(values, kind)):
+                row[index] = value
+        return rows
+
+    def _convert_column(self, values, kind):
+        if self._block_patterns[kind].fullmatch('\n'.join(values)):
+            try:
+                return self._convert_all(values, kind)
+            except ValueError:
+                # e.g. an impossible date such as 2024-02-30
+                pass
+        return [self._convert_value(value, kind) for value in values]
+
+    def _convert_all(self, values, kind):
+        if kind == INTEGER:
+            return [int(value) if value else None for value in values]
+        if kind == DECIMAL:
+            if self.decimal_separator == '.':
+                return [float(value) if value else None for value in values]
+            return [float(value.replace(self.decimal_separator, '.')) if value else None for value in values]
+        if kind == DATE:
+            return [_parse_date(value) if value else None for value in values]
+        if kind == BOOLEAN:
+            return [value.lower() == 'true' if value else None for value in values]
+        return values
+
+    def _convert_value(self, value, kind):
+        if not value:
+            return None
+        if not self._value_patterns[kind].fullmatch(value):
+            return value
+        try:
+            return self._convert_all([value], kind)[0]
+        except ValueError:
+            return value
+
+
+def _parse_date(value):
+    if '-' in value:
+        return date.fromisoformat(value)
+    day, month, year = value.split('.')
+    return date(int(year), int(month), int(day))
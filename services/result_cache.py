@@ -0,0 +1,232 @@
+"""
+Content-addressed cache of finished CSV to XLS workbooks.
+
+The key is a SHA-256 over the uploaded bytes and the normalised parameters that
+determine the workbook (sheet names, tables, separator, metadata, typing). Cached
+workbooks are files in CSV_CACHE_DIR, evicted least recently used first once
+they exceed CSV_CACHE_MAX_BYTES. The LRU order is kept in the file modification
+times, or in Redis when CSV_CACHE_SHARED is set so several containers sharing
+the cache directory also share hit information and evict consistently.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+from config import Config
+from monitoring import metrics
+from version import __version__
+
+RESULT_SUFFIX = '.xlsx'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Evict down to this fraction of the size cap so eviction does not run on every store
+EVICTION_TARGET = 0.9
+
+REDIS_KEY_PREFIX = 'api_toolbox:csv2xls:cache:'
+
+
+def cache_key(sources, params):
+    """
+    Hash the binary streams in `sources` (rewound afterwards) together with the
+    JSON-serialisable `params` and the application version.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps({'version': __version__, **params}, sort_keys=True).encode('utf-8'))
+    for stream in sources:
+        stream.seek(0)
+        file_digest = hashlib.sha256()
+        size = 0
+        while True:
+            chunk = stream.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            file_digest.update(chunk)
+            size += len(chunk)
+        stream.seek(0)
+        digest.update(f'{size}:{file_digest.hexdigest()};'.encode('ascii'))
+    return digest.hexdigest()
+
+
+def _text(value):
+    return value.decode('ascii') if isinstance(value, bytes) else value
+
+
+class LocalIndex:
+    """LRU bookkeeping in file modification times; eviction scans the directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def touch(self, key, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def add(self, key, path, size):
+        pass
+
+    def record_lookup(self, hit):
+        pass
+
+    def eviction_candidates(self, max_bytes):
+        """Return (key, path) pairs to delete, oldest first, to get below the target size."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if not entry.name.endswith(RESULT_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.name[:-len(RESULT_SUFFIX)], entry.path))
+                total += stat.st_size
+        if total <= max_bytes:
+            return []
+
+        candidates = []
+        for _, size, key, path in sorted(entries):
+            if total <= max_bytes * EVICTION_TARGET:
+                break
+            candidates.append((key, path))
+            total -= size
+        return candidates
+
+    def remove(self, key):
+        return True
+
+
+class RedisIndex(LocalIndex):
+    """
+    LRU order (sorted set), sizes and hit/miss counts in Redis, shared by every
+    container using the same cache directory.
+    """
+
+    def __init__(self, directory, redis_client):
+        super().__init__(directory)
+        self.redis = redis_client
+        self.lru_key = REDIS_KEY_PREFIX + 'lru'
+        self.sizes_key = REDIS_KEY_PREFIX + 'sizes'
+        self.stats_key = REDIS_KEY_PREFIX + 'stats'
+
+    def touch(self, key, path):
+        self.redis.zadd(self.lru_key, {key: time.time()})
+
+    def add(self, key, path, size):
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.lru_key, {key: time.time()})
+        pipe.hset(self.sizes_key, key, size)
+        pipe.execute()
+
+    def record_lookup(self, hit):
+        self.redis.hincrby(self.stats_key, 'hits' if hit else 'misses', 1)
+
+    def eviction_candidates(self, max_bytes):
+        sizes = {_text(key): int(size) for key, size in self.redis.hgetall(self.sizes_key).items()}
+        total = sum(sizes.values())
+        if total <= max_bytes:
+            return []
+
+        candidates = []
+        for key in map(_text, self.redis.zrange(self.lru_key, 0, -1)):
+            if total <= max_bytes * EVICTION_TARGET:
+                break
+            total -= sizes.get(key, 0)
+            candidates.append((key, os.path.join(self.directory, key + RESULT_SUFFIX)))
+        return candidates
+
+    def remove(self, key):
+        """Drop `key` from the index; only the caller that actually removed it gets True."""
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.lru_key, key)
+        pipe.hdel(self.sizes_key, key)
+        removed, _ = pipe.execute()
+        return bool(removed)
+
+
+class ResultCache:
+    """Finished workbooks by cache key, bounded to `max_bytes` on disk."""
+
+    def __init__(self, directory, max_bytes, index=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index = index or LocalIndex(directory)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + RESULT_SUFFIX)
+
+    def get(self, key):
+        """Return the cached workbook opened for reading, or None on a miss."""
+        path = self.path(key)
+        try:
+            result = open(path, 'rb')
+        except FileNotFoundError:
+            result = None
+        else:
+            self._safely(self.index.touch, key, path)
+        hit = result is not None
+        self._safely(self.index.record_lookup, hit)
+        metrics.CSV_CACHE_LOOKUPS.labels('hit' if hit else 'miss').inc()
+        return result
+
+    def put(self, key, build):
+        """
+        Create the workbook with `build(path)` and add it to the cache. Returns it
+        opened for reading, so a concurrent eviction cannot pull it away before it
+        has been sent.
+        """
+        part = os.path.join(self.directory, f'{key}.{uuid.uuid4().hex}.part')
+        try:
+            build(part)
+            final = self.path(key)
+            os.replace(part, final)
+            result = open(final, 'rb')
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+
+        self._safely(self.index.add, key, final, os.fstat(result.fileno()).st_size)
+        self._evict(keep=key)
+        return result
+
+    def _evict(self, keep):
+        candidates = self._safely(self.index.eviction_candidates, self.max_bytes) or []
+        for key, path in candidates:
+            if key == keep or not self._safely(self.index.remove, key):
+                continue
+            try:
+                os.remove(path)
+                metrics.CSV_CACHE_EVICTIONS.inc()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _safely(operation, *args):
+        """Index failures (e.g. Redis being down) must not fail the conversion."""
+        try:
+            return operation(*args)
+        except Exception as e:
+            logging.warning("csv2xls result cache index operation %s failed: %s", operation.__name__, e)
+            return None
+
+
+_cache = None
+
+def get_cache(redis_client=None):
+    """Return the shared result cache, or None when CSV_CACHE_ENABLED is off."""
+    global _cache
+    if not Config.CSV_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        directory = Config.CSV_CACHE_DIR or os.path.join(tempfile.gettempdir(), 'api_toolbox_csv2xls_cache')
+        index = RedisIndex(directory, redis_client) if Config.CSV_CACHE_SHARED and redis_client is not None else None
+        _cache = ResultCache(directory, Config.CSV_CACHE_MAX_BYTES, index)
+    return _cache
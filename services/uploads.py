@@ -0,0 +1,108 @@
+"""
+Request body limits, upload spooling and file-backed responses.
+
+Every request is limited to MAX_REQUEST_BODY_SIZE unless its resource method is
+decorated with `upload_limit`, which raises the limit for that endpoint. The
+limit is checked against Content-Length before the body is read, and enforced
+while reading bodies without one (chunked transfer encoding), so an oversized
+upload is rejected before multipart parsing buffers it. Uploaded files larger
+than UPLOAD_SPOOL_THRESHOLD are spooled to temp files instead of memory.
+"""
+import functools
+import os
+import tempfile
+import unicodedata
+from io import BytesIO
+from urllib.parse import quote
+
+from flask import Request, request, send_file
+from flask_restx import abort
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from config import Config
+
+# Allowance for multipart boundaries, part headers and small form fields
+MULTIPART_OVERHEAD = 64 * 1024
+
+# The max_body_size callables of all `upload_limit` endpoints
+_endpoint_limits = []
+
+
+class SpoolingRequest(Request):
+    """Request class whose uploaded files stay in memory only up to UPLOAD_SPOOL_THRESHOLD."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=Config.UPLOAD_SPOOL_THRESHOLD)
+
+
+def too_large_message(limit):
+    return f'Request body too large. Max size is {limit / (1024 * 1024)} MB'
+
+def upload_limit(max_body_size, max_form_field_size=None):
+    """
+    Decorate a resource method to accept request bodies of up to
+    `max_body_size()` bytes (a callable, so settings are read per request) and
+    form fields of up to `max_form_field_size()` bytes. Bodies over the limit
+    are answered with 413.
+    """
+    _endpoint_limits.append(max_body_size)
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            limit = max_body_size()
+            request.max_content_length = limit
+            if max_form_field_size is not None:
+                request.max_form_memory_size = max_form_field_size()
+            if request.content_length is not None and request.content_length > limit:
+                abort(413, too_large_message(limit))
+            try:
+                return method(*args, **kwargs)
+            except RequestEntityTooLarge:
+                abort(413, too_large_message(limit))
+        return wrapper
+    return decorator
+
+def largest_upload_limit():
+    """The largest request body any endpoint accepts; serve.py makes it the server's limit."""
+    return max([Config.MAX_REQUEST_BODY_SIZE] + [limit() for limit in _endpoint_limits])
+
+def detach_upload_stream(file):
+    """
+    Take ownership of an uploaded file's stream so it outlives the request
+    (werkzeug closes request files before a streamed response is sent).
+    The caller is responsible for closing the returned stream.
+    """
+    stream = file.stream
+    file.stream = BytesIO()
+    return stream
+
+
+def file_size(stream):
+    """Size of a seekable file object, which is left at its current position."""
+    position = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    return size - position
+
+def send_result_file(stream, download_name, mimetype):
+    """
+    Send a rewound (temp) file as an attachment with a Content-Length, so the
+    WSGI server's file wrapper streams it from disk.
+    """
+    response = send_file(stream, mimetype=mimetype, download_name=download_name, as_attachment=True)
+    response.content_length = file_size(stream)
+    return response
+
+def attachment_headers(download_name):
+    """Content-Disposition for a streamed download, encoded as send_file does."""
+    try:
+        download_name.encode('ascii')
+        options = {'filename': download_name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        options = {'filename': simple, 'filename*': f"UTF-8''{quote(download_name, safe='!#$&+^`|~')}"}
+    headers = Headers()
+    headers.set('Content-Disposition', 'attachment', **options)
+    return headers
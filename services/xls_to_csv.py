@@ -0,0 +1,156 @@
+from flask import Response
+from flask_restx import Namespace, Resource, reqparse, abort
+from werkzeug.datastructures import FileStorage
+import csv
+import datetime
+import io
+import os
+import zipfile
+from auth.auth import api_auth
+from config import Config
+from monitoring.logs import SAMPLED
+from services.csv_to_xls import SEPARATOR_CHOICES, SEPARATOR_MAP
+from services.uploads import attachment_headers, detach_upload_stream, upload_limit
+import logging
+
+ns = Namespace('xls2csv', description='XLS to CSV operations')
+
+# Rows written to the CSV buffer before it is encoded and sent
+CSV_BLOCK_ROWS = 1024
+
+parser = reqparse.RequestParser()
+parser.add_argument('file', location='files', type=FileStorage, required=True, help='The .xlsx file to upload')
+parser.add_argument('separator', type=str, required=False, default='semicolon', choices=SEPARATOR_CHOICES, help='The separator to use in the CSV output.')
+parser.add_argument('sheet', type=str, required=False, help='Name of the sheet to convert. Defaults to the first sheet.')
+parser.add_argument('all_sheets', type=str, required=False, default='false', choices=('true', 'false'), help='Return a zip archive with one CSV per sheet instead of a single CSV.')
+
+@ns.route('')
+class XlsToCsvConverter(Resource):
+    @ns.expect(parser)
+    @ns.doc(security='apiKey', description='The workbook is read in streaming mode and the CSV is sent while it is being read.')
+    @api_auth.login_required
+    @upload_limit(lambda: Config.MAX_XLSX_UPLOAD_SIZE)
+    def post(self):
+        """Convert an Excel sheet (or all sheets, as a zip) to CSV."""
+        # openpyxl is loaded with the first conversion, not at startup
+        from openpyxl.utils.exceptions import InvalidFileException
+        from services.xlsx_reader import close_workbook, load_streaming_workbook
+
+        args = parser.parse_args()
+        upload = args['file']
+        if not upload or not upload.filename or not upload.filename.lower().endswith('.xlsx'):
+            abort(400, 'Invalid file format. Only .xlsx files are supported.')
+
+        sep = SEPARATOR_MAP.get(args['separator'], ';')
+        base_filename = os.path.splitext(upload.filename)[0] or 'converted_xlsx'
+        all_sheets = args['all_sheets'] == 'true'
+
+        # Only the workbook index is read here; sheets are parsed while the response is sent
+        stream = detach_upload_stream(upload)
+        try:
+            wb = load_streaming_workbook(stream)
+        except (InvalidFileException, zipfile.BadZipFile, KeyError, ValueError, OSError) as e:
+            stream.close()
+            logging.warning("Invalid .xlsx file provided for conversion: %s: %s", upload.filename, e)
+            abort(400, 'Invalid .xlsx file.')
+
+        if all_sheets:
+            worksheets = wb.worksheets
+        elif args['sheet']:
+            if args['sheet'] not in wb.sheetnames:
+                close_workbook(wb, stream)
+                abort(400, f'Sheet "{args["sheet"]}" not found. Available sheets: {", ".join(wb.sheetnames)}')
+            worksheets = [wb[args['sheet']]]
+        else:
+            worksheets = wb.worksheets[:1]
+        if not worksheets:
+            close_workbook(wb, stream)
+            abort(400, 'The workbook contains no worksheets.')
+
+        logging.info("Streaming XLSX to CSV conversion of %s (%s sheet(s)).", upload.filename, len(worksheets), extra=SAMPLED)
+        if all_sheets:
+            body = generate_csv_zip(wb, stream, worksheets, sep)
+            mimetype, download_name = 'application/zip', f"{base_filename}.zip"
+        else:
+            body = generate_csv(wb, stream, worksheets[0], sep)
+            mimetype, download_name = 'text/csv', f"{base_filename}.csv"
+
+        return Response(body, mimetype=mimetype, headers=attachment_headers(download_name))
+
+def format_cell(value):
+    """Render a cell value as CSV text (ISO dates, integral floats without '.0')."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, datetime.datetime):
+        if value.time() == datetime.time():
+            return value.date().isoformat()
+        return value.isoformat(sep=' ')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+def iter_csv_blocks(worksheet, separator):
+    """Yield the sheet as UTF-8 CSV, CSV_BLOCK_ROWS rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=separator, lineterminator='\r\n')
+    pending = 0
+    for row in worksheet.iter_rows(values_only=True):
+        writer.writerow([format_cell(value) for value in row])
+        pending += 1
+        if pending == CSV_BLOCK_ROWS:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue().encode('utf-8')
+
+def generate_csv(wb, stream, worksheet, separator):
+    from services.xlsx_reader import close_workbook
+
+    try:
+        yield from iter_csv_blocks(worksheet, separator)
+    finally:
+        close_workbook(wb, stream)
+
+class _ZipSink:
+    """Write-only, non-seekable target for zipfile; the written bytes are collected until drained."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def generate_csv_zip(wb, stream, worksheets, separator):
+    """Yield a zip archive with one CSV per worksheet, built while the sheets are read."""
+    from services.xlsx_reader import close_workbook
+
+    sink = _ZipSink()
+    try:
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for worksheet in worksheets:
+                # The CSV size is unknown until the sheet is read; zip64 headers allow members over 2 GiB
+                with archive.open(f"{worksheet.title}.csv", 'w', force_zip64=True) as member:
+                    for block in iter_csv_blocks(worksheet, separator):
+                        member.write(block)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                yield sink.drain()
+        yield sink.drain()
+    finally:
+        close_workbook(wb, stream)
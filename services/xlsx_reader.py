@@ -0,0 +1,56 @@
+"""
+Streaming .xlsx reading for the XLS to CSV service.
+
+openpyxl's read-only mode still parses a whole sheet when the workbook is opened
+if the sheet has no leading <dimension> element; the classes here read the size
+only from the start of the sheet so rows are parsed while the CSV is sent. Kept
+apart from services/xls_to_csv.py so openpyxl is imported on the first
+conversion rather than at startup.
+"""
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+from openpyxl.worksheet._reader import DATA_TAG, DIMENSION_TAG
+from openpyxl.worksheet.dimensions import SheetDimension
+from openpyxl.xml.functions import iterparse
+
+
+class StreamingWorksheet(ReadOnlyWorksheet):
+    """
+    Read-only worksheet that takes its size from the <dimension> element only if
+    it precedes the sheet data. openpyxl otherwise parses the whole sheet when
+    the workbook is opened (workbooks written in write-only mode have none).
+    """
+
+    def _get_size(self):
+        src = self._get_source()
+        try:
+            for _event, element in iterparse(src, events=('start',)):
+                if element.tag == DIMENSION_TAG:
+                    self._min_column, self._min_row, self._max_column, self._max_row = \
+                        SheetDimension.from_tree(element).boundaries
+                    break
+                if element.tag == DATA_TAG:
+                    break
+        finally:
+            src.close()
+
+class StreamingExcelReader(ExcelReader):
+    """ExcelReader creating StreamingWorksheets; chartsheets are skipped."""
+
+    def read_worksheets(self):
+        for sheet, rel in self.parser.find_sheets():
+            if rel.target not in self.valid_files or "chartsheet" in rel.Type:
+                continue
+            ws = StreamingWorksheet(self.wb, sheet.name, rel.target, self.shared_strings)
+            ws.sheet_state = sheet.state
+            self.wb._sheets.append(ws)
+
+def load_streaming_workbook(stream):
+    """Open an .xlsx file object in read-only mode with cell values (not formulas)."""
+    reader = StreamingExcelReader(stream, read_only=True, data_only=True)
+    reader.read()
+    return reader.wb
+
+def close_workbook(wb, stream):
+    wb.close()
+    stream.close()
@@ -0,0 +1,476 @@
+"""
+Workbook building blocks for the CSV to XLS service.
+
+Each CSV is rendered into a standalone write-only worksheet part, either in the
+request thread or in a worker process, and the parts are then assembled into the
+final workbook in their original order. This module deliberately avoids Flask
+and auth imports so worker processes stay lightweight.
+"""
+import csv
+import gzip
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import warnings
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles.numbers import FORMAT_DATE_YYYYMMDD2
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from openpyxl.worksheet._writer import ALL_TEMP_FILES
+from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+from openpyxl.utils import get_column_letter
+from werkzeug.datastructures import FileStorage
+from config import Config
+from monitoring import timing
+
+TABLE_NAME_INVALID_CHARS = re.compile(r'[^A-Za-z0-9_]')  # Excel table names allow letters, numbers, underscore
+
+# Workbooks are written in openpyxl's write-only mode, where column widths must be
+# set before the first row is written. They are derived from the first rows of
+# each CSV, which are buffered until the widths are known.
+COLUMN_WIDTH_SAMPLE_ROWS = 1000
+
+# Rows read, converted (when cell types are inferred) and written per batch
+ROW_BLOCK_SIZE = 1024
+
+# Rows per worksheet in Excel; longer CSVs continue on further sheets, each
+# starting with a copy of the header row.
+EXCEL_MAX_ROWS = 1048576
+SHEET_TITLE_MAX_LENGTH = 31
+
+# Number formats registered up front in every workbook, in this order. Sheets are
+# rendered in separate workbooks (and processes) and reference cell styles by
+# index, so all of them must agree on the index of every style they can use.
+SHARED_NUMBER_FORMATS = (FORMAT_DATE_YYYYMMDD2,)  # openpyxl's format for date cells
+
+# Size and header of a written sheet, used for the table range instead of
+# ws.max_row/ws.max_column (which write-only worksheets do not track).
+SheetDimensions = namedtuple('SheetDimensions', ['rows', 'columns', 'header'])
+
+# One CSV to convert: `source` is an uploaded FileStorage or the path of a CSV
+# file on disk; `table_index` is None when no table should be created.
+SheetJob = namedtuple('SheetJob', ['source', 'filename', 'sheet_title', 'table_index'])
+
+# A worksheet rendered on its own: the path of its finished XML part plus the
+# relationships and tables that the XML refers to. `title` is provisional for
+# continuation sheets; build_workbook assigns the final names.
+RenderedSheet = namedtuple('RenderedSheet', ['title', 'path', 'rels', 'tables', 'dimensions'])
+
+
+# --- Rendering and assembly ---
+
+def new_workbook():
+    """Create a write-only workbook with the SHARED_NUMBER_FORMATS styles registered."""
+    wb = Workbook(write_only=True)
+    scratch = wb.create_sheet()
+    for number_format in SHARED_NUMBER_FORMATS:
+        cell = WriteOnlyCell(scratch)
+        cell.number_format = number_format
+        cell.style_id  # registers the style with the workbook
+    wb.remove(scratch)
+    return wb
+
+def render_csv_sheet(source, filename, separator, sheet_title, table_style=None, table_index=None, type_inference=None):
+    """
+    Render one CSV into standalone worksheet parts.
+
+    `source` is either an uploaded FileStorage or the path of a spooled copy (when
+    running in a worker process). A table is added to every part when
+    `table_style` is given and cells are typed when `type_inference` (a
+    csv_types.TypeInference) is given. Returns a list of RenderedSheets: one, plus
+    one per continuation sheet for CSVs longer than EXCEL_MAX_ROWS. Their XML
+    files are owned by the caller.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as stream:
+            return render_csv_sheet(FileStorage(stream=stream, filename=filename), filename,
+                                    separator, sheet_title, table_style, table_index, type_inference)
+
+    wb = new_workbook()
+
+    def next_sheet():
+        part = len(wb.worksheets) + 1
+        return wb.create_sheet(title=sheet_title if part == 1 else continuation_sheet_name(sheet_title, part))
+
+    try:
+        parts = write_csv_to_sheets(source, next_sheet, separator, type_inference)
+        for ws, dimensions in parts:
+            if table_style:
+                generate_table(ws, table_style, table_index, ws.title, dimensions)
+            ws.close()
+    except BaseException:
+        discard_workbook(wb)
+        raise
+
+    # Hand the XML files over to whoever assembles the workbook
+    rendered = []
+    for ws, dimensions in parts:
+        writer = ws._writer
+        ALL_TEMP_FILES.remove(writer.out)
+        rendered.append(RenderedSheet(
+            title=ws.title,
+            path=writer.out,
+            rels=writer._rels,
+            tables=list(ws.tables.values()),
+            dimensions=dimensions,
+        ))
+    return rendered
+
+class _RenderedSheetWriter:
+    """Stands in for openpyxl's WorksheetWriter when the XML part already exists."""
+
+    def __init__(self, out, rels):
+        self.out = out
+        self._rels = rels
+        ALL_TEMP_FILES.append(out)
+
+    def close(self):
+        pass
+
+    def cleanup(self):
+        if os.path.exists(self.out):
+            os.remove(self.out)
+        if self.out in ALL_TEMP_FILES:
+            ALL_TEMP_FILES.remove(self.out)
+
+class RenderedWorksheet(WriteOnlyWorksheet):
+    """A write-only worksheet whose content was rendered by render_csv_sheet."""
+
+    def __init__(self, parent, rendered):
+        super().__init__(parent, rendered.title)
+        self._writer = _RenderedSheetWriter(rendered.path, rendered.rels)
+        self._hyperlinks = []
+        self._comments = []
+        for table in rendered.tables:
+            self._tables.add(table)
+
+    @property
+    def closed(self):
+        return True
+
+    def close(self):
+        pass
+
+    def append(self, row):
+        raise TypeError('Rendered worksheets cannot be modified.')
+
+def attach_rendered_sheet(wb, rendered):
+    """Add a rendered worksheet part to a write-only workbook."""
+    ws = RenderedWorksheet(wb, rendered)
+    wb._add_sheet(ws)
+    return ws
+
+_process_pool = None
+
+def conversion_pool_size():
+    """Number of worker processes for multi-file conversions (1 disables the pool)."""
+    return Config.CSV_CONVERSION_PROCESSES or os.cpu_count() or 1
+
+def get_process_pool():
+    """Return the shared conversion process pool, starting it on first use."""
+    global _process_pool
+    if _process_pool is None:
+        # forkserver avoids forking the multi-threaded server process itself
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _process_pool = ProcessPoolExecutor(
+            max_workers=conversion_pool_size(),
+            mp_context=multiprocessing.get_context(method),
+        )
+    return _process_pool
+
+class CsvConversionError(ValueError):
+    """A CSV file could not be converted; the message is safe to show to clients."""
+
+class SheetRenderer:
+    """
+    Renders SheetJobs into worksheet parts.
+
+    With `parallel=True` (and a pool size above 1) each upload is spooled to a
+    temp file (unless it already is a file on disk) and rendered in the shared
+    process pool; otherwise rendering
+    happens lazily in the calling thread. `submit` returns a callable that yields
+    the job's list of RenderedSheets (or raises the rendering error). Closing the renderer
+    removes spooled inputs and any rendered parts that were never collected.
+    """
+
+    def __init__(self, separator, table_style=None, parallel=False, type_inference=None):
+        self.separator = separator
+        self.table_style = table_style
+        self.type_inference = type_inference
+        self.parallel = parallel and conversion_pool_size() > 1
+        self._spooled_paths = []
+        self._futures = []
+        self._collected = set()
+
+    def submit(self, job):
+        table_style = self.table_style if job.table_index else None
+        args = (job.filename, self.separator, job.sheet_title, table_style, job.table_index, self.type_inference)
+        if not self.parallel:
+            return lambda: render_csv_sheet(job.source, *args)
+
+        path = job.source if isinstance(job.source, str) else self._spool(job.source)
+        future = get_process_pool().submit(render_csv_sheet, path, *args)
+        self._futures.append(future)
+
+        def result():
+            rendered = future.result()
+            self._collected.add(future)
+            return rendered
+        return result
+
+    def close(self):
+        for future in self._futures:
+            if future not in self._collected and not future.cancel():
+                future.add_done_callback(_remove_rendered_output)
+        for path in self._spooled_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _spool(self, file_storage):
+        stream = file_storage.stream
+        try:
+            stream.seek(0)
+        except (AttributeError, OSError):
+            pass
+        with tempfile.NamedTemporaryFile(prefix='csv2xls.', suffix='.csv', delete=False) as spooled:
+            self._spooled_paths.append(spooled.name)
+            shutil.copyfileobj(stream, spooled)
+        return spooled.name
+
+def build_workbook(sheet_jobs, separator, output, table_style=None, author=None, title=None,
+                   on_sheet_done=None, type_inference=None):
+    """
+    Convert the CSVs described by `sheet_jobs` into one workbook saved to `output`
+    (a path or binary file object), with sheets in job order. Batches are rendered
+    in the process pool. `on_sheet_done(count)` is called after each attached sheet.
+    Raises CsvConversionError if any CSV cannot be converted.
+    """
+    wb = new_workbook()
+    wb.properties.creator = author
+    wb.properties.title = title
+    used_sheet_names = {job.sheet_title for job in sheet_jobs}
+    used_table_names = set()
+
+    with SheetRenderer(separator, table_style, parallel=len(sheet_jobs) > 1,
+                       type_inference=type_inference) as renderer:
+        pending = [(job, renderer.submit(job)) for job in sheet_jobs]
+        try:
+            for count, (job, result) in enumerate(pending, start=1):
+                try:
+                    with timing.phase('render'):
+                        parts = result()
+                except ValueError as value_error:
+                    raise CsvConversionError(str(value_error)) from value_error
+                except Exception as e:
+                    logging.error("Error processing CSV file '%s': %s", job.filename, e)
+                    raise CsvConversionError(f"Could not process CSV file '{job.filename}'. Please check the file format and the selected separator. Error: {e}") from e
+                for part, rendered in enumerate(parts, start=1):
+                    if part > 1:
+                        rendered = rendered._replace(title=ensure_unique_sheet_name(
+                            continuation_sheet_name(job.sheet_title, part), used_sheet_names))
+                    for table in rendered.tables:
+                        table.name = table.displayName = unique_table_name(
+                            build_table_name(rendered.title, job.table_index), used_table_names)
+                    attach_rendered_sheet(wb, rendered)
+                if on_sheet_done:
+                    on_sheet_done(count)
+
+            with timing.phase('save'):
+                wb.save(output)
+        except BaseException:
+            discard_workbook(wb)
+            raise
+
+def _remove_rendered_output(future):
+    """Delete the XML parts of a rendering result nobody collected."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    for rendered in future.result():
+        try:
+            os.remove(rendered.path)
+        except OSError:
+            pass
+
+# --- Worksheet content ---
+
+def is_gzip_upload(filename):
+    """True for gzip-compressed uploads (.csv.gz)."""
+    return bool(filename) and filename.lower().endswith('.gz')
+
+def write_csv_to_sheets(file_storage, next_sheet, separator, type_inference=None, max_rows=None):
+    """
+    Stream CSV rows into write-only worksheets in a single pass.
+
+    `next_sheet()` returns the (empty) worksheet to write to; it is called again
+    whenever a sheet holds `max_rows` (default EXCEL_MAX_ROWS) rows and more follow, and each continuation
+    sheet starts with the header row. Column widths are computed from the first
+    COLUMN_WIDTH_SAMPLE_ROWS rows, which are buffered until the widths have been
+    applied; the remaining rows are streamed straight through in blocks of
+    ROW_BLOCK_SIZE rows. With `type_inference` the column types are inferred from
+    the same sample (below the header row) and each block is converted before it
+    is written. Returns a list of (worksheet, SheetDimensions) pairs.
+    """
+    max_rows = max_rows or EXCEL_MAX_ROWS
+    try:
+        file_storage.stream.seek(0)
+    except (AttributeError, OSError):
+        pass
+
+    stream = file_storage.stream
+    if is_gzip_upload(file_storage.filename):
+        # .csv.gz uploads are inflated line by line as the rows are read
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    decoded_lines = (line.decode('utf-8') for line in stream)
+    reader = csv.reader(decoded_lines, delimiter=separator)
+    rows = (row for row in reader if row)
+
+    with timing.phase('read_csv'):
+        sample = list(islice(rows, COLUMN_WIDTH_SAMPLE_ROWS))
+    if not sample:
+        raise ValueError(f'The provided CSV file "{file_storage.filename}" is empty.')
+    header = sample[0]
+
+    column_widths = []
+    for row in sample:
+        for i, cell in enumerate(row):
+            cell_length = len(cell)
+            if i < len(column_widths):
+                column_widths[i] = max(column_widths[i], cell_length)
+            else:
+                column_widths.append(cell_length)
+
+    column_types = None
+    if type_inference is not None:
+        column_types = type_inference.infer_column_types(sample[1:])
+
+    parts = []
+    worksheet = next_sheet()
+    adjust_column_widths(worksheet, column_widths)
+    row_count = 0
+    column_count = 0
+    block = sample
+    while block:
+        if column_types:
+            with timing.phase('convert_types'):
+                # The header row is never converted
+                type_inference.convert_rows(block[1:] if block is sample else block, column_types)
+        with timing.phase('write_rows'):
+            while block:
+                if row_count == max_rows:
+                    parts.append((worksheet, SheetDimensions(rows=row_count, columns=column_count, header=header)))
+                    worksheet = next_sheet()
+                    adjust_column_widths(worksheet, column_widths)
+                    worksheet.append(header)
+                    row_count = 1
+                    column_count = len(header)
+                fitting = block if len(block) <= max_rows - row_count else block[:max_rows - row_count]
+                for row in fitting:
+                    worksheet.append(row)
+                    if len(row) > column_count:
+                        column_count = len(row)
+                row_count += len(fitting)
+                block = block[len(fitting):] if fitting is not block else None
+        with timing.phase('read_csv'):
+            block = list(islice(rows, ROW_BLOCK_SIZE))
+
+    parts.append((worksheet, SheetDimensions(rows=row_count, columns=column_count, header=header)))
+    return parts
+
+
+def adjust_column_widths(ws, column_widths):
+    """Adjust column widths based on the longest value found in each column."""
+    extra_space = 4
+    for i, width in enumerate(column_widths, 1):
+        column_letter = get_column_letter(i)
+        ws.column_dimensions[column_letter].width = width + extra_space
+
+def generate_table(ws, table_style_name, index, sheet_title, dimensions):
+    """Create a table covering the written data with the specified style."""
+    # Check if worksheet is empty before creating a table
+    if dimensions.rows == 0:
+        return
+    table_name = build_table_name(sheet_title, index)
+    tab = Table(displayName=table_name, ref=f"A1:{get_column_letter(dimensions.columns)}{dimensions.rows}")
+    # Write-only worksheets cannot read back the header row, so name the columns explicitly
+    header = dimensions.header
+    tab.tableColumns = [
+        TableColumn(id=i, name=header[i - 1] if i <= len(header) and header[i - 1] else f"Column{i}")
+        for i in range(1, dimensions.columns + 1)
+    ]
+    style = TableStyleInfo(
+        name=table_style_name, 
+        showFirstColumn=False,
+        showLastColumn=False, 
+        showRowStripes=True, 
+        showColumnStripes=False
+    )
+    tab.tableStyleInfo = style
+    with timing.phase('table'), warnings.catch_warnings():
+        # openpyxl warns that write-only tables need manual columns; they were added above
+        warnings.simplefilter('ignore')
+        ws.add_table(tab)
+
+def discard_workbook(wb):
+    """Close and remove the temp files of a write-only workbook that will not be saved."""
+    for ws in wb.worksheets:
+        writer = getattr(ws, '_writer', None)
+        if writer is None:
+            continue
+        try:
+            if ws._rows is not None:
+                ws._rows.close()
+            writer.close()
+            writer.cleanup()
+        except (OSError, ValueError):
+            pass
+
+def build_table_name(sheet_title, index):
+    """Generate a workbook-unique table name based on sheet title."""
+    base = TABLE_NAME_INVALID_CHARS.sub('', sheet_title) or 'DataTable'
+    name = f"{base}_{index}"
+    # Excel table names must start with a letter; prefix if needed
+    if not name[0].isalpha():
+        name = f"T{name}"
+    return name[:31]
+
+def ensure_unique_sheet_name(name, used_names):
+    """Ensure the sheet name is unique within the workbook."""
+    candidate = name
+    suffix = 1
+    while candidate in used_names:
+        trimmed = name[: max(0, 31 - len(str(suffix)) - 1)]
+        candidate = f"{trimmed}_{suffix}" if trimmed else f"{name}_{suffix}"
+        candidate = candidate[:31]
+        suffix += 1
+    used_names.add(candidate)
+    return candidate
+
+def continuation_sheet_name(sheet_title, part):
+    """Name of the `part`-th sheet (2, 3, ...) of a CSV split over several sheets, e.g. 'Blad1 (2)'."""
+    suffix = f" ({part})"
+    return sheet_title[:SHEET_TITLE_MAX_LENGTH - len(suffix)] + suffix
+
+def unique_table_name(name, used_names):
+    """Ensure the table name is unique within the workbook (Excel requires it)."""
+    candidate = name
+    suffix = 2
+    while candidate.lower() in used_names:
+        tail = f"_{suffix}"
+        candidate = name[:31 - len(tail)] + tail
+        suffix += 1
+    used_names.add(candidate.lower())
+    return candidate
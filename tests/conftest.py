@@ -0,0 +1,83 @@
+"""
+Shared fixtures: the application with a scratch settings.json (created from the
+template) and Redis replaced by an in-process fakeredis server.
+
+The settings path is read when `config` is imported, so it is set up here
+before any application module is imported.
+"""
+import base64
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+WORK_DIR = tempfile.mkdtemp(prefix='api_toolbox_tests_')
+ADMIN_USER = 'admin'
+ADMIN_PASSWORD = 'change_me'  # as in defaults/settings.template.json
+
+with open(os.path.join(REPO_ROOT, 'defaults', 'settings.template.json')) as f:
+    _settings = json.load(f)
+_settings.update({
+    'LOG_FILE': os.path.join(WORK_DIR, 'logs', 'app.log'),
+    'CSV_JOB_RESULT_DIR': os.path.join(WORK_DIR, 'jobs'),
+    'CSV_CACHE_DIR': os.path.join(WORK_DIR, 'cache'),
+    # Convert in the calling thread; no process pool in tests
+    'CSV_CONVERSION_PROCESSES': 1,
+    'METRICS_ENABLED': False,
+})
+with open(os.path.join(WORK_DIR, 'settings.json'), 'w') as f:
+    json.dump(_settings, f, indent=4)
+os.environ['SETTINGS_PATH'] = os.path.join(WORK_DIR, 'settings.json')
+os.environ['SECRET_KEY'] = 'test-secret'
+
+
+@pytest.fixture(scope='session')
+def redis_server():
+    """A fakeredis server standing in for Redis for the whole session."""
+    import fakeredis
+    import redis
+
+    server = fakeredis.FakeServer()
+
+    class FakeRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, **kwargs):
+            for name in ('host', 'port', 'db'):
+                kwargs.pop(name, None)
+            super().__init__(server=server, **kwargs)
+
+    redis.Redis = FakeRedis
+    redis.StrictRedis = FakeRedis
+    yield server
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def app(redis_server):
+    import main
+    return main.create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope='session')
+def admin_headers():
+    """Basic auth headers of the template's admin account."""
+    credentials = base64.b64encode(f'{ADMIN_USER}:{ADMIN_PASSWORD}'.encode()).decode()
+    return {'Authorization': f'Basic {credentials}'}
+
+
+@pytest.fixture(scope='session')
+def api_headers(app, admin_headers):
+    """Headers carrying a freshly issued API token."""
+    response = app.test_client().post('/admin/api/tokens', json={'description': 'tests'}, headers=admin_headers)
+    assert response.status_code == 201, response.get_data(as_text=True)
+    return {'X-API-Token': response.json['token']}
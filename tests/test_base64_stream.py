@@ -0,0 +1,97 @@
+"""
+The streaming Base64 decoder behind /Base64/decode/stream: 4-character
+alignment across chunks, padding and whitespace rules, and gzip request bodies.
+"""
+import base64
+import binascii
+import gzip
+import io
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from services.base64 import decode_base64_stream
+
+# Chunk sizes that split the input at every offset within a 4-character block
+CHUNK_SIZES = (1, 2, 3, 5, 7, 8192)
+
+
+def decode(data, chunk_size, max_size=1024 * 1024):
+    target = io.BytesIO()
+    written = decode_base64_stream(io.BytesIO(data), target, max_size, chunk_size)
+    assert written == len(target.getvalue())
+    return target.getvalue()
+
+
+def post(client, headers, body, extra_headers=None):
+    response = client.post('/Base64/decode/stream?filename=out.bin', data=body, content_type='text/plain',
+                           headers={**headers, **(extra_headers or {})})
+    response.get_data()
+    response.close()
+    return response
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('plain', [b'hello', b'hell', b'hel', bytes(range(256)) * 3])
+def test_round_trip_at_any_chunk_size(plain, chunk_size):
+    assert decode(base64.b64encode(plain), chunk_size) == plain
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_padding_split_across_chunks(chunk_size):
+    assert decode(b'aGVsbA==', chunk_size) == b'hell'
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_whitespace_is_ignored_also_after_padding(chunk_size):
+    assert decode(b'aGVs\r\nbG8=\n \t\n\n', chunk_size) == b'hello'
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('data', [
+    b'aGVsbG8=aGVsbG8=',  # padding in the middle of the stream
+    b'aGVsbA==\naGVs',    # data after padding and a line break
+    b'aGVsbA=',           # incomplete final block
+    b'aGVsbA=x=',         # discontinuous padding
+    b'aGVs*G8=',          # not in the Base64 alphabet
+])
+def test_invalid_input_is_rejected(data, chunk_size):
+    with pytest.raises(binascii.Error):
+        decode(data, chunk_size)
+
+
+def test_body_over_max_size_is_rejected():
+    with pytest.raises(RequestEntityTooLarge):
+        decode(base64.b64encode(b'x' * 300), 64, max_size=100)
+
+
+def test_endpoint_decodes_body(client, api_headers):
+    response = post(client, api_headers, base64.b64encode(b'hello world'))
+
+    assert response.status_code == 200
+    assert response.data == b'hello world'
+    assert 'out.bin' in response.headers['Content-Disposition']
+
+
+def test_endpoint_rejects_padding_in_the_middle(client, api_headers):
+    response = post(client, api_headers, b'aGVsbG8=aGVsbG8=')
+
+    assert response.status_code == 400
+    assert response.json['message'] == 'Invalid Base64 content'
+
+
+def test_endpoint_rejects_empty_body(client, api_headers):
+    response = post(client, api_headers, b'\n\n')
+
+    assert response.status_code == 400
+    assert response.json['message'] == 'No Base64 content provided'
+
+
+def test_endpoint_decodes_gzip_body(client, api_headers):
+    plain = bytes(range(256)) * 100
+    body = gzip.compress(base64.encodebytes(plain))
+
+    response = post(client, api_headers, body, {'Content-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert response.data == plain
@@ -0,0 +1,146 @@
+"""
+gzip request bodies (inflated on demand and bounded by the endpoint's upload
+limit) and gzip responses (sync-flushed per chunk when streamed).
+"""
+import base64
+import gzip
+import io
+import json
+import zlib
+
+from config import Config
+from services.compression import GZIP_WBITS, CompressionMiddleware
+
+
+def decode_stream(client, headers, body, content_encoding='gzip'):
+    response = client.post('/Base64/decode/stream?filename=out.bin', data=body, content_type='text/plain',
+                           headers={**headers, 'Content-Encoding': content_encoding})
+    response.get_data()
+    response.close()
+    return response
+
+
+def call(middleware, environ=None):
+    """Run a WSGI app through `middleware`; returns the status, headers and body chunks."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started.update(status=status, headers=dict(headers))
+
+    environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip', **(environ or {})}
+    chunks = list(middleware(environ, start_response))
+    return started['status'], started['headers'], chunks
+
+
+def ndjson_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'application/x-ndjson')])
+    return (json.dumps({'line': n}).encode() + b'\n' for n in range(5))
+
+
+def test_gzip_body_is_inflated(client, api_headers):
+    response = decode_stream(client, api_headers, gzip.compress(base64.b64encode(b'hello')))
+
+    assert response.status_code == 200
+    assert response.data == b'hello'
+
+
+def test_concatenated_gzip_members_are_inflated(client, api_headers):
+    body = gzip.compress(b'aGVs') + gzip.compress(b'bG8=')
+
+    response = decode_stream(client, api_headers, body)
+
+    assert response.status_code == 200
+    assert response.data == b'hello'
+
+
+def test_truncated_gzip_body_is_rejected(client, api_headers):
+    body = gzip.compress(base64.b64encode(b'x' * 1000))
+
+    response = decode_stream(client, api_headers, body[:len(body) // 2])
+
+    assert response.status_code == 400
+    assert 'truncated' in response.json['message']
+
+
+def test_trailing_garbage_is_rejected(client, api_headers):
+    body = gzip.compress(base64.b64encode(b'hello')) + b'not gzip'
+
+    response = decode_stream(client, api_headers, body)
+
+    assert response.status_code == 400
+    assert 'not valid gzip' in response.json['message']
+
+
+def test_inflated_size_over_upload_limit_is_rejected(client, api_headers, monkeypatch):
+    monkeypatch.setattr(Config, 'MAX_STREAM_DECODE_SIZE', 64 * 1024)
+    # About 1 MB of Base64 text compressing to about 1 KB
+    body = gzip.compress(b'A' * (1024 * 1024))
+    assert len(body) < Config.MAX_STREAM_DECODE_SIZE
+
+    response = decode_stream(client, api_headers, body)
+
+    assert response.status_code == 413
+
+
+def test_unsupported_content_encoding_is_rejected(client, api_headers):
+    response = decode_stream(client, api_headers, b'aGVsbG8=', content_encoding='br')
+
+    assert response.status_code == 415
+    assert response.headers['Accept-Encoding'] == 'gzip'
+    assert 'not supported' in response.json['message']
+
+
+def test_streamed_response_is_flushed_per_chunk():
+    status, headers, chunks = call(CompressionMiddleware(ndjson_app))
+
+    assert status == '200 OK'
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    # Each chunk inflates to the complete line it carries, without waiting for the next one
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    lines = [decompressor.decompress(chunk) for chunk in chunks[:-1]]
+    assert lines == [json.dumps({'line': n}).encode() + b'\n' for n in range(5)]
+    assert decompressor.decompress(chunks[-1]) == b''
+    assert decompressor.eof
+
+
+def test_response_with_length_is_compressed_whole():
+    body = b'x' * 4096
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/csv'), ('Content-Length', str(len(body)))])
+        return [body[:2048], body[2048:]]
+
+    status, headers, chunks = call(CompressionMiddleware(app))
+
+    assert 'Content-Length' not in headers
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(b''.join(chunks)) == body
+    # Without sync flushes the repetitive body compresses to a few dozen bytes
+    assert len(b''.join(chunks)) < 100
+
+
+def test_small_and_binary_responses_are_not_compressed():
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', environ['test.type']), ('Content-Length', '2')])
+        return [b'{}']
+
+    _, json_headers, _ = call(CompressionMiddleware(app, min_size=1024), {'test.type': 'application/json'})
+    _, xlsx_headers, _ = call(CompressionMiddleware(app, min_size=1), {'test.type': 'application/zip'})
+
+    assert 'Content-Encoding' not in json_headers
+    assert json_headers['Vary'] == 'Accept-Encoding'
+    assert 'Content-Encoding' not in xlsx_headers
+
+
+def test_endpoint_ndjson_is_gzipped(client, api_headers):
+    response = client.post('/Base64/encode/batch', headers={**api_headers, 'Accept-Encoding': 'gzip'},
+                           data={'bizDoc': [(io.BytesIO(b'a' * 2000), 'a.txt'), (io.BytesIO(b'b' * 2000), 'b.txt')]},
+                           content_type='multipart/form-data')
+    body = response.get_data()
+    response.close()
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+    assert [line.get('filename') for line in lines] == ['a.txt', 'b.txt']
@@ -0,0 +1,102 @@
+"""
+The SQLite credential store and the change detection workers rely on to drop
+cached token verifications.
+"""
+import pytest
+
+from auth import store as store_module
+from auth.store import SqliteStore
+from config import ApiToken
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'credentials.db')
+
+
+@pytest.fixture
+def changes(db_path):
+    """Two stores on one database, as in two workers; returns (writer, reader, change callback calls)."""
+    writer, reader = SqliteStore(db_path), SqliteStore(db_path)
+    calls = []
+    reader.on_change(lambda: calls.append(True))
+    return writer, reader, calls
+
+
+def test_tokens_round_trip(db_path):
+    store = SqliteStore(db_path)
+    token = ApiToken(description='reports', rate_limit_per_minute=60, daily_byte_quota=1000)
+
+    assert store.add_token('fp1', token)
+    assert not store.add_token('fp2', ApiToken(description='reports'))
+    assert store.get_token('fp1') == token
+    assert store.tokens() == {'fp1': token}
+
+    assert store.rekey_token('fp1', 'fp3') == token
+    assert store.get_token('fp1') is None
+    assert store.rekey_token('fp1', 'fp4') is None
+
+    assert store.delete_token('fp3')
+    assert not store.delete_token('fp3')
+    assert store.tokens() == {}
+
+
+def test_last_used_only_moves_forward(db_path):
+    store = SqliteStore(db_path)
+    store.add_token('fp', ApiToken(description='reports'))
+
+    store.record_last_used({'fp': '2025-01-02T00:00:00+00:00', 'unknown': '2025-01-02T00:00:00+00:00'})
+    store.record_last_used({'fp': '2025-01-01T00:00:00+00:00'})
+
+    assert store.get_token('fp').last_used == '2025-01-02T00:00:00+00:00'
+
+
+def test_changes_by_another_worker_are_detected(changes):
+    writer, reader, calls = changes
+    assert reader.check_for_changes(force=True) is False
+
+    writer.add_token('fp', ApiToken(description='reports'))
+    assert reader.check_for_changes(force=True) is True
+    assert calls == [True]
+
+    writer.delete_token('fp')
+    assert reader.check_for_changes(force=True) is True
+    assert reader.get_token('fp') is None
+    assert len(calls) == 2
+
+
+def test_last_used_updates_are_not_changes(changes):
+    writer, reader, calls = changes
+    writer.add_token('fp', ApiToken(description='reports'))
+    reader.check_for_changes(force=True)
+
+    writer.record_last_used({'fp': '2025-01-02T00:00:00+00:00'})
+
+    assert reader.check_for_changes(force=True) is False
+    assert len(calls) == 1
+
+
+def test_checks_are_rate_limited(changes, monkeypatch):
+    writer, reader, calls = changes
+    reader.check_for_changes(force=True)
+    monkeypatch.setattr(store_module, 'CHANGE_CHECK_INTERVAL', 3600)
+
+    writer.add_token('fp', ApiToken(description='reports'))
+
+    assert reader.check_for_changes() is False
+    assert reader.check_for_changes(force=True) is True
+
+
+def test_import_and_export(db_path):
+    store = SqliteStore(db_path)
+    store.set_admin_password('admin', 'hash')
+    data = {
+        'API_TOKENS': {'fp': {'description': 'reports', 'last_used': None}},
+        'ADMIN_CREDENTIALS': {'ops': 'hash2'},
+    }
+
+    assert store.import_data(data) == (1, 1)
+    assert store.admin_credentials() == {'admin': 'hash', 'ops': 'hash2'}
+    assert store.import_data(data, replace=True) == (1, 1)
+    assert store.admin_credentials() == {'ops': 'hash2'}
+    assert store.export_data()['API_TOKENS']['fp']['description'] == 'reports'
@@ -0,0 +1,101 @@
+import io
+import os
+import time
+import uuid
+
+from openpyxl import load_workbook
+
+from services import csv_jobs
+
+CSV_BODY = b'id;name;amount\n' + b''.join(b'%d;row %d;%d.50\n' % (i, i, i) for i in range(1, 51))
+
+
+def submit(client, headers, data, filename='report.csv'):
+    response = client.post('/csv2xls/jobs', headers=headers,
+                           data={'file': (io.BytesIO(data), filename)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 202, response.get_data(as_text=True)
+    return response
+
+
+def wait_for(client, headers, location, timeout=30):
+    """Poll a job until it leaves the queued/running states; returns the last response."""
+    deadline = time.monotonic() + timeout
+    while True:
+        response = client.get(location, headers=headers)
+        if response.status_code != 200 or not response.is_json \
+                or response.json['status'] not in (csv_jobs.STATUS_QUEUED, csv_jobs.STATUS_RUNNING):
+            return response
+        assert time.monotonic() < deadline, 'job did not finish in time'
+        time.sleep(0.05)
+
+
+def test_job_runs_and_result_downloads(client, api_headers):
+    submitted = submit(client, api_headers, CSV_BODY)
+    body = submitted.json
+    assert body['status'] == csv_jobs.STATUS_QUEUED
+    assert submitted.headers['Location'] == body['location']
+    assert csv_jobs.is_valid_job_id(body['job_id'])
+
+    response = wait_for(client, api_headers, body['location'])
+    assert response.status_code == 200
+    assert response.mimetype == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    assert 'report.xlsx' in response.headers['Content-Disposition']
+
+    worksheet = load_workbook(io.BytesIO(response.data), read_only=True).active
+    rows = list(worksheet.values)
+    assert rows[0] == ('id', 'name', 'amount')
+    assert len(rows) == 51
+
+
+def test_failed_job_reports_message(client, api_headers):
+    body = submit(client, api_headers, b'\n\n', filename='empty.csv').json
+
+    response = wait_for(client, api_headers, body['location'])
+    assert response.status_code == 200
+    assert response.json['status'] == csv_jobs.STATUS_FAILED
+    assert 'empty' in response.json['message']
+    assert not os.path.exists(csv_jobs.result_path(body['job_id']))
+
+
+def test_job_is_private_to_its_token(client, api_headers, app):
+    from auth.auth import hash_api_token
+    from auth.store import get_store
+    from config import ApiToken
+
+    body = submit(client, api_headers, CSV_BODY).json
+    wait_for(client, api_headers, body['location'])
+    other_token = 'other-' + uuid.uuid4().hex
+    get_store().add_token(hash_api_token(other_token), ApiToken(description='other'))
+
+    assert client.get(body['location'], headers={'X-API-Token': other_token}).status_code == 404
+    assert client.get('/csv2xls/jobs/not-a-job-id', headers=api_headers).status_code == 404
+
+
+def test_job_status_and_result_expire(client, api_headers, app, redis_server):
+    body = submit(client, api_headers, CSV_BODY).json
+    job_id = body['job_id']
+    assert wait_for(client, api_headers, body['location']).status_code == 200
+
+    # The status record expires with the TTL ...
+    store = csv_jobs.JobStore(app.config['SESSION_REDIS'], ttl=1)
+    store.update(job_id, status=csv_jobs.STATUS_DONE)
+    time.sleep(1.2)
+    assert store.get(job_id) is None
+    assert client.get(body['location'], headers=api_headers).status_code == 404
+
+    # ... and the result directory is removed once it is older than the TTL
+    assert os.path.isdir(csv_jobs.job_dir(job_id))
+    csv_jobs.cleanup_expired_results(now=time.time() + 365 * 24 * 3600)
+    assert not os.path.exists(csv_jobs.job_dir(job_id))
+
+
+def test_job_store_round_trip(app):
+    store = csv_jobs.JobStore(app.config['SESSION_REDIS'], ttl=60)
+    job_id = uuid.uuid4().hex
+    store.create(job_id, status=csv_jobs.STATUS_QUEUED, sheets_total=2, message=None)
+    store.update(job_id, sheets_done=1)
+
+    assert store.get(job_id) == {'status': 'queued', 'sheets_total': '2', 'message': '', 'sheets_done': '1'}
+    assert 0 < app.config['SESSION_REDIS'].ttl(csv_jobs.JOB_KEY_PREFIX + job_id) <= 60
+    assert store.get(uuid.uuid4().hex) is None
@@ -0,0 +1,81 @@
+"""
+Per-token daily byte quotas, including bodies sent without a Content-Length,
+which are charged by the bytes actually read once the request ends.
+"""
+import base64
+import gzip
+import io
+import uuid
+
+import pytest
+
+PAYLOAD = base64.b64encode(b'x' * 3000)  # 4000 bytes of Base64
+
+
+@pytest.fixture
+def quota_token(client, admin_headers):
+    """An API token with a daily quota of 100 request bytes; returns (headers, fingerprint)."""
+    from auth.auth import hash_api_token
+
+    response = client.post('/admin/api/tokens', headers=admin_headers,
+                           json={'description': f'quota-{uuid.uuid4().hex}', 'daily_byte_quota': 100})
+    assert response.status_code == 201
+    token = response.json['token']
+    return {'X-API-Token': token}, hash_api_token(token)
+
+
+def bytes_today(client, admin_headers, fingerprint):
+    return client.get('/admin/api/tokens', headers=admin_headers).json['tokens'][fingerprint]['usage']['bytes_today']
+
+
+def decode_stream(client, headers, body, extra_headers=None, chunked=True):
+    """POST to /Base64/decode/stream; chunked bodies carry no Content-Length."""
+    options = {}
+    if chunked:
+        options = {
+            'input_stream': io.BytesIO(body),
+            # Like a server passing a chunked body through: no length, read to EOF
+            'environ_overrides': {'CONTENT_LENGTH': '', 'wsgi.input_terminated': True},
+        }
+        extra_headers = {'Transfer-Encoding': 'chunked', **(extra_headers or {})}
+    else:
+        options = {'data': body}
+    response = client.post('/Base64/decode/stream?filename=x.bin', headers={**headers, **(extra_headers or {})},
+                           content_type='text/plain', **options)
+    response.get_data()
+    response.close()
+    return response
+
+
+def test_declared_length_over_quota_is_rejected(client, admin_headers, quota_token):
+    headers, fingerprint = quota_token
+
+    response = decode_stream(client, headers, PAYLOAD, chunked=False)
+
+    assert response.status_code == 429
+    assert 'quota' in response.json['message']
+    assert bytes_today(client, admin_headers, fingerprint) == 0
+
+
+def test_chunked_body_is_charged_by_bytes_read(client, admin_headers, quota_token):
+    headers, fingerprint = quota_token
+
+    first = decode_stream(client, headers, PAYLOAD)
+    assert first.status_code == 200
+    assert first.data == b'x' * 3000
+    assert bytes_today(client, admin_headers, fingerprint) == len(PAYLOAD)
+
+    # The quota is used up, so the next chunked upload is refused before it is read
+    second = decode_stream(client, headers, PAYLOAD)
+    assert second.status_code == 429
+    assert bytes_today(client, admin_headers, fingerprint) == len(PAYLOAD)
+
+
+def test_chunked_gzip_body_is_charged_compressed(client, admin_headers, quota_token):
+    headers, fingerprint = quota_token
+    body = gzip.compress(PAYLOAD)
+
+    response = decode_stream(client, headers, body, {'Content-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert bytes_today(client, admin_headers, fingerprint) == len(body)
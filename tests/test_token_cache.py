@@ -0,0 +1,160 @@
+"""
+API token verification through the token cache: revocation across workers
+(Redis pub/sub and the shared tier), changes made by other workers in the
+credential store, and the migration of legacy werkzeug hashes.
+"""
+import secrets
+import threading
+import time
+import uuid
+
+import pytest
+import redis
+from werkzeug.security import generate_password_hash
+
+from auth import auth
+from auth.rate_limit import TokenLimits
+from auth.store import get_store
+from auth.token_cache import SHARED_KEY_PREFIX, TokenCache
+from config import ApiToken, update_settings
+
+LIMITS = TokenLimits(None, None, None)
+
+
+@pytest.fixture
+def issue_token(client, admin_headers):
+    """Create API tokens through the admin API; returns (token, fingerprint)."""
+    def issue():
+        response = client.post('/admin/api/tokens', headers=admin_headers,
+                               json={'description': f'cache-{uuid.uuid4().hex}'})
+        assert response.status_code == 201
+        token = response.json['token']
+        return token, auth.hash_api_token(token)
+    return issue
+
+
+@pytest.fixture
+def shared_cache(app, monkeypatch):
+    """Use the shared tier in this worker's cache; yields a second cache on the same Redis, as another worker."""
+    monkeypatch.setattr(auth.token_cache, 'shared', True)
+    other = TokenCache(shared=True)
+    revoked = []
+    event = threading.Event()
+    other.on_revocation(lambda fingerprint: (revoked.append(fingerprint), event.set()))
+    other.attach_redis(redis.Redis())
+    other.revoked, other.revoked_event = revoked, event
+    # Wait for its revocation listener to subscribe
+    wait_until(lambda: redis.Redis().pubsub_numsub('api_toolbox:token-revocations')[0][1] >= 2)
+    return other
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not met in time'
+        time.sleep(0.02)
+
+
+def ping(client, token):
+    return client.get('/Status/ping', headers={'X-API-Token': token}).status_code
+
+
+def test_revoked_token_is_rejected(client, admin_headers, issue_token):
+    token, fingerprint = issue_token()
+    assert ping(client, token) == 200
+    assert auth.token_cache.get(fingerprint) is not None
+
+    response = client.delete(f'/admin/api/tokens/{fingerprint}', headers=admin_headers)
+
+    assert response.status_code == 200
+    assert auth.token_cache.get(fingerprint) is None
+    assert ping(client, token) == 401
+
+
+def test_revocation_reaches_other_workers(client, admin_headers, issue_token, shared_cache):
+    token, fingerprint = issue_token()
+    assert ping(client, token) == 200
+    # The other worker finds the verification in the shared tier
+    assert shared_cache.get(fingerprint).description == get_store().get_token(fingerprint).description
+
+    client.delete(f'/admin/api/tokens/{fingerprint}', headers=admin_headers)
+
+    assert shared_cache.revoked_event.wait(5)
+    assert fingerprint in shared_cache.revoked
+    assert shared_cache.get(fingerprint) is None
+    assert not redis.Redis().exists(SHARED_KEY_PREFIX + fingerprint)
+    assert ping(client, token) == 401
+
+
+def test_revocation_from_another_worker_is_applied(client, issue_token, shared_cache):
+    token, fingerprint = issue_token()
+    assert ping(client, token) == 200
+
+    # Another worker deletes the token and broadcasts the revocation
+    get_store().delete_token(fingerprint)
+    shared_cache.invalidate(fingerprint)
+
+    wait_until(lambda: auth.token_cache.get(fingerprint) is None)
+    assert ping(client, token) == 401
+
+
+def test_token_deleted_in_the_store_by_another_worker_is_rejected(client, issue_token, monkeypatch):
+    token, fingerprint = issue_token()
+    assert ping(client, token) == 200
+
+    # Another worker removed it from settings.json without a broadcast
+    update_settings(lambda settings_data: settings_data['API_TOKENS'].pop(fingerprint))
+    get_store().check_for_changes(force=True)
+
+    assert auth.token_cache.get(fingerprint) is None
+    assert ping(client, token) == 401
+
+
+def test_last_used_flush_keeps_cached_tokens(client, issue_token):
+    token, fingerprint = issue_token()
+    assert ping(client, token) == 200
+
+    auth.last_used_recorder.flush()
+
+    assert get_store().check_for_changes(force=True) is False
+    assert auth.token_cache.get(fingerprint) is not None
+
+
+def test_legacy_token_is_migrated_on_first_use(client):
+    token = secrets.token_urlsafe(32)
+    legacy_hash = generate_password_hash(token)
+    assert auth.is_legacy_token_hash(legacy_hash)
+    store = get_store()
+    store.add_token(legacy_hash, ApiToken(description=f'legacy-{uuid.uuid4().hex}'))
+
+    assert ping(client, token) == 200
+
+    fingerprint = auth.hash_api_token(token)
+    assert fingerprint.startswith(auth.API_TOKEN_HASH_PREFIX)
+    assert store.get_token(legacy_hash) is None
+    assert store.get_token(fingerprint) is not None
+    # Later requests find the token by its fingerprint
+    auth.token_cache.clear()
+    assert ping(client, token) == 200
+    assert ping(client, 'not-a-token') == 401
+
+
+def test_cache_entries_expire():
+    cache = TokenCache(ttl=0.05)
+    cache.set('fp', 'description', LIMITS)
+    assert cache.get('fp').description == 'description'
+
+    time.sleep(0.1)
+
+    assert cache.get('fp') is None
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TokenCache(max_entries=2)
+    cache.set('a', 'a', LIMITS)
+    cache.set('b', 'b', LIMITS)
+    cache.get('a')
+    cache.set('c', 'c', LIMITS)
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
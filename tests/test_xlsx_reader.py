@@ -0,0 +1,103 @@
+"""
+Round trips through the streaming reader behind /xls2csv. services/xlsx_reader.py
+extends openpyxl's read-only worksheet and reader classes (hence the exact
+openpyxl pin in requirements.txt); these tests feed it workbooks written by
+openpyxl and by the CSV to XLS writer.
+"""
+import io
+import zipfile
+from datetime import datetime
+
+from openpyxl import Workbook
+from werkzeug.datastructures import FileStorage
+
+from services.xlsx_reader import close_workbook, load_streaming_workbook
+from services.xlsx_writer import SheetJob, build_workbook
+
+
+def openpyxl_workbook():
+    """A workbook with a <dimension> element, a typed row and two sheets."""
+    wb = Workbook()
+    orders = wb.active
+    orders.title = 'Orders'
+    orders.append(['id', 'amount', 'day', 'paid'])
+    orders.append([1, 2.5, datetime(2024, 4, 3), True])
+    orders.append([2, 3.0, datetime(2024, 4, 3, 12, 30), False])
+    wb.create_sheet('Notes').append(['a;b', 'line\nbreak'])
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def written_workbook():
+    """A workbook from the CSV to XLS writer, whose sheets have no leading <dimension>."""
+    output = io.BytesIO()
+    csv_data = b'n;name\n' + b''.join(b'%d;row %d\n' % (n, n) for n in range(1, 2001))
+    build_workbook([SheetJob(FileStorage(io.BytesIO(csv_data), filename='rows.csv'), 'rows.csv', 'Blad1', 1)],
+                   ';', output, table_style='TableStyleMedium2')
+    return output.getvalue()
+
+
+def convert(client, headers, data, **form):
+    """POST to /xls2csv and read the streamed body, which frees the heavy request slot."""
+    form['file'] = (io.BytesIO(data), 'book.xlsx')
+    response = client.post('/xls2csv', headers=headers, data=form, content_type='multipart/form-data')
+    response.get_data()
+    response.close()
+    return response
+
+
+def test_streaming_reader_reads_rows_and_sizes():
+    stream = io.BytesIO(openpyxl_workbook())
+    wb = load_streaming_workbook(stream)
+    try:
+        assert wb.sheetnames == ['Orders', 'Notes']
+        orders = wb['Orders']
+        assert (orders.max_row, orders.max_column) == (3, 4)
+        assert list(orders.iter_rows(values_only=True))[1] == (1, 2.5, datetime(2024, 4, 3), True)
+    finally:
+        close_workbook(wb, stream)
+    assert stream.closed
+
+
+def test_streaming_reader_reads_writer_output():
+    stream = io.BytesIO(written_workbook())
+    wb = load_streaming_workbook(stream)
+    try:
+        rows = list(wb.active.iter_rows(values_only=True))
+    finally:
+        close_workbook(wb, stream)
+    assert rows[0] == ('n', 'name')
+    assert rows[-1] == ('2000', 'row 2000')
+    assert len(rows) == 2001
+
+
+def test_first_sheet_converts_to_csv(client, api_headers):
+    response = convert(client, api_headers, openpyxl_workbook())
+
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.mimetype == 'text/csv'
+    assert 'book.csv' in response.headers['Content-Disposition']
+    assert response.get_data(as_text=True) == (
+        'id;amount;day;paid\r\n'
+        '1;2.5;2024-04-03;TRUE\r\n'
+        '2;3;2024-04-03 12:30:00;FALSE\r\n'
+    )
+
+
+def test_all_sheets_convert_to_zip(client, api_headers):
+    response = convert(client, api_headers, openpyxl_workbook(), all_sheets='true', separator='comma')
+
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert response.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ['Orders.csv', 'Notes.csv']
+        assert archive.read('Orders.csv').startswith(b'id,amount,day,paid\r\n')
+        assert archive.read('Notes.csv') == b'a;b,"line\nbreak"\r\n'
+
+
+def test_unknown_sheet_lists_available_sheets(client, api_headers):
+    response = convert(client, api_headers, openpyxl_workbook(), sheet='Missing')
+
+    assert response.status_code == 400
+    assert 'Orders, Notes' in response.json['message']
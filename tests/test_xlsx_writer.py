@@ -0,0 +1,80 @@
+"""
+Round trips through the workbook writer. services/xlsx_writer.py assembles
+workbooks from separately rendered worksheet parts using openpyxl internals
+(hence the exact openpyxl pin in requirements.txt); these tests read the
+result back with openpyxl to catch an upgrade that breaks the assembly.
+"""
+import gzip
+import io
+from datetime import datetime
+
+from openpyxl import load_workbook
+from werkzeug.datastructures import FileStorage
+
+from services import xlsx_writer
+from services.csv_types import TypeInference
+from services.xlsx_writer import SheetJob, build_workbook
+
+SALES_CSV = 'id;amount;day;active\n1;1,5;03.04.2024;true\n2;22,25;2024-05-06;false\n'.encode('utf-8')
+NAMES_CSV = 'name;city\nÅsa;Malmö\nBo;Umeå\n'.encode('utf-8')
+
+
+def sheet_job(data, filename, title, table_index=None):
+    return SheetJob(FileStorage(io.BytesIO(data), filename=filename), filename, title, table_index)
+
+
+def build(sheet_jobs, **options):
+    output = io.BytesIO()
+    build_workbook(sheet_jobs, ';', output, **options)
+    output.seek(0)
+    return load_workbook(output)
+
+
+def test_sheets_are_assembled_in_order_with_tables():
+    wb = build(
+        [sheet_job(SALES_CSV, 'sales.csv', 'Blad1', 1), sheet_job(NAMES_CSV, 'names.csv', 'Blad2', 2)],
+        table_style='TableStyleMedium9', author='tests', title='Report',
+    )
+
+    assert wb.sheetnames == ['Blad1', 'Blad2']
+    assert wb.properties.creator == 'tests'
+    assert wb.properties.title == 'Report'
+    assert [list(row) for row in wb['Blad2'].values] == [['name', 'city'], ['Åsa', 'Malmö'], ['Bo', 'Umeå']]
+
+    tables = [(ws.title, table.name, table.ref, table.tableStyleInfo.name)
+              for ws in wb.worksheets for table in ws.tables.values()]
+    assert tables == [
+        ('Blad1', 'Blad1_1', 'A1:D3', 'TableStyleMedium9'),
+        ('Blad2', 'Blad2_2', 'A1:B3', 'TableStyleMedium9'),
+    ]
+    assert wb['Blad1'].column_dimensions['B'].width > 0
+
+
+def test_typed_cells_and_number_formats():
+    wb = build([sheet_job(SALES_CSV, 'sales.csv', 'Blad1')], type_inference=TypeInference.for_lang('SV'))
+
+    rows = list(wb['Blad1'].values)
+    assert rows[0] == ('id', 'amount', 'day', 'active')
+    assert rows[1] == (1, 1.5, datetime(2024, 4, 3), True)
+    assert rows[2] == (2, 22.25, datetime(2024, 5, 6), False)
+    assert wb['Blad1']['C2'].is_date
+
+
+def test_long_csv_continues_on_extra_sheets(monkeypatch):
+    monkeypatch.setattr(xlsx_writer, 'EXCEL_MAX_ROWS', 4)
+    csv_data = b'n;square\n' + b''.join(b'%d;%d\n' % (n, n * n) for n in range(1, 8))
+
+    wb = build([sheet_job(csv_data, 'long.csv', 'Blad1', 1)], table_style='TableStyleMedium2')
+
+    assert wb.sheetnames == ['Blad1', 'Blad1 (2)', 'Blad1 (3)']
+    # Every continuation sheet repeats the header row
+    assert [row[0] for ws in wb.worksheets for row in ws.values] == ['n', '1', '2', '3', 'n', '4', '5', '6', 'n', '7']
+    assert [(table.name, table.ref) for ws in wb.worksheets for table in ws.tables.values()] == [
+        ('Blad1_1', 'A1:B4'), ('Blad12_1', 'A1:B4'), ('Blad13_1', 'A1:B2'),
+    ]
+
+
+def test_gzip_upload_matches_plain_upload():
+    plain = build([sheet_job(NAMES_CSV, 'names.csv', 'Blad1')])
+    compressed = build([sheet_job(gzip.compress(NAMES_CSV), 'names.csv.gz', 'Blad1')])
+    assert list(plain['Blad1'].values) == list(compressed['Blad1'].values)